@@ -1,7 +1,6 @@
 import time
-import asyncio
 
-from pmg_lammps.calculator import LammpsCalculator
+from pmg_lammps.calculator import LammpsExecutor
 
 
 script = [
@@ -29,19 +28,19 @@ script = [
 ]
 
 
-async def main(loop):
-    lammps_calculator = LammpsCalculator(cwd='/home/costrouc/scratch/python/asyncio-process/simple', max_workers=2, cmd=['lammps_serial'])
-    await lammps_calculator._create()
+def main():
+    with open('initial.data') as f:
+        files = {'initial.data': f.read()}
 
+    num_jobs = 10000
     start = time.time()
-    lammps_futures = []
-    for i in range(10000):
-        future = await lammps_calculator.submit(script)
-        lammps_futures.append(future)
-    results = await asyncio.gather(*lammps_futures)
+    # identical jobs would otherwise be coalesced into a single run
+    with LammpsExecutor(command='lammps_serial', num_workers=2, deduplicate=False, max_pending_jobs=64) as executor:
+        results = list(executor.map(
+            [script] * num_jobs, [files] * num_jobs, [{'energy', 'stress', 'forces'}] * num_jobs,
+            chunksize=32))
     print('total time: ', time.time() - start)
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main(loop))
+    main()
@@ -0,0 +1,356 @@
+""" Benchmark suite of the parsers, writers, analysis and calculator
+
+Benchmarks are registered with the `benchmark` decorator. A benchmark
+is a generator function taking a scratch directory and its parameters
+(the defaults given to the decorator) that prepares its inputs and
+yields the operation to time. The operation returns the number of
+items processed (e.g. atoms) or a dict with `items` and further
+per call metrics (e.g. seconds of overhead, failed jobs). Code after
+the yield cleans up. Calculator benchmarks run the mock lammps
+(`pmg_lammps.calculator.mock`) unless a lammps `command` is given.
+
+>>> results = run_suite(['dump.parse'], params={'atoms': 10000})
+>>> regressions = compare(results, baseline, threshold=0.1)
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import platform
+import tempfile
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+
+BENCHMARKS = OrderedDict()
+PERCENTILES = [50, 90, 99]
+RESULTS_VERSION = 1
+
+
+class SkipBenchmark(Exception):
+    """ Raised by benchmarks that cannot run here (missing programs) """
+
+
+def benchmark(name, **params):
+    """ Register a benchmark with default parameters """
+    def decorator(function):
+        BENCHMARKS[name] = (function, params)
+        return function
+    return decorator
+
+
+def benchmark_key(name, params):
+    """ Name of a benchmark result e.g. dump.parse[atoms=1000,frames=10] """
+    return name + '[' + ','.join(f'{key}={value}' for key, value in sorted(params.items())) + ']'
+
+
+def summarize(values):
+    """ Min, mean, max and percentiles of values """
+    values = np.asarray(values, dtype=float)
+    summary = {'min': float(values.min()), 'mean': float(values.mean()), 'max': float(values.max())}
+    for percentile in PERCENTILES:
+        summary[f'p{percentile}'] = float(np.percentile(values, percentile))
+    return summary
+
+
+def run_benchmark(name, repeats=10, warmup=1, **params):
+    """ Time `repeats` calls of a benchmark after `warmup` calls
+
+    Returns the parameters, latency percentiles [sec], throughput
+    [items/sec] and the percentiles of extra metrics. Benchmarks that
+    cannot run (raising `SkipBenchmark`, e.g. for missing optional
+    dependencies) have `skipped` set to the reason.
+    """
+    function, defaults = BENCHMARKS[name]
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ValueError(f'unknown parameters {sorted(unknown)} of benchmark {name}')
+    params = dict(defaults, **params)
+    result = {'name': name, 'params': params, 'repeats': repeats}
+
+    directory = tempfile.mkdtemp(prefix='pmg-lammps-benchmark-')
+    try:
+        generator = function(directory, **params)
+        try:
+            operation = next(generator)
+        except SkipBenchmark as error:
+            result['skipped'] = str(error)
+            return result
+
+        latencies, items, metrics = [], 0, {}
+        try:
+            for index in range(warmup + repeats):
+                start_time = time.perf_counter()
+                value = operation()
+                latency = time.perf_counter() - start_time
+                if index < warmup:
+                    continue
+                latencies.append(latency)
+                if isinstance(value, dict):
+                    value = dict(value)
+                    items += value.pop('items', 1)
+                    for key, metric in value.items():
+                        metrics.setdefault(key, []).append(metric)
+                else:
+                    items += 1 if value is None else value
+        finally:
+            generator.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    result['latency'] = summarize(latencies)
+    result['throughput'] = items / sum(latencies) if sum(latencies) > 0 else None
+    result['metrics'] = {key: summarize(values) for key, values in metrics.items()}
+    return result
+
+
+def run_suite(names=None, params=None, repeats=10, warmup=1):
+    """ Run benchmarks (default all) for every combination of parameters
+
+    `params` maps parameter names to a value or a list of values and
+    applies to the benchmarks having that parameter.
+    """
+    names = names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f'unknown benchmark {name} must be one of {list(BENCHMARKS)}')
+    results = OrderedDict()
+    for name in names:
+        _, defaults = BENCHMARKS[name]
+        grid = OrderedDict()
+        for key, value in (params or {}).items():
+            if key in defaults:
+                grid[key] = value if isinstance(value, (list, tuple)) else [value]
+        for values in itertools.product(*grid.values()):
+            result = run_benchmark(name, repeats=repeats, warmup=warmup, **dict(zip(grid, values)))
+            results[benchmark_key(name, result['params'])] = result
+    return {
+        'version': RESULTS_VERSION,
+        'created': time.time(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'benchmarks': results,
+    }
+
+
+def save_results(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=4)
+
+
+def load_results(filename):
+    with open(filename) as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError(f'unsupported benchmark results version {results.get("version")}')
+    return results
+
+
+def compare(results, baseline, threshold=0.1, statistic='p50'):
+    """ Benchmarks whose latency `statistic` grew by more than `threshold`
+    (a fraction) relative to the `baseline` results
+
+    Benchmarks measured in the baseline that are now skipped or missing
+    are regressions too (with `latency` None and the `reason`).
+    """
+    regressions = []
+    for key, reference in baseline['benchmarks'].items():
+        result = results['benchmarks'].get(key)
+        if 'latency' not in reference:
+            continue
+        elif result is None or 'latency' not in result:
+            reason = 'missing' if result is None else f'skipped: {result.get("skipped")}'
+            regressions.append({'name': key, 'baseline': reference['latency'][statistic], 'latency': None,
+                                'change': None, 'reason': reason})
+            continue
+        before, after = reference['latency'][statistic], result['latency'][statistic]
+        change = after / before - 1 if before > 0 else 0.0
+        if change > threshold:
+            regressions.append({'name': key, 'baseline': before, 'latency': after, 'change': change, 'reason': None})
+    return regressions
+
+
+def generate_structure(atoms, seed=0):
+    """ Random MgO like structure of `atoms` atoms at rock salt density """
+    from pymatgen import Lattice, Structure
+
+    random = np.random.RandomState(seed)
+    length = (atoms * 74.0 / 8) ** (1 / 3)
+    species = ['Mg' if index % 2 == 0 else 'O' for index in range(atoms)]
+    return Structure(Lattice.cubic(length), species, random.random_sample((atoms, 3)))
+
+
+def write_dump(filename, atoms, frames, seed=0):
+    random = np.random.RandomState(seed)
+    with open(filename, 'w') as f:
+        for frame in range(frames):
+            f.write(f'ITEM: TIMESTEP\n{frame * 100}\nITEM: NUMBER OF ATOMS\n{atoms}\n')
+            f.write('ITEM: BOX BOUNDS pp pp pp\n0.0 20.0\n0.0 20.0\n0.0 20.0\n')
+            f.write('ITEM: ATOMS id type x y z vx vy vz fx fy fz\n')
+            values = random.random_sample((atoms, 9))
+            for index in range(atoms):
+                f.write(f'{index + 1} {index % 2 + 1} ' + ' '.join('%.8f' % _ for _ in values[index]) + '\n')
+
+
+def write_log(filename, rows, runs=1, seed=0):
+    random = np.random.RandomState(seed)
+    columns = ['Step', 'TotEng', 'Pxx', 'Pyy', 'Pzz', 'Pxy', 'Pxz', 'Pyz']
+    with open(filename, 'w') as f:
+        f.write('LAMMPS (generated benchmark log)\n')
+        for _ in range(runs):
+            f.write('run {}\nPer MPI rank memory allocation (min/avg/max) = 1 | 1 | 1 Mbytes\n'.format(rows))
+            f.write(' '.join(columns) + '\n')
+            for step in range(rows):
+                f.write(f'{step} ' + ' '.join('%.6f' % _ for _ in random.random_sample(len(columns) - 1)) + '\n')
+            f.write(f'Loop time of 1.0 on 1 procs for {rows} steps with 1000 atoms\n\n')
+            f.write('Performance: 86.400 ns/day, 0.278 hours/ns, 1000.000 timesteps/s\n')
+            f.write('100.0% CPU use with 1 MPI tasks x no OpenMP threads\n\n')
+            f.write('Section |  min time  |  avg time  |  max time  |%varavg| %total\n')
+            for section in ['Pair', 'Kspace', 'Neigh', 'Comm', 'Output', 'Modify']:
+                f.write(f'{section:<8}| 0.1        | 0.1        | 0.1        |   0.0 | 16.67\n')
+            f.write('\nTotal # of neighbors = 1000\nNeighbor list builds = 0\nDangerous builds = 0\n')
+
+
+@benchmark('dump.parse', atoms=1000, frames=10)
+def dump_parse(directory, atoms, frames):
+    from .output import LammpsDump
+
+    filename = os.path.join(directory, 'mol.lammpstrj')
+    write_dump(filename, atoms, frames)
+
+    def parse():
+        LammpsDump(filename)
+        return atoms * frames
+    yield parse
+
+
+@benchmark('log.parse', rows=10000, runs=1)
+def log_parse(directory, rows, runs):
+    from .output import LammpsLog
+
+    filename = os.path.join(directory, 'lammps.log')
+    write_log(filename, rows, runs)
+
+    def parse():
+        LammpsLog(filename)
+        return rows * runs
+    yield parse
+
+
+@benchmark('data.parse', atoms=1000)
+def data_parse(directory, atoms):
+    from .inputs import LammpsData
+
+    filename = os.path.join(directory, 'initial.data')
+    LammpsData.from_structure(generate_structure(atoms)).write_file(filename)
+
+    def parse():
+        LammpsData.from_file(filename)
+        return atoms
+    yield parse
+
+
+@benchmark('data.write', atoms=1000)
+def data_write(directory, atoms):
+    from .inputs import LammpsData
+
+    filename = os.path.join(directory, 'initial.data')
+    lammps_data = LammpsData.from_structure(generate_structure(atoms))
+
+    def write():
+        lammps_data.write_file(filename)
+        return atoms
+    yield write
+
+
+@benchmark('data.from_structure', atoms=1000)
+def data_from_structure(directory, atoms):
+    from .inputs import LammpsData
+
+    structure = generate_structure(atoms)
+
+    def convert():
+        LammpsData.from_structure(structure)
+        return atoms
+    yield convert
+
+
+@benchmark('analysis.rdf', atoms=100, structures=1)
+def analysis_rdf(directory, atoms, structures):
+    try:
+        from .analysis import RadialDistributionFunction
+    except ImportError as error: # scipy and matplotlib are optional
+        raise SkipBenchmark(f'analysis dependencies missing: {error}')
+
+    _structures = [generate_structure(atoms, seed=seed) for seed in range(structures)]
+
+    def rdf():
+        RadialDistributionFunction(_structures, rmax=5.0, species=['Mg', 'O'])
+        return atoms * structures
+    yield rdf
+
+
+def _calculator_client(command, num_workers, delay=0.0, error_rate=0.0):
+    """ Started `LammpsLocalClient` and a small job, command 'mock' runs the mock lammps """
+    from .calculator import LammpsLocalClient
+    from .calculator.mock import mock_command
+    from .inputs import LammpsData
+
+    if command == 'mock':
+        command = mock_command(delay=delay, error_rate=error_rate, seed=0)
+    elif shutil.which(command) is None:
+        raise SkipBenchmark(f'lammps command {command} not found')
+
+    files = {'initial.data': str(LammpsData.from_structure(generate_structure(8)))}
+    script = '\n'.join([
+        'log lammps.log', 'units metal', 'atom_style full', 'read_data initial.data',
+        'pair_style lj/cut 5.0', 'pair_coeff * * 0.0 1.0', 'thermo_style custom step etotal', 'run 0', ''])
+
+    loop = asyncio.get_event_loop()
+    client = LammpsLocalClient(command=command, num_workers=num_workers, deduplicate=False)
+    loop.run_until_complete(client.create())
+    return loop, client, (script, files, {'energy'})
+
+
+@benchmark('calculator.overhead', command='mock', num_workers=1)
+def calculator_overhead(directory, command, num_workers):
+    """ Latency of a zero step job through `LammpsLocalClient`, the
+    `overhead` metric excludes the time spent in lammps
+    """
+    loop, client, job = _calculator_client(command, num_workers)
+
+    async def submit():
+        start_time = time.perf_counter()
+        lammps_job_output = await (await client.submit(*job))
+        latency = time.perf_counter() - start_time
+        if lammps_job_output['error']:
+            raise ValueError(lammps_job_output['error'])
+        return {'items': 1, 'overhead': latency - lammps_job_output['timings']['execute']}
+
+    try:
+        yield lambda: loop.run_until_complete(submit())
+    finally:
+        client.shutdown()
+
+
+@benchmark('calculator.throughput', command='mock', num_workers=1, jobs=100, delay=0.0, error_rate=0.0)
+def calculator_throughput(directory, command, num_workers, jobs, delay, error_rate):
+    """ Batches of concurrent jobs through `LammpsLocalClient`, with the
+    mock lammps `delay` and `error_rate` simulate compute time and
+    failures (failed jobs are counted in the `errors` metric)
+    """
+    loop, client, job = _calculator_client(command, num_workers, delay=delay, error_rate=error_rate)
+
+    async def submit():
+        futures = [await client.submit(*job) for _ in range(jobs)]
+        outputs = await asyncio.gather(*futures)
+        return {'items': jobs, 'errors': sum(1 for _ in outputs if _['error'])}
+
+    try:
+        yield lambda: loop.run_until_complete(submit())
+    finally:
+        client.shutdown()
@@ -1,3 +1,7 @@
 from .client import LammpsLocalClient, LammpsDistributedClient
+from .executor import LammpsExecutor
 from .worker import LammpsWorker
 from .scheduler import LammpsMaster
+from .cache import LammpsResultCache
+from .tuning import LammpsSettingsTuner, LammpsPoolTuner
+from .tracing import enable_tracing, disable_tracing, merge_traces
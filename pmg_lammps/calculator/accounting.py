@@ -0,0 +1,126 @@
+import os
+import math
+
+
+def process_tree(pid):
+    """ Pids of a process and all of its descendants (e.g. mpi ranks)
+
+    Only `pid` is returned when the children are not exposed in /proc.
+    """
+    pids, index = [pid], 0
+    while index < len(pids):
+        try:
+            for tid in os.listdir(f'/proc/{pids[index]}/task'):
+                with open(f'/proc/{pids[index]}/task/{tid}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+        index += 1
+    return pids
+
+
+def _cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        # the command name may contain spaces
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def _peak_rss_bytes(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def reset_peak_rss(pid):
+    """ Reset the peak resident memory of a process tree (linux >= 4.0) """
+    for _pid in process_tree(pid):
+        try:
+            with open(f'/proc/{_pid}/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            pass
+
+
+def process_usage(pid):
+    """ Cpu time [sec] and sum of peak resident memory [bytes] of a process tree
+
+    Returns `(None, None)` where /proc is not available.
+    """
+    cpu_seconds, peak_rss_bytes = 0.0, 0
+    for _pid in process_tree(pid):
+        try:
+            cpu_seconds += _cpu_seconds(_pid)
+            peak_rss_bytes += _peak_rss_bytes(_pid)
+        except (OSError, IndexError, ValueError):
+            if _pid == pid:
+                return None, None
+    return cpu_seconds, peak_rss_bytes
+
+
+def directory_snapshot(directory):
+    """ Modification time and size of every file in `directory` """
+    snapshot = {}
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def written_bytes(directory, snapshot):
+    """ Size of the files in `directory` created or modified since `snapshot` """
+    return sum(size for path, (mtime, size) in directory_snapshot(directory).items()
+               if snapshot.get(path) != (mtime, size))
+
+
+class RunningStats:
+    """ Count, mean, standard deviation, minimum, maximum and total of a
+    stream of values (Welford's algorithm)
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def std(self):
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def as_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'std': self.std,
+                'min': self.min, 'max': self.max, 'total': self.total}
+
+
+class ResourceStats:
+    """ Running statistics of the timings and resources of completed jobs """
+    def __init__(self):
+        self.stats = {}
+
+    def add(self, lammps_job_output):
+        values = dict(lammps_job_output.get('timings') or {})
+        values.update(lammps_job_output.get('resources') or {})
+        for key, value in values.items():
+            if value is not None:
+                self.stats.setdefault(key, RunningStats()).add(value)
+
+    def as_dict(self):
+        return {key: stats.as_dict() for key, stats in self.stats.items()}
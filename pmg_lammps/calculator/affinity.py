@@ -0,0 +1,87 @@
+import os
+import glob
+import re
+
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+
+def parse_cpulist(cpulist):
+    """ Convert a linux cpu list e.g. "0-3,8-11" into a list of cpus """
+    cpus = []
+    for token in cpulist.strip().split(','):
+        if not token:
+            continue
+        start, _, end = token.partition('-')
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def numa_nodes():
+    """ Cpus available to this process grouped by numa node
+
+    Without numa information all cpus form a single node.
+    """
+    available = os.sched_getaffinity(0)
+    nodes = []
+    filenames = glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')
+    for filename in sorted(filenames, key=lambda _: int(re.search(r'node(\d+)', _).group(1))):
+        with open(filename) as f:
+            cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in available]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(available)]
+
+
+def cpu_layout(slots, threads_per_rank=1, layout='compact', nodes=None):
+    """ Cpus of every slot (list of mpi widths) each rank using `threads_per_rank` cores
+
+    A slot is kept within one numa node whenever it fits. `compact`
+    fills numa nodes one after another while `spread` places each slot
+    on the node with the most free cpus to balance memory bandwidth.
+    """
+    if layout not in {'compact', 'spread'}:
+        raise ValueError(f'unknown cpu layout {layout}')
+    nodes = [list(cpus) for cpus in (nodes or numa_nodes())]
+    if sum(slots) * threads_per_rank > sum(len(cpus) for cpus in nodes):
+        raise ValueError(f'slots {slots} with {threads_per_rank} threads per rank need more cpus than available')
+
+    placements = []
+    for width in slots:
+        num_cpus = width * threads_per_rank
+        candidates = [cpus for cpus in nodes if len(cpus) >= num_cpus]
+        if not candidates:
+            # slot does not fit on one node take cpus from the fullest nodes
+            cpus = []
+            for node in sorted(nodes, key=len, reverse=True):
+                taken = node[:num_cpus - len(cpus)]
+                cpus.extend(taken)
+                del node[:len(taken)]
+            placements.append(sorted(cpus))
+            continue
+        if layout == 'spread':
+            node = max(candidates, key=len)
+        else:
+            node = candidates[0]
+        placements.append(node[:num_cpus])
+        del node[:num_cpus]
+    return placements
+
+
+def numa_node(cpus, nodes=None):
+    """ Numa node holding most of `cpus` """
+    nodes = nodes or numa_nodes()
+    return max(range(len(nodes)), key=lambda index: len(set(cpus) & set(nodes[index])))
+
+
+def thread_environment(threads_per_rank, pinned=False):
+    """ Environment limiting the threads of openmp enabled lammps builds and math libraries
+
+    Openmp threads are only bound to cores of a `pinned` process,
+    unpinned processes would all bind to the first cores of the host.
+    """
+    environment = {variable: str(threads_per_rank) for variable in THREAD_VARIABLES}
+    if pinned:
+        environment['OMP_PROC_BIND'] = 'true'
+        environment['OMP_PLACES'] = 'cores'
+    return environment
@@ -0,0 +1,136 @@
+import os
+import hashlib
+import logging
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+
+def blob_key(content):
+    """ Content hash of an input file """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+def link_blob(source, filename):
+    """ Materialize a blob at `filename` as a hard link (copy across filesystems) """
+    if os.path.lexists(filename):
+        os.remove(filename)
+    try:
+        os.link(source, filename)
+    except OSError:
+        shutil.copyfile(source, filename)
+
+
+class LammpsBlobStore:
+    """ Content addressed store of input files on a worker
+
+    Blobs are read-only files named by `blob_key` that are hard linked
+    into the lammps job directories. The store is limited to `max_bytes`
+    with the least recently used blobs evicted first. Blobs used by
+    queued or running jobs are pinned with `acquire` and never evicted.
+    Without a `directory` a temporary directory is used and removed on
+    `close`.
+    """
+    def __init__(self, directory=None, max_bytes=2**30):
+        self.temporary = directory is None
+        self.directory = directory or tempfile.mkdtemp()
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.hits = 0
+        self.misses = 0
+        self._blobs = OrderedDict()
+        self._pins = {}
+        self._num_bytes = 0
+        self._last_access = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith('.tmp'):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime_ns, filename, stat.st_size))
+        for mtime, key, size in sorted(entries):
+            self._last_access = max(mtime, self._last_access)
+            self._blobs[key] = size
+            self._num_bytes += size
+        self.logger.info(f'loaded {len(self._blobs)} blobs ({self._num_bytes} bytes) from {self.directory}')
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def __contains__(self, key):
+        return key in self._blobs
+
+    @property
+    def num_bytes(self):
+        return self._num_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def missing(self, keys):
+        """ Keys not held by the store (counted as misses) """
+        keys = list(keys)
+        missing = [key for key in keys if key not in self._blobs]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return missing
+
+    def put(self, key, content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if blob_key(content) != key:
+            raise ValueError(f'blob content does not match key {key}')
+        if key not in self._blobs:
+            fd, temp_filename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.chmod(temp_filename, 0o444)
+            os.replace(temp_filename, self.path(key))
+            self._blobs[key] = len(content)
+            self._num_bytes += len(content)
+        self._touch(key)
+        self._evict(keep=key)
+
+    def acquire(self, keys):
+        """ Pin blobs used by a job so that they are not evicted """
+        for key in keys:
+            self._pins[key] = self._pins.get(key, 0) + 1
+            self._touch(key)
+
+    def release(self, keys):
+        for key in keys:
+            self._pins[key] -= 1
+            if self._pins[key] == 0:
+                del self._pins[key]
+        self._evict()
+
+    def close(self):
+        if self.temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _touch(self, key):
+        self._blobs.move_to_end(key)
+        self._last_access = max(int(time.time() * 1e9), self._last_access + 1)
+        os.utime(self.path(key), ns=(self._last_access, self._last_access))
+
+    def _evict(self, keep=None):
+        for key in list(self._blobs):
+            if self._num_bytes <= self.max_bytes:
+                break
+            if key in self._pins or key == keep:
+                continue
+            self.logger.debug(f'evicting blob {key}')
+            self._num_bytes -= self._blobs.pop(key)
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,197 @@
+import os
+import re
+import asyncio
+import shlex
+import shutil
+import hashlib
+import pickle
+import logging
+import tempfile
+import time
+from collections import OrderedDict
+
+from .capture import capture_mode
+
+
+def canonical_script(stdin):
+    """ Lammps script with comments, blank lines and redundant whitespace removed
+
+    Two scripts with the same canonical form run the same commands.
+    """
+    lines = []
+    for line in stdin.split('\n'):
+        line = re.sub(r'#[^"\']*$', '', line)
+        tokens = line.split()
+        if tokens:
+            lines.append(' '.join(tokens))
+    return '\n'.join(lines)
+
+
+def command_identity(command):
+    """ Lammps command with the path, size and modification time of its
+    executable and of the files among its arguments
+
+    Results cached under the identity of one lammps build are not
+    returned after the binary is rebuilt or replaced.
+    """
+    arguments = shlex.split(command or 'lammps')
+    identity = [' '.join(arguments)]
+    for index, argument in enumerate(arguments):
+        path = shutil.which(argument) if index == 0 else argument
+        if path is None or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        identity.append(f'{os.path.realpath(path)} {stat.st_size} {stat.st_mtime_ns}')
+    return '\n'.join(identity)
+
+
+def job_key(lammps_job_input, command=None):
+    """ Content hash of a lammps job (script, input files, requested properties,
+    stdout capture and timeout) run by `command` (see `command_identity`)
+
+    The timeout is part of the key so that a job is never coalesced with a
+    run under a different limit.
+    """
+    digest = hashlib.sha256()
+    if command is not None:
+        digest.update(command.encode('utf-8') + b'\0')
+    digest.update(canonical_script(lammps_job_input['stdin']).encode('utf-8'))
+    for filename in sorted(lammps_job_input['files']):
+        content = lammps_job_input['files'][filename]
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        digest.update(b'\0' + filename.encode('utf-8') + b'\0')
+        digest.update(hashlib.sha256(content).digest())
+    digest.update(b'\0' + ' '.join(sorted(lammps_job_input['properties'])).encode('utf-8'))
+    digest.update(f"\0{capture_mode(lammps_job_input.get('capture'))}\0{lammps_job_input.get('timeout')}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class LammpsResultCache:
+    """ Cache of lammps job outputs keyed by `job_key`
+
+    Recently used results are kept in memory (at most `maxsize`). If
+    `directory` is given results are also stored on disk so that they
+    survive between workflows. The on-disk store is limited to
+    `max_disk_bytes` with the least recently used results evicted first.
+
+    `put_async` pickles results to disk in an executor so that the event
+    loop is not blocked.
+    """
+    def __init__(self, maxsize=1024, directory=None, max_disk_bytes=2**30):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._last_access = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_disk_index()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, f'{key}.pickle')
+
+    def _load_disk_index(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.pickle'):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((stat.st_mtime_ns, filename[:-len('.pickle')], stat.st_size))
+        for mtime, key, size in sorted(entries):
+            self._last_access = max(mtime, self._last_access)
+            self._disk[key] = size
+            self._disk_bytes += size
+        self.logger.info(f'loaded {len(self._disk)} results ({self._disk_bytes} bytes) from {self.directory}')
+
+    def __len__(self):
+        return len(set(self._memory) | set(self._disk))
+
+    def __contains__(self, key):
+        return key in self._memory or key in self._disk
+
+    def get(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+        elif key in self._disk:
+            try:
+                with open(self._filename(key), 'rb') as f:
+                    result = pickle.load(f)
+                self._touch(key)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                self.logger.warning(f'removing unreadable cached result {key}')
+                self._remove_disk(key)
+            else:
+                self._disk.move_to_end(key)
+                self._put_memory(key, result)
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        self._put_memory(key, result)
+        if self.directory:
+            self._put_disk(key, result)
+
+    def put_async(self, key, result, executor=None):
+        """ `put` writing to disk in `executor` (default executor if None)
+
+        The result is available from memory immediately. Returns the
+        future of the disk write (None without a `directory`).
+        """
+        self._put_memory(key, result)
+        if not self.directory:
+            return None
+        loop = asyncio.get_event_loop()
+        return asyncio.ensure_future(self._index_disk_async(
+            key, loop.run_in_executor(executor, self._write_disk, key, result)))
+
+    async def _index_disk_async(self, key, write):
+        self._index_disk(key, await write)
+
+    def _put_memory(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _put_disk(self, key, result):
+        self._index_disk(key, self._write_disk(key, result))
+
+    def _write_disk(self, key, result):
+        """ Pickle `result` to disk and return its size (thread safe) """
+        fd, temp_filename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(result, f)
+            size = f.tell()
+        os.replace(temp_filename, self._filename(key))
+        return size
+
+    def _index_disk(self, key, size):
+        self._touch(key)
+        if key in self._disk:
+            self._disk_bytes -= self._disk.pop(key)
+        self._disk[key] = size
+        self._disk_bytes += self._disk[key]
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            self._remove_disk(next(iter(self._disk)))
+
+    def _touch(self, key):
+        # file modification times record the lru order on disk and
+        # filesystem timestamps are often too coarse to order accesses
+        self._last_access = max(int(time.time() * 1e9), self._last_access + 1)
+        os.utime(self._filename(key), ns=(self._last_access, self._last_access))
+
+    def _remove_disk(self, key):
+        self._disk_bytes -= self._disk.pop(key)
+        try:
+            os.remove(self._filename(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,66 @@
+import os
+import collections
+
+
+CAPTURE_MODES = {'all', 'discard', 'file'}
+
+
+def capture_mode(capture):
+    """ Validate a stdout capture mode: 'all' (default), 'discard', 'file'
+    or the number of last lines to keep
+    """
+    if capture is None:
+        return 'all'
+    elif isinstance(capture, int) and not isinstance(capture, bool):
+        if capture < 1:
+            raise ValueError('number of captured stdout lines must be positive')
+        return capture
+    elif capture in CAPTURE_MODES:
+        return capture
+    raise ValueError(f'unknown stdout capture {capture} must be one of {sorted(CAPTURE_MODES)} or a number of lines')
+
+
+class StdoutCapture:
+    """ Bounded capture of the screen output of a lammps job
+
+    Depending on `capture` (see `capture_mode`) all lines are kept, none,
+    the last lines in a ring buffer or all lines are written to
+    `filename`. The last `ERROR_CONTEXT` lines are always kept and
+    returned when the job did not complete (script errors, crashes,
+    timeouts) so that errors can be diagnosed in every mode.
+    """
+    ERROR_CONTEXT = 20
+
+    def __init__(self, capture=None, filename=None):
+        self.mode = capture_mode(capture)
+        self.filename = filename if self.mode == 'file' else None
+        self.completed = False
+        self._context = collections.deque(maxlen=self.ERROR_CONTEXT)
+        if self.mode == 'all':
+            self._lines = []
+        elif isinstance(self.mode, int):
+            self._lines = collections.deque(maxlen=self.mode)
+        else:
+            self._lines = None
+        self._file = None
+        if self.filename is not None:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            self._file = open(self.filename, 'wb')
+
+    def append(self, line):
+        self._context.append(line)
+        if self._lines is not None:
+            self._lines.append(line)
+        if self._file is not None:
+            self._file.write(line)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def output(self):
+        lines = self._lines or []
+        if not self.completed and len(lines) < len(self._context):
+            lines = self._context
+        return b''.join(lines)
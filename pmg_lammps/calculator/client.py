@@ -1,81 +1,438 @@
-import multiprocessing
 import asyncio
+import copy
+import functools
 import urllib.parse
-import pickle
 import uuid
 import logging
+import time
+from collections import OrderedDict
 
 
-from .process import LammpsProcess
+from .pool import LammpsPool
+from .cache import command_identity, job_key
+from .blobs import blob_key
+from .scheduling import priority_class
+from .capture import capture_mode
+from .accounting import ResourceStats
+from .config import load_pool_config
+from .tracing import tracer
+from . import protocol
+from ..inputs import LammpsScript
 
 
-class LammpsLocalClient:
-    def __init__(self, command=None, num_workers=None):
-        self.command = command
+async def _aiter(iterable):
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+class LammpsClient:
+    """ Job bookkeeping shared by the local and distributed clients
+
+    When a `cache` (see `LammpsResultCache`) is given, jobs whose script,
+    files and properties were computed before by the same lammps command
+    (`command_key`, see `command_identity`) are answered from the cache
+    with an already completed future. With `deduplicate` a job
+    identical to one still running is not submitted again, its future
+    completes with the output of the running job.
+
+    `max_pending_jobs` and `max_pending_bytes` (script and file sizes)
+    bound the work submitted but not yet completed. `submit` waits until
+    there is capacity which applies backpressure to producers.
+
+    Jobs running longer than their `timeout` (seconds) fail and cancelling
+    the future of a job removes it from the queue or stops it.
+
+    Queued jobs run by `priority` ('high', 'normal', 'low' or an integer
+    with lower running first), fair share between `submitter` names and
+    shortest estimated runtime first (see `LammpsJobQueue`).
+
+    `capture` bounds the screen output returned in `stdout`: 'all'
+    (default), 'discard', the number of last lines to keep or 'file' to
+    spill it to a file on the machine running the job (`stdout_file`).
+    Lines around errors are always kept.
+
+    Timings and resources (cpu time, peak memory, bytes written) of
+    completed jobs are aggregated into running statistics, see
+    `resource_stats`.
+    """
+    def __init__(self, cache=None, deduplicate=True, max_pending_jobs=None, max_pending_bytes=None, command_key=None):
         self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
-        self.num_workers = num_workers or multiprocessing.cpu_count()
-        if num_workers > multiprocessing.cpu_count():
-            raise ValueError('cannot have more workers than cpus')
+        self.cache = cache
+        self.command_key = command_key
+        self.deduplicate = deduplicate
+        self.max_pending_jobs = max_pending_jobs
+        self.max_pending_bytes = max_pending_bytes
         self.lammps_jobs = {}
+        self._inflight_jobs = {}
+        self._pending_bytes = 0
+        self._capacity_available = asyncio.Event()
+        self._resource_stats = ResourceStats()
+        self.io_executor = None
+        self._cache_writes = set()
+
+    def _has_capacity(self, num_bytes):
+        if not self.lammps_jobs:
+            return True
+        if self.max_pending_jobs is not None and len(self.lammps_jobs) >= self.max_pending_jobs:
+            return False
+        if self.max_pending_bytes is not None and self._pending_bytes + num_bytes > self.max_pending_bytes:
+            return False
+        return True
+
+    async def submit(self, stdin, files=None, properties=None, cost_hint=None, timeout=None, priority=None, submitter=None,
+                     capture=None):
+        if not isinstance(stdin, str):
+            stdin = str(LammpsScript(stdin))
+        priority_class(priority) # validate before queueing
+        capture_mode(capture)
+        lammps_job_input = {
+            'id': uuid.uuid4().hex,
+            'stdin': stdin,
+            'files': dict(files or {}),
+            'properties': set(properties or ()),
+            'cost_hint': cost_hint,
+            'timeout': timeout,
+            'priority': priority,
+            'submitter': submitter,
+            'capture': capture
+        }
+        future = asyncio.Future()
+        key = None
+        if self.cache is not None or self.deduplicate:
+            key = job_key(lammps_job_input, self.command_key)
+        if self.cache is not None:
+            lammps_job_output = self.cache.get(key)
+            if lammps_job_output is not None:
+                self.logger.debug(f'lammps job {lammps_job_input["id"]} found in cache')
+                future.set_result(dict(copy.deepcopy(lammps_job_output), id=lammps_job_input['id']))
+                return future
+        num_bytes = len(stdin) + sum(len(content) for content in lammps_job_input['files'].values())
+        while True:
+            if self.deduplicate and key in self._inflight_jobs:
+                job_id = self._inflight_jobs[key]
+                self.logger.debug(f'lammps job {lammps_job_input["id"]} coalesced with running job {job_id}')
+                self.lammps_jobs[job_id][1].append(future)
+                future.add_done_callback(lambda future, job_id=job_id: self._check_cancelled(job_id))
+                return future
+            elif self._has_capacity(num_bytes):
+                break
+            self._capacity_available.clear()
+            await self._capacity_available.wait()
+        self.lammps_jobs[lammps_job_input['id']] = (key, [future], num_bytes)
+        self._pending_bytes += num_bytes
+        if self.deduplicate:
+            self._inflight_jobs[key] = lammps_job_input['id']
+        future.add_done_callback(lambda future, job_id=lammps_job_input['id']: self._check_cancelled(job_id))
+        await self._submit(lammps_job_input)
+        return future
+
+    async def as_completed(self, futures):
+        """ Iterate over futures as they complete
+
+        `futures` may be an asynchronous iterable, e.g. an async generator
+        that submits jobs, so that submission (bounded by
+        `max_pending_jobs`) and consumption of results overlap.
+        """
+        completed = asyncio.Queue()
+        state = {'count': 0, 'exhausted': False}
+
+        def add_future(future):
+            state['count'] += 1
+            future.add_done_callback(completed.put_nowait)
+
+        producer_task = None
+        if hasattr(futures, '__aiter__'):
+            async def produce():
+                try:
+                    async for future in futures:
+                        add_future(future)
+                except Exception as error:
+                    completed.put_nowait(error)
+                state['exhausted'] = True
+                completed.put_nowait(None)
+            producer_task = asyncio.ensure_future(produce())
+        else:
+            for future in futures:
+                add_future(future)
+            state['exhausted'] = True
+
+        num_yielded = 0
+        try:
+            while not (state['exhausted'] and num_yielded == state['count']):
+                future = await completed.get()
+                if future is None:
+                    continue
+                elif isinstance(future, Exception):
+                    raise future
+                num_yielded += 1
+                yield future
+        finally:
+            if producer_task is not None and not producer_task.done():
+                producer_task.cancel()
+
+    async def map(self, jobs, ordered=False, chunksize=None):
+        """ Submit many jobs and iterate over `(index, output)` as they complete
+
+        Each job is a script string, a tuple `(stdin, files, properties)`
+        or a dict of `submit` keyword arguments; `jobs` may be an
+        asynchronous iterable. With `ordered` outputs are yielded in
+        submission order otherwise as soon as they finish. `chunksize`
+        pulls jobs from `jobs` in chunks and only submits the next chunk
+        once fewer than `chunksize` jobs of this map are outstanding,
+        which avoids materialising very large job iterables.
+        """
+        indices = {}
+        outstanding = set()
+        job_completed = asyncio.Event()
+
+        def on_done(future):
+            outstanding.discard(future)
+            job_completed.set()
+
+        async def submit_jobs():
+            index = 0
+            async for job in _aiter(jobs):
+                if chunksize and index and index % chunksize == 0:
+                    while len(outstanding) >= chunksize:
+                        job_completed.clear()
+                        await job_completed.wait()
+                if isinstance(job, str):
+                    future = await self.submit(job)
+                elif isinstance(job, dict):
+                    future = await self.submit(**job)
+                else:
+                    future = await self.submit(*job)
+                indices[future] = index
+                outstanding.add(future)
+                future.add_done_callback(on_done)
+                index += 1
+                yield future
+
+        completed = {}
+        next_index = 0
+        async for future in self.as_completed(submit_jobs()):
+            index = indices.pop(future)
+            if not ordered:
+                yield index, future.result()
+                continue
+            completed[index] = future.result()
+            while next_index in completed:
+                yield next_index, completed.pop(next_index)
+                next_index += 1
+
+    def resource_stats(self):
+        """ Count, mean, std, min, max and total of every timing (queue,
+        write, execute, parse) and resource of the completed jobs
+        """
+        return self._resource_stats.as_dict()
+
+    async def _submit(self, lammps_job_input):
+        raise NotImplementedError()
+
+    async def _cancel(self, job_id):
+        """ Stop a queued or running job whose futures were all cancelled """
+        pass
+
+    def _check_cancelled(self, job_id):
+        if job_id not in self.lammps_jobs:
+            return
+        if all(future.cancelled() for future in self.lammps_jobs[job_id][1]):
+            self.logger.debug(f'lammps job {job_id} cancelled')
+            self._release(job_id)
+            asyncio.ensure_future(self._cancel(job_id))
+
+    def _release(self, job_id):
+        key, futures, num_bytes = self.lammps_jobs.pop(job_id)
+        self._pending_bytes -= num_bytes
+        self._capacity_available.set()
+        if self.deduplicate and self._inflight_jobs.get(key) == job_id:
+            del self._inflight_jobs[key]
+        return key, futures
+
+    def _cache_written(self, job_id, write):
+        self._cache_writes.discard(write)
+        if not write.cancelled() and write.exception() is not None:
+            self.logger.error(f'lammps job {job_id} could not be cached', exc_info=write.exception())
+
+    async def wait_closed(self):
+        """ Wait for completed results to be written to the cache after `shutdown` """
+        if self._cache_writes:
+            await asyncio.wait(self._cache_writes)
+
+    def _complete(self, lammps_job_output):
+        if lammps_job_output['id'] not in self.lammps_jobs:
+            self.logger.debug(f'lammps job {lammps_job_output["id"]} completed after it was cancelled')
+            return
+        key, futures = self._release(lammps_job_output['id'])
+        self._resource_stats.add(lammps_job_output)
+        if self.cache is not None and lammps_job_output['error'] is None:
+            try:
+                write = self.cache.put_async(key, copy.deepcopy(lammps_job_output), self.io_executor)
+            except Exception:
+                self.logger.exception(f'lammps job {lammps_job_output["id"]} could not be cached')
+            else:
+                if write is not None:
+                    self._cache_writes.add(write)
+                    write.add_done_callback(functools.partial(self._cache_written, lammps_job_output['id']))
+        # coalesced callers get their own copy of the nested results
+        for i, future in enumerate(futures):
+            if not future.done():
+                future.set_result(lammps_job_output if i == 0 else copy.deepcopy(lammps_job_output))
+
+
+class LammpsLocalClient(LammpsClient):
+    """ Run lammps jobs on a pool of persistent local lammps processes
+
+    By default `num_workers` serial lammps processes are started.
+    `slots` (lammps `-partition` syntax e.g. "8x1 2x8") starts processes
+    of different widths with `mpirun` and jobs are routed to them by atom
+    count or `cost_hint`. When `partitions` is given a single `mpirun`
+    launch is started instead and every partition is used as an
+    independent job slot. With `min_workers` and `idle_timeout` the
+    number of lammps processes follows the load. `pin` and
+    `threads_per_rank` control the cpu placement of the processes and
+    `shares` weights the fair share of named submitters. See `LammpsPool`.
+
+    Pool options can be loaded from a config file written by
+    `LammpsPoolTuner` with `from_config`.
+    """
+    def __init__(self, command=None, num_workers=None, slots=None, partitions=None,
+                 mpirun='mpirun', atoms_per_rank=LammpsPool.DEFAULT_ATOMS_PER_RANK, parse_processes=None,
+                 min_workers=None, idle_timeout=None, pin=None, threads_per_rank=None, shares=None, stdout_directory=None, cache=None, deduplicate=True, max_pending_jobs=None, max_pending_bytes=None):
+        super().__init__(
+            cache=cache, deduplicate=deduplicate,
+            max_pending_jobs=max_pending_jobs, max_pending_bytes=max_pending_bytes,
+            command_key=command_identity(command) if cache is not None else None)
+        self.pool = LammpsPool(
+            command=command, num_workers=num_workers,
+            slots=slots, partitions=partitions,
+            mpirun=mpirun, atoms_per_rank=atoms_per_rank,
+            parse_processes=parse_processes,
+            min_workers=min_workers, idle_timeout=idle_timeout,
+            pin=pin, threads_per_rank=threads_per_rank, shares=shares,
+            stdout_directory=stdout_directory)
+        self.num_workers = self.pool.num_slots
+
+    @classmethod
+    def from_config(cls, filename, **kwargs):
+        """ Client with the pool options of a config file, `kwargs` take precedence """
+        return cls(**dict(load_pool_config(filename), **kwargs))
 
     async def create(self):
-        self._pending_queue = asyncio.Queue()
         self._completed_queue = asyncio.Queue()
-        self._processes = []
-        self.logger.info(f'creating {self.num_workers} lammps processes')
-        for _ in range(self.num_workers):
-            process = LammpsProcess(command=self.command)
-            await process.create(self._pending_queue, self._completed_queue)
-            self._processes.append(process)
+        await self.pool.create(self._completed_queue)
+        self.io_executor = self.pool.io_executor
         self._completed_jobs_task = asyncio.ensure_future(self._handle_completed())
 
     async def _handle_completed(self):
         while True:
-            client_id, message = await self._completed_queue.get()
-            lammps_job_output = pickle.loads(message[0])
-            (self.lammps_jobs.pop(lammps_job_output['id'])).set_result(lammps_job_output)
+            client_id, lammps_job_output = await self._completed_queue.get()
+            self._complete(lammps_job_output)
 
     def shutdown(self):
-        for process in self._processes:
-            process.shutdown()
+        self._completed_jobs_task.cancel()
+        self.pool.shutdown()
 
-    async def submit(self, stdin, files=None, properties=None):
-        lammps_job_input = {
-            'id': uuid.uuid4().hex,
-            'stdin': stdin,
-            'files': files or {},
-            'properties': properties or set()
-        }
-        future = asyncio.Future()
-        self.lammps_jobs[lammps_job_input['id']] = future
-        await self._pending_queue.put((b'client_id', [pickle.dumps(lammps_job_input)]))
-        return future
+    async def wait_closed(self):
+        """ Wait for the lammps processes to exit after `shutdown` """
+        await super().wait_closed()
+        await self.pool.wait_closed()
+
+    async def _submit(self, lammps_job_input):
+        await self.pool.put(b'client_id', lammps_job_input)
+
+    async def _cancel(self, job_id):
+        self.pool.cancel(job_id)
+
+    def metrics(self):
+        """ Supervision counters of the lammps processes see `LammpsPool.metrics` """
+        return self.pool.metrics()
 
+    def queue_stats(self):
+        """ Queue wait times per priority class see `LammpsPool.queue_stats` """
+        return self.pool.queue_stats()
 
-class LammpsDistributedClient:
-    def __init__(self, scheduler, loop=None):
+
+class LammpsDistributedClient(LammpsClient):
+    """ Submit lammps jobs to workers through a `LammpsMaster`
+
+    Jobs and outputs are sent in the binary format of
+    `pmg_lammps.calculator.protocol`, frames larger than
+    `compress_threshold` bytes are compressed.
+
+    Workers keep a content addressed store of input files. Files of at
+    least `blob_threshold` bytes are sent once and afterwards only by
+    hash. A worker missing a blob replies with the missing hashes and
+    the job is sent again with its files included.
+
+    The client does not know the lammps build of the workers, results
+    are only cached per `command_key` (e.g. the lammps version) given.
+    """
+    MAX_BLOB_KEYS = 64
+
+    def __init__(self, scheduler, cache=None, deduplicate=True,
+                 max_pending_jobs=None, max_pending_bytes=None, compress_threshold=None,
+                 blob_threshold=4096, command_key=None, loop=None):
         from zmq_legos.mdp import Client as MDPClient
 
+        super().__init__(
+            cache=cache, deduplicate=deduplicate,
+            max_pending_jobs=max_pending_jobs, max_pending_bytes=max_pending_bytes,
+            command_key=command_key)
+        self.compress_threshold = compress_threshold
+        self.blob_threshold = blob_threshold
+        self._sent_blobs = set()
+        self._blob_keys = OrderedDict()
+        self._blob_jobs = {}
+        self._submitted_at = {}
         parsed = urllib.parse.urlparse(scheduler)
         self.mdp_client = MDPClient(protocol=parsed.scheme, port=parsed.port, hostname=parsed.hostname, loop=loop)
-        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
-        self.lammps_jobs = {}
 
     async def create(self):
         self._completed_jobs_task = asyncio.ensure_future(self._handle_completed())
 
-    async def submit(self, stdin, files=None, properties=None):
-        lammps_job_input = {
-            'id': uuid.uuid4().hex,
-            'stdin': stdin,
-            'files': files or {},
-            'properties': properties or set()
-        }
-        future = asyncio.Future()
-        self.lammps_jobs[lammps_job_input['id']] = future
-        await self.mdp_client.submit(b'lammps.job', [pickle.dumps(lammps_job_input)])
+    def _blob_key(self, content):
+        # parameter sweeps submit the same file object many times
+        entry = self._blob_keys.get(id(content))
+        if entry is None or entry[0] is not content:
+            entry = (content, blob_key(content))
+            self._blob_keys[id(content)] = entry
+            if len(self._blob_keys) > self.MAX_BLOB_KEYS:
+                self._blob_keys.popitem(last=False)
+        self._blob_keys.move_to_end(id(content))
+        return entry[1]
+
+    def _encode_job(self, lammps_job_input, include_blobs=False):
+        files, file_hashes, blobs = {}, {}, {}
+        for filename, content in lammps_job_input['files'].items():
+            if self.blob_threshold is None or len(content) < self.blob_threshold:
+                files[filename] = content
+                continue
+            key = self._blob_key(content)
+            file_hashes[filename] = key
+            if include_blobs or key not in self._sent_blobs:
+                blobs[key] = content.encode('utf-8') if isinstance(content, str) else content
+                self._sent_blobs.add(key)
+        if file_hashes:
+            self._blob_jobs[lammps_job_input['id']] = lammps_job_input
+        message = dict(lammps_job_input, files=files, file_hashes=file_hashes, blobs=blobs)
+        return protocol.encode(message, self.compress_threshold)
+
+    async def _cancel(self, job_id):
+        # majordomo has no way to reach the worker running a job so the
+        # job runs to completion and its output is dropped
+        self._blob_jobs.pop(job_id, None)
+
+    async def _submit(self, lammps_job_input, include_blobs=False):
+        with tracer().span('client.serialize', lammps_job_input['id']):
+            message = self._encode_job(lammps_job_input, include_blobs)
+        self._submitted_at[lammps_job_input['id']] = time.time()
+        await self.mdp_client.submit(b'lammps.job', message)
         self.logger.debug(f'lammps job {lammps_job_input["id"]} submitted')
-        return future
 
     def shutdown(self):
         pass
@@ -83,6 +440,20 @@ class LammpsDistributedClient:
     async def _handle_completed(self):
         while True:
             service, message = await self.mdp_client.get()
-            lammps_job_output = pickle.loads(message[0])
+            start_time = time.time()
+            lammps_job_output = protocol.decode(message)
+            submitted_at = self._submitted_at.pop(lammps_job_output['id'], None)
+            if submitted_at is not None:
+                tracer().add('client.roundtrip', lammps_job_output['id'], submitted_at, start_time)
+            tracer().add('client.deserialize', lammps_job_output['id'], start_time, time.time())
+            if lammps_job_output['id'] not in self.lammps_jobs:
+                self._blob_jobs.pop(lammps_job_output['id'], None)
+                self.logger.debug(f'lammps job {lammps_job_output["id"]} completed after it was cancelled')
+                continue
+            if lammps_job_output.get('missing'):
+                self.logger.debug(f'lammps job {lammps_job_output["id"]} worker missing blobs {lammps_job_output["missing"]}')
+                await self._submit(self._blob_jobs[lammps_job_output['id']], include_blobs=True)
+                continue
             self.logger.debug(f'lammps job {lammps_job_output["id"]} completed')
-            (self.lammps_jobs.pop(lammps_job_output['id'])).set_result(lammps_job_output)
+            self._blob_jobs.pop(lammps_job_output['id'], None)
+            self._complete(lammps_job_output)
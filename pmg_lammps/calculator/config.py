@@ -0,0 +1,30 @@
+import json
+
+
+POOL_OPTIONS = ['command', 'num_workers', 'slots', 'mpirun', 'atoms_per_rank', 'parse_processes',
+                'min_workers', 'idle_timeout', 'pin', 'threads_per_rank', 'stdout_directory']
+
+
+def load_pool_config(filename):
+    """ Lammps pool options (see `POOL_OPTIONS`) of a json config file
+
+    Other keys of the file (e.g. the `master` uri of a worker or
+    the measurements of `LammpsPoolTuner`) are ignored.
+    """
+    with open(filename) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f'pool config {filename} must be a json object')
+    return {key: value for key, value in config.items() if key in POOL_OPTIONS}
+
+
+def write_pool_config(filename, config):
+    """ Write a pool config keeping other keys of an existing file """
+    try:
+        with open(filename) as f:
+            existing = json.load(f)
+    except (OSError, ValueError):
+        existing = {}
+    existing.update(config)
+    with open(filename, 'w') as f:
+        json.dump(existing, f, indent=4, sort_keys=True)
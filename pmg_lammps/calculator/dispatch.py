@@ -0,0 +1,337 @@
+import asyncio
+import collections
+import logging
+import time
+import uuid
+
+from zmq_legos.mdp import Scheduler as MDPScheduler
+from zmq_legos.mdp.scheduler import SchedulerCode
+
+from . import protocol
+from .pool import job_cost
+from .scheduling import LammpsJobQueue, RuntimeHistory, merge_queue_stats
+from .tracing import tracer
+
+
+class LammpsScheduler(MDPScheduler):
+    """ Majordomo scheduler that routes lammps jobs by cache affinity
+
+    The scheduler follows which input files (blob hashes see
+    `LammpsBlobStore`) every worker holds: a worker holds the files of
+    the jobs it completed and loses the files it reports missing. A job
+    is sent to the available worker already holding the most bytes of
+    its files and otherwise to the least loaded worker.
+
+    Queued jobs are dispatched by priority class, fair share between
+    submitters and shortest estimated runtime (see `LammpsJobQueue`)
+    learned from the runtimes workers report.
+
+    With `speculate` a job running `straggler_factor` times longer than
+    its estimate (more when runtimes of its template vary) is sent to a
+    second worker once the queue has drained. The first result is
+    returned and the other copy cancelled. Workers not heard from
+    (heartbeats or replies) for `heartbeat_timeout` seconds are dropped
+    and their jobs requeued.
+    """
+    MONITOR_INTERVAL = 0.5
+    STRAGGLER_DEVIATIONS = 3.0
+
+    def __init__(self, *args, shares=None, speculate=True, straggler_factor=2.0, heartbeat_timeout=10.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.worker_blobs = collections.defaultdict(set)
+        self.blob_sizes = {}
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+        self.history = RuntimeHistory()
+        self.services = collections.defaultdict(lambda: {
+            'workers': set(), 'task': None, 'next_worker': asyncio.PriorityQueue(),
+            'queue': LammpsJobQueue(history=self.history, shares=shares, job=self._message_job),
+        })
+        self.speculate = speculate
+        self.straggler_factor = straggler_factor
+        self.heartbeat_timeout = heartbeat_timeout
+        self.speculative_copies = 0
+        self.speculative_wins = 0
+        self.duplicate_replies = 0
+        self.lost_workers = 0
+        self._message_blobs = {}
+        self._message_jobs = {}
+        self._message_services = {}
+        self._running = {}
+        self._speculated = set()
+        self._control_messages = set()
+        self._worker_seen = {}
+        self._monitor_task = None
+
+    @property
+    def affinity_hit_rate(self):
+        total = self.affinity_hits + self.affinity_misses
+        return self.affinity_hits / total if total else None
+
+    def stats(self):
+        return {
+            'affinity_hits': self.affinity_hits,
+            'affinity_misses': self.affinity_misses,
+            'affinity_hit_rate': self.affinity_hit_rate,
+            'workers': {worker_id.hex(): len(blobs) for worker_id, blobs in self.worker_blobs.items()},
+            'queue': merge_queue_stats(service['queue'].stats() for service in self.services.values()),
+            'running': len(self._running),
+            'speculative_copies': self.speculative_copies,
+            'speculative_wins': self.speculative_wins,
+            'duplicate_replies': self.duplicate_replies,
+            'lost_workers': self.lost_workers,
+        }
+
+    def _parse_message(self, message_uuid):
+        message = self.messages[message_uuid]
+        try:
+            body = protocol.header(message.message)
+        except (ValueError, IndexError):
+            body = {}
+        keys = set((body.get('file_hashes') or {}).values())
+        blobs = body.get('blobs') or {}
+        for key, value in blobs.items():
+            self.blob_sizes[key] = len(message.message[value['__bytes__'][0]])
+        self._message_blobs[message_uuid] = (keys, keys & set(blobs))
+        stdin = body.get('stdin') or ''
+        self._message_jobs[message_uuid] = {
+            'stdin': stdin,
+            'cost_hint': job_cost(dict(body, stdin=stdin, files=body.get('files') or {})),
+            'priority': body.get('priority'),
+            'submitter': body.get('submitter'),
+            'id': body.get('id'),
+            'queued_at': time.time(),
+        }
+
+    def _message_job(self, message_uuid):
+        """ Script, cost and scheduling fields of a job """
+        if message_uuid not in self._message_jobs:
+            self._parse_message(message_uuid)
+        return self._message_jobs[message_uuid]
+
+    def _message_keys(self, message_uuid):
+        """ Blob hashes of the files of a job and those sent along with it """
+        if message_uuid not in self._message_blobs:
+            self._parse_message(message_uuid)
+        return self._message_blobs[message_uuid]
+
+    def _forget_message(self, message_uuid):
+        for messages in (self._message_blobs, self._message_jobs, self._message_services, self._running):
+            messages.pop(message_uuid, None)
+        self._speculated.discard(message_uuid)
+
+    def _select_worker(self, keys, available):
+        """ Available `(load, worker_id)` holding the most bytes of `keys` """
+        def affinity(entry):
+            load, worker_id = entry
+            held = keys & self.worker_blobs[worker_id]
+            return (-sum(self.blob_sizes.get(key, 1) for key in held), load)
+
+        selected = min(available, key=affinity)
+        if keys:
+            if keys <= self.worker_blobs[selected[1]]:
+                self.affinity_hits += 1
+            else:
+                self.affinity_misses += 1
+        return selected
+
+    async def _handle_service_queue(self, service):
+        try:
+            while True:
+                # wait for a worker before taking the next job so that
+                # jobs queued meanwhile are ordered by priority too
+                available = [await service['next_worker'].get()]
+                message_uuid = await service['queue'].get()
+                while not service['next_worker'].empty():
+                    available.append(service['next_worker'].get_nowait())
+                for _ in available:
+                    service['next_worker'].task_done()
+                # workers may have disconnected while waiting for a job
+                available = [entry for entry in available if entry[1] in self.workers]
+                running = self._running.get(message_uuid, {})
+                candidates = [entry for entry in available if entry[1] not in running]
+                if message_uuid not in self.messages or not candidates:
+                    for entry in available:
+                        service['next_worker'].put_nowait(entry)
+                    if message_uuid not in self.messages:
+                        pass # a copy of a job that already completed
+                    elif running:
+                        self._speculated.discard(message_uuid) # no other worker for the copy
+                    else:
+                        service['queue'].put_nowait(message_uuid)
+                    service['queue'].task_done()
+                    continue
+                message = self.messages[message_uuid]
+                keys, sent_keys = self._message_keys(message_uuid)
+                selected = self._select_worker(keys, candidates)
+                for entry in available:
+                    if entry != selected:
+                        service['next_worker'].put_nowait(entry)
+                worker_id = selected[1]
+                worker = self.workers[worker_id]
+                # files sent with the job are stored by the worker
+                self.worker_blobs[worker_id] |= sent_keys
+                worker['messages'].add(message_uuid)
+                if not running:
+                    lammps_job_input = self._message_job(message_uuid)
+                    tracer().add('master.queue', lammps_job_input['id'], lammps_job_input['queued_at'], time.time())
+                self._running.setdefault(message_uuid, {})[worker_id] = time.monotonic()
+                self._message_services[message_uuid] = worker['service']
+                await self.socket.send_multipart([
+                    worker_id, b'', SchedulerCode.WORKER, SchedulerCode.REQUEST,
+                    message_uuid, b'', *message.message
+                ])
+                if len(worker['messages']) < worker['config']['max_messages']:
+                    await service['next_worker'].put((len(worker['messages']), worker_id))
+                service['queue'].task_done()
+                self.logger.debug(f'broker sent request to worker {worker_id} for message {message_uuid} affinity hit rate {self.affinity_hit_rate}')
+        except asyncio.CancelledError:
+            self.logger.info('stopping worker for service')
+
+    async def _handle_worker_message(self, worker_id, multipart_message):
+        message_type = multipart_message[0]
+        self._worker_seen[worker_id] = time.monotonic()
+        if message_type == SchedulerCode.READY:
+            if self._monitor_task is None:
+                self._monitor_task = asyncio.ensure_future(self._monitor())
+        elif message_type == SchedulerCode.REPLY:
+            await self._handle_reply(worker_id, multipart_message[1], multipart_message[3:])
+            if worker_id not in self.workers:
+                await self._request_reconnect(worker_id)
+            return
+        elif message_type == SchedulerCode.DISCONNECT:
+            self._release_worker_messages(worker_id)
+            self.worker_blobs.pop(worker_id, None)
+            self._worker_seen.pop(worker_id, None)
+        elif worker_id not in self.workers:
+            # e.g. a worker dropped after missing heartbeats
+            await self._request_reconnect(worker_id)
+            return
+        await super()._handle_worker_message(worker_id, multipart_message)
+
+    async def _handle_reply(self, worker_id, message_uuid, frames):
+        if message_uuid in self._control_messages:
+            self._control_messages.discard(message_uuid)
+            return
+        worker = self.workers.get(worker_id)
+        if worker is not None and message_uuid in worker['messages']:
+            worker['messages'].remove(message_uuid)
+            if len(worker['messages']) == (worker['config']['max_messages'] - 1):
+                await self.services[worker['service']]['next_worker'].put((len(worker['messages']), worker_id))
+        running = self._running.get(message_uuid, {})
+        started = running.pop(worker_id, None)
+        try:
+            body = protocol.header(frames)
+        except (ValueError, IndexError):
+            body = {}
+        if started is not None:
+            tracer().add_duration('master.dispatch', body.get('id'), time.monotonic() - started, worker=worker_id.hex())
+        keys, _ = self._message_blobs.get(message_uuid, (set(), set()))
+        if body.get('missing'):
+            self.worker_blobs[worker_id] -= set(body['missing'])
+        else:
+            self.worker_blobs[worker_id] |= keys
+
+        if message_uuid not in self.messages:
+            self.logger.debug(f'dropping reply of worker {worker_id} to completed message {message_uuid}')
+            self.duplicate_replies += 1
+            return
+        elif body.get('missing') and running:
+            # another copy of the job is still running
+            return
+
+        message = self.messages.pop(message_uuid)
+        service_name = self._message_services.get(message_uuid) or worker['service']
+        self.logger.debug(f'sending client {message.client_id} message response from worker {worker_id}')
+        await self.socket.send_multipart([
+            message.client_id, b'', SchedulerCode.CLIENT, service_name, *frames
+        ])
+        lammps_job_input = self._message_jobs.get(message_uuid)
+        execute = (body.get('timings') or {}).get('execute')
+        if lammps_job_input is not None and body.get('error') is None and execute is not None and not body.get('missing'):
+            self.history.record(lammps_job_input['stdin'], lammps_job_input['cost_hint'], execute)
+        if running and started is not None and started > min(running.values()):
+            self.speculative_wins += 1
+        for other_worker_id in running:
+            await self._cancel_copy(other_worker_id, body.get('id'))
+        self._forget_message(message_uuid)
+
+    async def _cancel_copy(self, worker_id, job_id):
+        """ Ask a worker to stop its copy of a job that completed elsewhere """
+        if worker_id not in self.workers or job_id is None:
+            return
+        self.logger.debug(f'cancelling lammps job {job_id} on worker {worker_id}')
+        control_uuid = uuid.uuid4().bytes
+        self._control_messages.add(control_uuid)
+        await self.socket.send_multipart([
+            worker_id, b'', SchedulerCode.WORKER, SchedulerCode.REQUEST,
+            control_uuid, b'', *protocol.encode({'cancel': job_id})
+        ])
+
+    async def _request_reconnect(self, worker_id):
+        await self.socket.send_multipart([worker_id, b'', SchedulerCode.WORKER, SchedulerCode.DISCONNECT])
+
+    def _release_worker_messages(self, worker_id):
+        """ Keep only jobs without a copy on another worker for requeueing """
+        worker = self.workers.get(worker_id)
+        if worker is None:
+            return
+        for message_uuid in list(worker['messages']):
+            running = self._running.get(message_uuid, {})
+            running.pop(worker_id, None)
+            if running or message_uuid not in self.messages:
+                worker['messages'].discard(message_uuid)
+
+    def _overrun(self, message_uuid, elapsed):
+        """ Running time of a job relative to its straggler threshold """
+        lammps_job_input = self._message_jobs.get(message_uuid)
+        if lammps_job_input is None:
+            return None
+        estimate = self.history.estimate(lammps_job_input['stdin'], lammps_job_input['cost_hint'])
+        if not estimate:
+            return None
+        spread = self.history.spread(lammps_job_input['stdin']) or 0.0
+        return elapsed / (estimate * max(self.straggler_factor, 1 + self.STRAGGLER_DEVIATIONS * spread))
+
+    def _speculate(self, now):
+        for service_name, service in self.services.items():
+            if not service['queue'].empty():
+                continue
+            idle = sum(max(self.workers[worker_id]['config']['max_messages'] - len(self.workers[worker_id]['messages']), 0)
+                       for worker_id in service['workers'] if worker_id in self.workers)
+            if not idle:
+                continue
+            stragglers = []
+            for message_uuid, running in self._running.items():
+                if len(running) != 1 or message_uuid in self._speculated or self._message_services.get(message_uuid) != service_name:
+                    continue
+                overrun = self._overrun(message_uuid, now - min(running.values()))
+                if overrun is not None and overrun > 1:
+                    stragglers.append((overrun, message_uuid))
+            for overrun, message_uuid in sorted(stragglers, reverse=True)[:idle]:
+                self.logger.info(f'message {message_uuid} running {overrun:.1f} times its expected runtime sending a speculative copy')
+                self._speculated.add(message_uuid)
+                self.speculative_copies += 1
+                service['queue'].put_nowait(message_uuid)
+
+    async def _monitor(self):
+        try:
+            while not self.stop_event.is_set():
+                await asyncio.sleep(self.MONITOR_INTERVAL)
+                now = time.monotonic()
+                for worker_id, seen in list(self._worker_seen.items()):
+                    if worker_id in self.workers and now - seen > self.heartbeat_timeout:
+                        self.logger.warning(f'worker {worker_id} not heard from in {now - seen:.1f} [sec] requeueing its jobs')
+                        self.lost_workers += 1
+                        await self._request_reconnect(worker_id)
+                        await self._handle_worker_message(worker_id, [SchedulerCode.DISCONNECT])
+                if self.speculate:
+                    self._speculate(now)
+        except asyncio.CancelledError:
+            pass
+
+    def disconnect(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+        super().disconnect()
@@ -0,0 +1,167 @@
+import sys
+import asyncio
+import itertools
+import threading
+import time
+import logging
+from concurrent.futures import Executor, Future
+
+from .client import LammpsLocalClient
+
+
+class LammpsExecutor(Executor):
+    """ An implementation that tries to run lammps as a calculator
+
+    This is a good idea for lots of calculations that run in a short
+    period of time. A `concurrent.futures.Executor` for synchronous code
+    backed by a `LammpsLocalClient` whose event loop runs in a
+    background thread. Keyword arguments are passed to the client.
+
+    `submit(fn, *args, **kwargs)` and `map(fn, *iterables)` follow the
+    executor signatures but `fn` builds a lammps job instead of doing
+    the work: it is called in the submitting thread and returns a
+    script, a tuple `(stdin, files, properties)` or a dict of
+    `LammpsClient.submit` keyword arguments. The futures hold the job
+    outputs and errors raised by `fn` propagate from `submit` and `map`.
+    Code whose callables run lammps themselves has to be changed to
+    return the job.
+
+    >>> with LammpsExecutor(command='lammps', num_workers=4) as executor:
+    ...     outputs = list(executor.map(make_job, structures))
+    """
+    def __init__(self, command=None, num_workers=None, **kwargs):
+        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self._shutdown = False
+        self._shutdown_lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._main_loop = None
+        if sys.version_info < (3, 8) and threading.current_thread() is threading.main_thread():
+            # subprocesses of a loop outside the main thread need the
+            # child watcher attached to that loop before python 3.8
+            self._main_loop = asyncio.get_event_loop()
+            asyncio.get_child_watcher().attach_loop(self._loop)
+        self._thread = threading.Thread(target=self._run_loop, name='LammpsExecutor', daemon=True)
+        self._thread.start()
+        try:
+            self._client = self._run(self._create_client(command, num_workers, kwargs))
+        except Exception:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            raise
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+        if self._main_loop is None:
+            self._loop.close()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _create_client(self, command, num_workers, kwargs):
+        client = LammpsLocalClient(command=command, num_workers=num_workers, **kwargs)
+        await client.create()
+        return client
+
+    @staticmethod
+    def _job(fn, args, kwargs):
+        """ Arguments of `LammpsClient.submit` for a job built by `fn` """
+        if not callable(fn):
+            return (fn, *args), kwargs
+        job = fn(*args, **kwargs)
+        if isinstance(job, dict):
+            return (), job
+        elif isinstance(job, tuple):
+            return job, {}
+        return (job,), {}
+
+    async def _submit_jobs(self, jobs, futures):
+        for (args, kwargs), future in zip(jobs, futures):
+            lammps_future = await self._client.submit(*args, **kwargs)
+            lammps_future.add_done_callback(lambda lammps_future, future=future: self._set_result(lammps_future, future))
+            future.add_done_callback(lambda future, lammps_future=lammps_future: self._cancel(future, lammps_future))
+
+    def _cancel(self, future, lammps_future):
+        if future.cancelled() and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(lammps_future.cancel)
+
+    @staticmethod
+    def _set_result(lammps_future, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        if lammps_future.cancelled():
+            future.cancel()
+        elif lammps_future.exception() is not None:
+            future.set_exception(lammps_future.exception())
+        else:
+            future.set_result(lammps_future.result())
+
+    def _submit_chunk(self, jobs):
+        """ Submit jobs with a single call into the event loop
+
+        Blocks while the client has no capacity (see `max_pending_jobs`).
+        """
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            futures = [Future() for _ in jobs]
+            self._run(self._submit_jobs(jobs, futures))
+            return futures
+
+    def submit(self, fn, *args, **kwargs):
+        """ Submit the lammps job `fn(*args, **kwargs)` returning a
+        `concurrent.futures.Future` of its output
+
+        A script in place of `fn` is submitted with `args` and `kwargs`
+        as in `LammpsClient.submit`. Cancelling the future stops the job.
+        """
+        return self._submit_chunk([self._job(fn, args, kwargs)])[0]
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        """ Run the lammps jobs `fn(*args)` for `args` in `zip(*iterables)`
+
+        Without a callable `fn` the iterables hold the `(stdin, files,
+        properties)` of the jobs. Outputs are returned in order.
+        `chunksize` jobs are submitted to the event loop thread at a time.
+        """
+        end_time = None if timeout is None else timeout + time.monotonic()
+        if not callable(fn):
+            fn, iterables = None, (fn, *iterables)
+        jobs = (self._job(fn, args, {}) if fn is not None else (args, {}) for args in zip(*iterables))
+        futures = []
+        for chunk in iter(lambda: list(itertools.islice(jobs, chunksize)), []):
+            futures.extend(self._submit_chunk(chunk))
+
+        def result_iterator():
+            try:
+                futures.reverse()
+                while futures:
+                    if end_time is None:
+                        yield futures.pop().result()
+                    else:
+                        yield futures.pop().result(end_time - time.monotonic())
+            finally:
+                for future in futures:
+                    future.cancel()
+        return result_iterator()
+
+    async def _shutdown_client(self):
+        pending = [future for _, futures, _ in self._client.lammps_jobs.values() for future in futures]
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._client.shutdown()
+        await self._client.wait_closed()
+        self._loop.stop()
+
+    def shutdown(self, wait=True):
+        """ Stop accepting jobs and shut down the lammps processes once
+        the submitted jobs have completed
+        """
+        with self._shutdown_lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+        asyncio.run_coroutine_threadsafe(self._shutdown_client(), self._loop)
+        if wait:
+            self._thread.join()
+            if self._main_loop is not None:
+                asyncio.get_child_watcher().attach_loop(self._main_loop)
+                self._loop.close()
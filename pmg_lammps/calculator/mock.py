@@ -0,0 +1,251 @@
+""" Mock lammps executable isolating the overhead of the calculator
+
+Understands just enough of the lammps input language (log, read_data,
+thermo_style, thermo, dump, run, minimize, print, clear, variable,
+shell, label, include, jump SELF, next) for the calculator to run jobs
+and parse the resulting log and dump files filled with synthetic
+values. Reported loop times follow a toy cost model of `neighbor` skin
+and `kspace_style pppm` accuracy, looser accuracies shift the energy.
+Supports `-partition` by forking one process per partition.
+
+Runs sleep for `-mock-delay` seconds plus `-mock-step-delay` seconds
+per step and fail with an error message (`-mock-error-rate`) or crash
+(`-mock-crash-rate`) with the given probability. Only the standard
+library is used so that startup is fast, see `mock_command`.
+"""
+import os
+import re
+import sys
+import time
+import shlex
+import random
+import subprocess
+
+
+MOCK_OPTIONS = {
+    'mock-delay': 0.0,
+    'mock-step-delay': 0.0,
+    'mock-error-rate': 0.0,
+    'mock-crash-rate': 0.0,
+    'mock-seed': None,
+}
+
+
+def mock_command(delay=None, step_delay=None, error_rate=None, crash_rate=None, seed=None):
+    """ Command running the mock lammps executable with the current python """
+    command = [sys.executable, os.path.abspath(__file__)]
+    options = [('mock-delay', delay), ('mock-step-delay', step_delay),
+               ('mock-error-rate', error_rate), ('mock-crash-rate', crash_rate), ('mock-seed', seed)]
+    for option, value in options:
+        if value is not None:
+            command.extend([f'-{option}', str(value)])
+    return ' '.join(shlex.quote(_) for _ in command)
+
+
+class World:
+    def __init__(self, partition, screen, universe, options=None):
+        self.partition = partition
+        self.screen = screen
+        self.universe = universe
+        self.options = dict(MOCK_OPTIONS, **(options or {}))
+        seed = self.options['mock-seed']
+        self.random = random.Random(None if seed is None else int(seed) + partition)
+        self.variables = {}
+        self.log = None
+        self.clear()
+
+    def clear(self):
+        self.natoms = 0
+        self.box = [0.0, 1.0] * 3
+        self.thermo_style = ['step', 'temp', 'epair', 'emol', 'etotal', 'press']
+        self.thermo = 0
+        self.dumps = []
+        self.skin = 1.0
+        self.accuracy = None
+
+    def write(self, text, universe=False):
+        if self.screen:
+            self.screen.write(text)
+            self.screen.flush()
+        if self.log:
+            self.log.write(text)
+            self.log.flush()
+        if universe:
+            os.write(self.universe, text.encode('utf-8'))
+
+    def substitute(self, line):
+        return re.sub(r'\$\{(\w+)\}|\$(\w)', lambda m: self.variables[m.group(1) or m.group(2)], line)
+
+    def execute_lines(self, lines):
+        index = 0
+        while index < len(lines):
+            line = lines[index].split('#')[0].strip()
+            index += 1
+            if not line:
+                continue
+            tokens = shlex.split(self.substitute(line))
+            if tokens[0] == 'jump' and tokens[1] == 'SELF':
+                index = lines.index(f'label {tokens[2]}\n') + 1
+                continue
+            self.execute(tokens)
+
+    def execute(self, tokens):
+        command, args = tokens[0], tokens[1:]
+        if command == 'variable' and args[1] == 'world':
+            self.variables[args[0]] = args[2 + self.partition]
+        elif command == 'variable' and args[1] == 'loop':
+            self.variables[args[0]] = '1'
+        elif command == 'next':
+            self.variables[args[0]] = str(int(self.variables[args[0]]) + 1)
+        elif command == 'shell' and args[0] == 'cd':
+            os.chdir(args[1])
+        elif command == 'shell':
+            subprocess.call(args)
+        elif command == 'log':
+            if self.log:
+                self.log.close()
+            self.log = open(args[0], 'w')
+        elif command == 'include':
+            with open(args[0]) as f:
+                self.execute_lines(f.readlines())
+        elif command == 'print':
+            universe = 'universe' in args[1:] and args[args.index('universe') + 1] == 'yes'
+            self.write(args[0] + '\n', universe=universe)
+        elif command == 'read_data':
+            with open(args[0]) as f:
+                for line in f:
+                    if line.strip().endswith(' atoms'):
+                        self.natoms = int(line.split()[0])
+                    elif line.strip().endswith('xlo xhi'):
+                        self.box[0:2] = map(float, line.split()[:2])
+                    elif line.strip().endswith('ylo yhi'):
+                        self.box[2:4] = map(float, line.split()[:2])
+                    elif line.strip().endswith('zlo zhi'):
+                        self.box[4:6] = map(float, line.split()[:2])
+        elif command == 'thermo_style':
+            self.thermo_style = args[1:]
+        elif command == 'thermo':
+            self.thermo = int(args[0])
+        elif command == 'dump':
+            self.dumps.append((args[4], int(args[3]), args[5:]))
+        elif command == 'neighbor':
+            self.skin = float(args[0])
+        elif command == 'kspace_style' and args[0].startswith('pppm'):
+            self.accuracy = float(args[1])
+        elif command == 'run':
+            self.run(int(args[0]))
+        elif command == 'minimize':
+            self.run(int(args[2]))
+        elif command == 'clear':
+            self.clear()
+        elif command == 'error':
+            self.write(f'ERROR: {" ".join(args)}\n', universe=True)
+            sys.exit(1)
+
+    def value(self, name, step):
+        if name == 'step':
+            return str(step)
+        elif name in {'etotal', 'pe'}:
+            return repr(-1.0 * self.natoms + 100.0 * (self.accuracy or 0.0))
+        return '0.0'
+
+    def loop_time(self):
+        seconds = 0.0001 * (1.0 + abs(self.skin - 1.0))
+        if self.accuracy:
+            seconds *= (1e-5 / self.accuracy) ** 0.25
+        return seconds
+
+    def atom_value(self, column, index):
+        """ Synthetic per atom values: atoms spread over the box at rest """
+        for dimension, name in enumerate('xyz'):
+            if column == name:
+                lo, hi = self.box[2 * dimension:2 * dimension + 2]
+                return repr(lo + (hi - lo) * ((index * (0.6180339887 + 0.1 * dimension)) % 1.0))
+        return '0.0'
+
+    def run(self, steps):
+        if self.random.random() < float(self.options['mock-crash-rate']):
+            os._exit(134)
+        header = [{'etotal': 'TotEng', 'pe': 'PotEng'}.get(_, _.capitalize()) for _ in self.thermo_style]
+        self.write('Per MPI rank memory allocation (min/avg/max) = 1 | 1 | 1 Mbytes\n')
+        self.write(' '.join(header) + '\n')
+        delay = float(self.options['mock-delay']) + float(self.options['mock-step-delay']) * steps
+        if delay > 0:
+            time.sleep(delay)
+        if self.random.random() < float(self.options['mock-error-rate']):
+            self.write('ERROR: mock injected error\n', universe=True)
+            sys.exit(1)
+        thermo_steps = {0, steps} | (set(range(0, steps, self.thermo)) if self.thermo else set())
+        for step in sorted(thermo_steps):
+            self.write(' '.join(self.value(_, step) for _ in self.thermo_style) + '\n')
+        loop_time = self.loop_time() + delay
+        self.write(f'Loop time of {loop_time:g} on 1 procs for {steps} steps with {self.natoms} atoms\n\n')
+        self.write(f'Performance: 8640.000 ns/day, 0.003 hours/ns, {steps / loop_time:.3f} timesteps/s\n')
+        self.write('100.0% CPU use with 1 MPI tasks x no OpenMP threads\n\n')
+        self.write('MPI task timing breakdown:\n')
+        self.write('Section |  min time  |  avg time  |  max time  |%varavg| %total\n')
+        self.write('---------------------------------------------------------------\n')
+        for section, fraction in [('Pair', 0.6), ('Neigh', 0.2), ('Comm', 0.1), ('Output', 0.1)]:
+            seconds = f'{fraction * loop_time:<10.4g}'
+            self.write(f'{section:<8}| {seconds} | {seconds} | {seconds} |   0.0 | {fraction * 100:5.2f}\n')
+        self.write('\nTotal # of neighbors = 0\nNeighbor list builds = 0\nDangerous builds = 0\n')
+        for filename, interval, columns in self.dumps:
+            with open(filename, 'a') as f:
+                for step in sorted({0, steps} | set(range(0, steps, interval))):
+                    f.write(f'ITEM: TIMESTEP\n{step}\nITEM: NUMBER OF ATOMS\n{self.natoms}\n')
+                    f.write('ITEM: BOX BOUNDS pp pp pp\n')
+                    for i in range(3):
+                        f.write(f'{self.box[2*i]} {self.box[2*i+1]}\n')
+                    f.write('ITEM: ATOMS ' + ' '.join(columns) + '\n')
+                    for i in range(self.natoms):
+                        f.write(' '.join([str(i + 1), '1'] + [self.atom_value(_, i) for _ in columns[2:]]) + '\n')
+
+
+def parse_arguments(argv):
+    arguments = {'partition': [], 'in': None, 'log': 'log.lammps', 'screen': None}
+    key = None
+    for arg in argv:
+        if arg.startswith('-'):
+            key = arg.lstrip('-')
+        elif key == 'partition':
+            arguments['partition'].append(arg)
+        elif key:
+            arguments[key] = arg
+    return arguments
+
+
+def main():
+    arguments = parse_arguments(sys.argv[1:])
+    options = {key: arguments[key] for key in MOCK_OPTIONS if key in arguments}
+    if not arguments['partition']:
+        world = World(0, sys.stdout, sys.stdout.fileno(), options)
+        for line in sys.stdin:
+            world.execute_lines([line])
+        return
+
+    num_partitions = sum(int(_.split('x')[0]) if 'x' in _ else 1 for _ in arguments['partition'])
+    children = []
+    for partition in range(num_partitions):
+        pid = os.fork()
+        if pid == 0:
+            screen = None
+            if arguments['screen'] != 'none':
+                screen = open(f'{arguments["screen"]}.{partition}', 'w')
+            world = World(partition, screen, sys.stdout.fileno(), options)
+            with open(arguments['in']) as f:
+                world.execute_lines(f.readlines())
+            os._exit(0)
+        children.append(pid)
+    for _ in children:
+        _, status = os.wait()
+        if status != 0:
+            for child in children:
+                try:
+                    os.kill(child, 9)
+                except ProcessLookupError:
+                    pass
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
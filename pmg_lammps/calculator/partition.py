@@ -0,0 +1,385 @@
+import os
+import re
+import asyncio
+import errno
+import signal
+import shutil
+import tempfile
+import logging
+import time
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+from .accounting import directory_snapshot, written_bytes
+from .affinity import thread_environment
+from .capture import StdoutCapture
+from .process import write_files, parse_results
+from .tracing import tracer
+
+
+DRIVER_SCRIPT = """variable pmg_lammps_partition world {partitions}
+shell cd partition-${{pmg_lammps_partition}}
+log log.lammps
+variable pmg_lammps_job loop 1000000000
+label pmg_lammps_loop
+include input-${{pmg_lammps_job}}.fifo
+next pmg_lammps_job
+jump SELF pmg_lammps_loop
+"""
+
+
+def parse_partitions(partitions):
+    """ Convert a lammps `-partition` specification into a list with the
+    number of mpi ranks in each partition
+
+    "4x16" -> [16, 16, 16, 16], "2x8 4x1" -> [8, 8, 1, 1, 1, 1], "4" -> [4]
+    """
+    if isinstance(partitions, str):
+        partitions = partitions.split()
+    ranks = []
+    for partition in partitions:
+        if isinstance(partition, int):
+            ranks.append(partition)
+            continue
+        num_partitions, _, num_ranks = str(partition).rpartition('x')
+        num_partitions = int(num_partitions or 1)
+        num_ranks = int(num_ranks)
+        if num_partitions < 1 or num_ranks < 1:
+            raise ValueError(f'invalid lammps partition {partition}')
+        ranks.extend([num_ranks] * num_partitions)
+    if not ranks:
+        raise ValueError('must specify at least one lammps partition')
+    return ranks
+
+
+class LammpsPartitionProcess:
+    """ Run many independent lammps jobs inside a single mpi launch
+
+    Lammps is started with `-partition` and every partition is an
+    independent job slot. Each partition runs in its own directory and
+    reads jobs in a loop from named pipes `input-<n>.fifo`. A new pipe
+    is used for every job so that the next job can never be written
+    into a pipe lammps is about to close. Completed jobs are announced
+    on the universe screen (stdout of the launch) while each partition
+    writes its own screen file.
+
+    Jobs are read from `pending_queues` keyed by the number of ranks of
+    the partition. Results are parsed with `parse_executor` when given.
+
+    A job past its `timeout` or cancelled while running can only be
+    stopped by restarting the whole launch. Jobs of the other partitions
+    are then requeued, at most `MAX_RETRIES` times each.
+
+    `threads` limits the openmp and math library threads of every rank,
+    binding ranks to cpus is left to `mpirun`. Screen output is captured
+    as in `LammpsProcess`. Cpu time and memory of the ranks of a
+    partition are not separated from the launch, only the bytes written
+    by a job are reported in its `resources`.
+    """
+    MAX_RETRIES = 3
+
+    def __init__(self, command=None, partitions='1x1', mpirun='mpirun', parse_executor=None, cancelled=None, threads=None,
+                 stdout_directory=None):
+        self.directory = tempfile.mkdtemp()
+        self.threads = threads
+        self.stdout_directory = stdout_directory or os.path.join(tempfile.gettempdir(), 'pmg-lammps-stdout')
+        self.parse_executor = parse_executor
+        self.cancelled = cancelled if cancelled is not None else set()
+        self.metrics = {'jobs': 0, 'errors': 0, 'timeouts': 0, 'cancelled': 0, 'crashes': 0, 'restarts': 0, 'busy_seconds': 0.0}
+        self.command = shlex.split(command or 'lammps')
+        self.mpirun = shlex.split(mpirun) if mpirun else []
+        self.partitions = parse_partitions(partitions)
+        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        if not shutil.which(self.command[0]):
+            raise ValueError(f'lammps executable {self.command[0]} does not exist')
+        if self.mpirun and not shutil.which(self.mpirun[0]):
+            raise ValueError(f'mpi executable {self.mpirun[0]} does not exist')
+
+    @property
+    def num_ranks(self):
+        return sum(self.partitions)
+
+    def partition_directory(self, partition):
+        return os.path.join(self.directory, f'partition-{partition}')
+
+    async def create(self, pending_queues, completed_queue):
+        self.pending_queues = pending_queues
+        self.completed_queue = completed_queue
+        self._executor = ThreadPoolExecutor(max_workers=len(self.partitions))
+        self._shutdown = False
+        for partition in range(len(self.partitions)):
+            os.makedirs(self.partition_directory(partition))
+        with open(os.path.join(self.directory, 'driver.in'), 'w') as f:
+            f.write(DRIVER_SCRIPT.format(partitions=' '.join(str(_) for _ in range(len(self.partitions)))))
+        self._running = asyncio.Event()
+        self._running_jobs = {}
+        self._waiting_jobs = {}
+        self._cancelling = set()
+        await self._start_lammps_process()
+        self._job_tasks = [asyncio.ensure_future(self._handle_jobs(partition)) for partition in range(len(self.partitions))]
+
+    def shutdown(self):
+        self._shutdown = True
+        for task in self._job_tasks + [self._monitor_task]:
+            task.cancel()
+        self._kill()
+        self._executor.shutdown(wait=False)
+        shutil.rmtree(self.directory)
+
+    async def wait_closed(self):
+        await self.process.wait()
+
+    def cancel(self, job_id):
+        """ Stop the job `job_id` if it is running on a partition """
+        for running_job_id, task in self._running_jobs.values():
+            if running_job_id == job_id:
+                self._cancelling.add(job_id)
+                task.cancel()
+                return True
+        if job_id in self._waiting_jobs.values():
+            # dequeued while lammps restarts, skipped once it is up
+            self.cancelled.add(job_id)
+            return True
+        return False
+
+    def _kill(self):
+        """ Kill the lammps launch along with all of its ranks """
+        if self.process.returncode is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def _partition_arguments(self):
+        arguments, previous, count = [], None, 0
+        for num_ranks in self.partitions + [None]:
+            if num_ranks != previous and previous is not None:
+                arguments.append(f'{count}x{previous}')
+                count = 0
+            previous = num_ranks
+            count += 1
+        return arguments
+
+    async def _start_lammps_process(self):
+        mpirun = [*self.mpirun, '-np', str(self.num_ranks)] if self.mpirun else []
+        command = [
+            *mpirun, *self.command,
+            '-partition', *self._partition_arguments(),
+            '-in', 'driver.in', '-log', 'none', '-screen', 'screen'
+        ]
+        self.logger.info(f'starting lammps with {len(self.partitions)} partitions: {" ".join(command)}')
+        self.process = await asyncio.create_subprocess_exec(
+            *command, cwd=self.directory,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=dict(os.environ, **thread_environment(self.threads)) if self.threads is not None else None,
+            start_new_session=True)
+        self._markers = {}
+        self._fifo_index = [1] * len(self.partitions)
+        for partition in range(len(self.partitions)):
+            self._make_fifo(partition, 1)
+        self._monitor_task = asyncio.ensure_future(self._monitor_universe(self.process))
+        self._running.set()
+
+    async def _monitor_universe(self, process):
+        lammps_job_regex = re.compile(b"^={5}(.{32})={5}\n$")
+        async for line in process.stdout:
+            match = lammps_job_regex.match(line)
+            if match:
+                future = self._markers.pop(match.group(1).decode(), None)
+                if future and not future.done():
+                    future.set_result(True)
+            elif b'ERROR' in line:
+                self.logger.warning(f'lammps universe error: {line.decode(errors="replace").strip()}')
+        await process.wait()
+        self._running.clear()
+        for future in self._markers.values():
+            if not future.done():
+                future.set_exception(ValueError('lammps process terminated'))
+        self._markers = {}
+        if not self._shutdown:
+            self.logger.warning(f'lammps partitions exited with code {process.returncode} restarting')
+            self.metrics['restarts'] += 1
+            await self._start_lammps_process()
+
+    def _fifo_filename(self, partition, index):
+        return os.path.join(self.partition_directory(partition), f'input-{index}.fifo')
+
+    def _make_fifo(self, partition, index):
+        filename = self._fifo_filename(partition, index)
+        if not os.path.exists(filename):
+            os.mkfifo(filename)
+
+    async def _open_fifo(self, filename, process):
+        """ Open named pipe once the partition is reading from it
+
+        A blocking open would hang forever if the lammps launch exits
+        before the partition reaches its next `include`.
+        """
+        while True:
+            try:
+                fd = os.open(filename, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as error:
+                if error.errno != errno.ENXIO:
+                    raise
+                if process.returncode is not None:
+                    raise ValueError('lammps process terminated')
+                await asyncio.sleep(0.001)
+            else:
+                os.set_blocking(fd, True)
+                return fd
+
+    def _write_stdin(self, fd, lammps_job_input):
+        with os.fdopen(fd, 'wb') as f:
+            f.write((
+                f'{lammps_job_input["stdin"]}'
+                f'\nprint "====={lammps_job_input["id"]}=====" universe yes\nclear\n'
+            ).encode('utf-8'))
+            f.write(b'\nprint "' + b'hack to force flush' * 500 + b'" universe yes\n')
+
+    def _read_stdout(self, partition, offset, lammps_job_input, lammps_job_output, completed):
+        capture = StdoutCapture(
+            lammps_job_input.get('capture'),
+            os.path.join(self.stdout_directory, f'{lammps_job_input["id"]}.stdout'))
+        capture.completed = completed
+        try:
+            with open(os.path.join(self.directory, f'screen.{partition}'), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if b'hack to force flush' not in line:
+                        capture.append(line)
+        except FileNotFoundError:
+            pass
+        finally:
+            capture.close()
+        lammps_job_output['stdout'] = capture.output()
+        if capture.filename is not None:
+            lammps_job_output['stdout_file'] = capture.filename
+        return lammps_job_output['stdout']
+
+    def _screen_offset(self, partition):
+        try:
+            return os.path.getsize(os.path.join(self.directory, f'screen.{partition}'))
+        except FileNotFoundError:
+            return 0
+
+    async def _run_job(self, partition, lammps_job_input, lammps_job_output):
+        loop = asyncio.get_event_loop()
+        directory = self.partition_directory(partition)
+        process = self.process
+        marker = loop.create_future()
+        self._markers[lammps_job_input['id']] = marker
+        timings = lammps_job_output['timings']
+        start_time = time.perf_counter()
+        await loop.run_in_executor(
+            self._executor, write_files,
+            directory, lammps_job_input['files'], lammps_job_input.get('links'))
+        offset = self._screen_offset(partition)
+        snapshot = await loop.run_in_executor(self._executor, directory_snapshot, directory)
+        lammps_job_output['resources'] = {'cpu_seconds': None, 'peak_rss_bytes': None, 'written_bytes': None}
+        index = self._fifo_index[partition]
+        try:
+            # lammps moves on to the next pipe as soon as this job is read
+            self._make_fifo(partition, index + 1)
+            fd = await self._open_fifo(self._fifo_filename(partition, index), process)
+            self._fifo_index[partition] = index + 1
+            try:
+                await loop.run_in_executor(self._executor, self._write_stdin, fd, lammps_job_input)
+                timings['write'] = time.perf_counter() - start_time
+                tracer().add_duration('process.write', lammps_job_output['id'], timings['write'], partition=partition)
+                self.logger.debug(f'lammps job {lammps_job_output["id"]} partition {partition} writing inputs {timings["write"]} [sec]')
+                start_time = time.perf_counter()
+                await asyncio.wait_for(marker, lammps_job_input.get('timeout'))
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                if process.returncode is None and not self._shutdown:
+                    self.logger.warning(f'lammps job {lammps_job_input["id"]} stopped restarting lammps partitions')
+                    self._kill()
+                raise
+            os.remove(self._fifo_filename(partition, index))
+            self._read_stdout(partition, offset, lammps_job_input, lammps_job_output, completed=True)
+            lammps_job_output['resources']['written_bytes'] = await loop.run_in_executor(
+                self._executor, written_bytes, directory, snapshot)
+            timings['execute'] = time.perf_counter() - start_time
+            tracer().add_duration('process.execute', lammps_job_output['id'], timings['execute'], partition=partition)
+            self.logger.debug(f'lammps job {lammps_job_output["id"]} partition {partition} completed in {timings["execute"]} [sec]')
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # before OSError since TimeoutError subclasses it on python >= 3.8
+            self._markers.pop(lammps_job_input['id'], None)
+            raise
+        except (ValueError, OSError):
+            self._markers.pop(lammps_job_input['id'], None)
+            lammps_job_output['resources']['written_bytes'] = written_bytes(directory, snapshot)
+            if b'ERROR' in self._read_stdout(partition, offset, lammps_job_input, lammps_job_output, completed=False):
+                raise ValueError('error executing script')
+            raise ValueError('lammps process terminated')
+        start_time = time.perf_counter()
+        if self.parse_executor is None:
+            results = parse_results(directory, lammps_job_input)
+        else:
+            lammps_job_input = {key: lammps_job_input[key] for key in ('id', 'stdin', 'properties')}
+            results = await loop.run_in_executor(self.parse_executor, parse_results, directory, lammps_job_input)
+        lammps_job_output['results'].update(results)
+        timings['parse'] = time.perf_counter() - start_time
+        tracer().add_duration('process.parse', lammps_job_output['id'], timings['parse'], partition=partition)
+        self.logger.debug(f'lammps job {lammps_job_output["id"]} partition {partition} processing results {timings["parse"]} [sec]')
+
+    async def _handle_jobs(self, partition):
+        pending_queue = self.pending_queues[self.partitions[partition]]
+        while True:
+            client_id, lammps_job_input = await pending_queue.get()
+            self._waiting_jobs[partition] = lammps_job_input['id']
+            try:
+                await self._running.wait()
+            finally:
+                self._waiting_jobs.pop(partition, None)
+            if lammps_job_input['id'] in self.cancelled:
+                # answered without running so that callers release the job
+                self.cancelled.discard(lammps_job_input['id'])
+                lammps_job_output = {'id': lammps_job_input['id'], 'stdout': None, 'results': {}, 'error': 'lammps job cancelled', 'timings': {}}
+                await self.completed_queue.put((client_id, lammps_job_output))
+                pending_queue.task_done()
+                continue
+            lammps_job_output = {'id': lammps_job_input['id'], 'stdout': None, 'results': {}, 'error': None, 'timings': {},
+                                 'placement': {'cpus': None, 'numa_node': None, 'ranks': self.partitions[partition], 'threads': self.threads}}
+            if 'queued_at' in lammps_job_input:
+                lammps_job_output['timings']['queue'] = time.monotonic() - lammps_job_input['queued_at']
+                tracer().add_duration('process.queue', lammps_job_output['id'], lammps_job_output['timings']['queue'])
+            start_time = time.perf_counter()
+            task = asyncio.ensure_future(self._run_job(partition, lammps_job_input, lammps_job_output))
+            self._running_jobs[partition] = (lammps_job_input['id'], task)
+            try:
+                await task
+            except asyncio.CancelledError:
+                if lammps_job_input['id'] not in self._cancelling:
+                    raise # shutdown
+                self._cancelling.discard(lammps_job_input['id'])
+                self.metrics['cancelled'] += 1
+                lammps_job_output['error'] = 'lammps job cancelled'
+            except asyncio.TimeoutError:
+                self.metrics['timeouts'] += 1
+                lammps_job_output['error'] = f'lammps job timed out after {lammps_job_input["timeout"]} [sec]'
+            except ValueError as error:
+                retries = lammps_job_input.get('retries', 0)
+                if str(error) == 'lammps process terminated' and retries < self.MAX_RETRIES:
+                    # job was lost with the lammps launch and likely not at fault
+                    self.logger.warning(f'lammps job {lammps_job_input["id"]} interrupted requeueing')
+                    self.metrics['crashes'] += 1
+                    pending_queue.task_done()
+                    await pending_queue.put((client_id, dict(lammps_job_input, retries=retries + 1)))
+                    continue
+                self.logger.warning(f'lammps job {lammps_job_input["id"]} failed on partition {partition}')
+                lammps_job_output['error'] = str(error)
+            except Exception as error:
+                self.logger.exception(f'lammps job {lammps_job_input["id"]} failed on partition {partition}')
+                lammps_job_output['error'] = f'{error.__class__.__name__}: {error}'
+            finally:
+                self._running_jobs.pop(partition, None)
+                self.metrics['busy_seconds'] += time.perf_counter() - start_time
+            if lammps_job_output['error'] is not None:
+                self.metrics['errors'] += 1
+            elif hasattr(pending_queue, 'record'): # runtime history of `LammpsJobQueue`
+                pending_queue.record(lammps_job_input, lammps_job_output['timings']['execute'])
+            self.metrics['jobs'] += 1
+            await self.completed_queue.put((client_id, lammps_job_output))
+            pending_queue.task_done()
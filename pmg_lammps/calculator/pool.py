@@ -0,0 +1,316 @@
+import re
+import asyncio
+import itertools
+import multiprocessing
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .affinity import cpu_layout
+from .process import LammpsProcess
+from .scheduling import LammpsJobQueue, RuntimeHistory, merge_queue_stats
+from .partition import LammpsPartitionProcess, parse_partitions
+
+
+def job_num_atoms(lammps_job_input):
+    """ Number of atoms in the data file read by a lammps job (None if unknown)
+
+    Only the header of the data file (possibly a linked blob) is inspected.
+    """
+    data_filenames = []
+    for line in lammps_job_input['stdin'].split('\n'):
+        tokens = line.split()
+        if len(tokens) > 1 and tokens[0] == 'read_data':
+            data_filenames.append(tokens[1])
+
+    atoms_regex = re.compile(r'^\s*(\d+)\s+atoms\s*$')
+    links = lammps_job_input.get('links') or {}
+    for filename in data_filenames:
+        content = lammps_job_input['files'].get(filename)
+        if content is None and filename in links:
+            with open(links[filename]) as f:
+                content = ''.join(itertools.islice(f, 64))
+        if content is None:
+            continue
+        for line in content.split('\n', 64)[:64]:
+            match = atoms_regex.match(line)
+            if match:
+                return int(match.group(1))
+    return None
+
+
+def job_cost(lammps_job_input):
+    """ Estimated cost of a lammps job in atoms
+
+    A user supplied `cost_hint` takes precedence over the atom count.
+    """
+    cost_hint = lammps_job_input.get('cost_hint')
+    if cost_hint is not None:
+        return cost_hint
+    return job_num_atoms(lammps_job_input)
+
+
+class LammpsPool:
+    """ A set of lammps job slots with possibly different widths (mpi ranks)
+
+    Slots are given in lammps `-partition` syntax e.g. "8x1 2x8" is 8
+    serial processes and 2 processes run with `mpirun -np 8`. With
+    `partitions` all slots live inside a single `mpirun` launch. Each
+    job is routed to the widest slot that still keeps at least
+    `atoms_per_rank` atoms (or cost units) on every rank.
+
+    Input files are written from a thread pool and results are parsed
+    in a pool of `parse_processes` processes (default one per slot up to
+    the number of cpus, 0 parses inside the event loop).
+
+    The slots are the most processes the pool runs. With `min_workers`
+    only that many processes of each width are started up front. More
+    are started while the queued work (queue depth times the measured
+    job runtime) would take longer to drain than starting a process and
+    processes idle for `idle_timeout` seconds are stopped again. Not
+    available with `partitions`.
+
+    With `pin` ('compact' or 'spread' see `cpu_layout`) every process is
+    pinned to its own numa aware set of cpus and `threads_per_rank` sets
+    `OMP_NUM_THREADS` (and related variables) for each rank.
+
+    Queued jobs are ordered by priority class, fair share between
+    submitters (weighted by `shares`) and shortest estimated runtime
+    learned per script template, see `LammpsJobQueue`.
+
+    Screen output of jobs captured to files is written to
+    `stdout_directory` (see `StdoutCapture`).
+    """
+    DEFAULT_ATOMS_PER_RANK = 1000
+    SCALE_INTERVAL = 0.1
+
+    def __init__(self, command=None, num_workers=None, slots=None, partitions=None,
+                 mpirun='mpirun', atoms_per_rank=DEFAULT_ATOMS_PER_RANK, parse_processes=None,
+                 min_workers=None, idle_timeout=None, pin=None, threads_per_rank=None, shares=None,
+                 stdout_directory=None):
+        if slots and partitions:
+            raise ValueError('cannot specify both slots and partitions')
+        if partitions and (min_workers is not None or idle_timeout is not None):
+            raise ValueError('autoscaling is not supported with partitions')
+        if partitions and pin:
+            raise ValueError('cpu pinning is not supported with partitions')
+        if threads_per_rank is not None and threads_per_rank < 1:
+            raise ValueError('threads_per_rank must be positive')
+        if min_workers is not None and min_workers < 0:
+            raise ValueError('min_workers must not be negative')
+        self.command = command
+        self.mpirun = mpirun
+        self.partitions = partitions
+        self.atoms_per_rank = atoms_per_rank
+        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        if partitions:
+            self.slots = parse_partitions(partitions)
+        elif slots:
+            self.slots = parse_partitions(slots)
+        else:
+            self.slots = [1] * (num_workers or multiprocessing.cpu_count())
+        if self.num_ranks * (threads_per_rank or 1) > multiprocessing.cpu_count():
+            raise ValueError('cannot have more workers than cpus')
+        self.pin = pin
+        self.threads_per_rank = threads_per_rank
+        self.layout = cpu_layout(self.slots, threads_per_rank or 1, pin) if pin else None
+        self.widths = sorted(set(self.slots))
+        if parse_processes is None:
+            parse_processes = min(self.num_slots, multiprocessing.cpu_count())
+        self.parse_processes = parse_processes
+        self.min_workers = min_workers
+        self.idle_timeout = idle_timeout
+        self.shares = shares
+        self.stdout_directory = stdout_directory
+        self.history = RuntimeHistory()
+
+    @property
+    def num_slots(self):
+        return len(self.slots)
+
+    @property
+    def num_ranks(self):
+        return sum(self.slots)
+
+    @property
+    def autoscaling(self):
+        return self.min_workers is not None or self.idle_timeout is not None
+
+    def max_processes(self, width):
+        return self.slots.count(width)
+
+    def min_processes(self, width):
+        if self.min_workers is None:
+            return self.max_processes(width)
+        return min(self.min_workers, self.max_processes(width))
+
+    async def create(self, completed_queue):
+        self.pending_queues = {
+            width: LammpsJobQueue(history=self.history, cost=job_cost, shares=self.shares)
+            for width in self.widths
+        }
+        self.completed_queue = completed_queue
+        self._processes = []
+        self._stopped_processes = []
+        self._stopped_metrics = {}
+        self._start_times = []
+        self._starting = {width: 0 for width in self.widths}
+        self._cancelled = set()
+        self._free_cpus = {width: [] for width in self.widths}
+        for width, cpus in zip(self.slots, self.layout or []):
+            self._free_cpus[width].append(cpus)
+        self.io_executor = ThreadPoolExecutor(max_workers=self.num_slots)
+        self._parse_executor = None
+        self._parse_shutdown = None
+        if self.parse_processes:
+            self._parse_executor = ProcessPoolExecutor(max_workers=self.parse_processes)
+        if self.partitions:
+            self.logger.info(f'creating lammps process with {self.num_slots} partitions')
+            process = LammpsPartitionProcess(
+                command=self.command, partitions=self.partitions, mpirun=self.mpirun,
+                parse_executor=self._parse_executor, cancelled=self._cancelled,
+                threads=self.threads_per_rank, stdout_directory=self.stdout_directory)
+            await process.create(self.pending_queues, completed_queue)
+            self._processes.append(process)
+        else:
+            self.logger.info(f'creating {self.num_slots} lammps processes with widths {self.slots}')
+            for width in self.widths:
+                for _ in range(self.min_processes(width)):
+                    await self._start_process(width)
+        self._autoscale_task = None
+        if self.autoscaling:
+            self._autoscale_task = asyncio.ensure_future(self._autoscale())
+
+    async def _start_process(self, width):
+        start_time = time.perf_counter()
+        cpus = self._free_cpus[width].pop(0) if self._free_cpus[width] else None
+        process = LammpsProcess(
+            command=self.command, ranks=width, mpirun=self.mpirun,
+            io_executor=self.io_executor, parse_executor=self._parse_executor,
+            cancelled=self._cancelled, cpus=cpus, threads=self.threads_per_rank,
+            stdout_directory=self.stdout_directory)
+        self._starting[width] += 1
+        try:
+            await process.create(self.pending_queues[width], self.completed_queue)
+        except Exception:
+            if cpus is not None:
+                self._free_cpus[width].append(cpus)
+            raise
+        finally:
+            self._starting[width] -= 1
+        self._processes.append(process)
+        self._start_times.append(time.perf_counter() - start_time)
+        return process
+
+    def _stop_process(self, process):
+        process.shutdown()
+        self._processes.remove(process)
+        self._stopped_processes.append(process)
+        if process.cpus is not None:
+            self._free_cpus[process.ranks].append(process.cpus)
+        for key, value in process.metrics.items():
+            self._stopped_metrics[key] = self._stopped_metrics.get(key, 0) + value
+
+    def processes(self, width):
+        return [process for process in self._processes if process.ranks == width]
+
+    def mean_runtime(self):
+        """ Measured mean wall time of a job (None before the first job) """
+        metrics = self.metrics()
+        if not metrics.get('jobs'):
+            return None
+        return metrics['busy_seconds'] / metrics['jobs']
+
+    def _scale_up(self, width):
+        """ Whether another process of `width` should be started """
+        processes = self.processes(width)
+        if len(processes) + self._starting[width] >= self.max_processes(width):
+            return False
+        queue_depth = self.pending_queues[width].qsize()
+        idle = sum(not process.busy for process in processes)
+        if queue_depth <= idle:
+            return False
+        runtime = self.mean_runtime()
+        if runtime is None or not processes:
+            return True
+        # start a process when the queued work takes longer to drain
+        # with the running processes than starting a new one
+        start_time = sum(self._start_times) / len(self._start_times)
+        return queue_depth * runtime / len(processes) > start_time + runtime
+
+    async def _autoscale(self):
+        while True:
+            for width in self.widths:
+                while self._scale_up(width):
+                    self.logger.info(f'starting lammps process of width {width} queue depth {self.pending_queues[width].qsize()}')
+                    await self._start_process(width)
+                if self.idle_timeout is None:
+                    continue
+                now = time.monotonic()
+                for process in self.processes(width):
+                    if len(self.processes(width)) <= self.min_processes(width):
+                        break
+                    if not process.busy and now - process.idle_since > self.idle_timeout and self.pending_queues[width].empty():
+                        self.logger.info(f'stopping lammps process of width {width} idle for {now - process.idle_since:.1f} [sec]')
+                        self._stop_process(process)
+            await asyncio.sleep(self.SCALE_INTERVAL)
+
+    def shutdown(self):
+        if self._autoscale_task is not None:
+            self._autoscale_task.cancel()
+        for process in self._processes:
+            process.shutdown()
+        if self._parse_executor is not None:
+            # python 3.7 fails to shut down a process pool without
+            # waiting so it is waited for off the loop (see wait_closed)
+            self._parse_shutdown = asyncio.get_event_loop().run_in_executor(
+                self.io_executor, self._parse_executor.shutdown)
+        self.io_executor.shutdown(wait=False)
+
+    async def wait_closed(self):
+        for process in self._processes + self._stopped_processes:
+            await process.wait_closed()
+        if self._parse_shutdown is not None:
+            await self._parse_shutdown
+
+    def cancel(self, job_id):
+        """ Stop a running job or skip it once it is dequeued
+
+        Jobs neither running nor queued have completed and are ignored.
+        """
+        if any(process.cancel(job_id) for process in self._processes):
+            return
+        if any(job_id in queue for queue in self.pending_queues.values()):
+            self._cancelled.add(job_id)
+
+    def metrics(self):
+        """ Job and supervision counters (restarts, timeouts, crashes, ...) summed over processes """
+        metrics = dict(self._stopped_metrics)
+        for process in self._processes:
+            for key, value in process.metrics.items():
+                metrics[key] = metrics.get(key, 0) + value
+        metrics['processes'] = len(self._processes)
+        return metrics
+
+    def queue_stats(self):
+        """ Queue wait times per priority class see `LammpsJobQueue.stats` """
+        return merge_queue_stats(queue.stats() for queue in self.pending_queues.values())
+
+    def route(self, lammps_job_input):
+        """ Width of the slot a lammps job should run on """
+        cost = job_cost(lammps_job_input)
+        if cost is None:
+            return self.widths[0]
+        return max([width for width in self.widths if cost >= width * self.atoms_per_rank], default=self.widths[0])
+
+    async def put(self, client_id, lammps_job_input):
+        """ Queue a lammps job dict, its output dict is put on the
+        completed queue as `(client_id, lammps_job_output)`
+        """
+        width = self.route(lammps_job_input)
+        self.logger.debug(f'lammps job {lammps_job_input["id"]} routed to slot width {width}')
+        lammps_job_input['queued_at'] = time.monotonic()
+        await self.pending_queues[width].put((client_id, lammps_job_input))
+        if self.autoscaling and self._scale_up(width):
+            # do not wait for the next autoscaling round to serve a burst
+            await self._start_process(width)
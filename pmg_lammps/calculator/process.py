@@ -3,54 +3,225 @@ import re
 import asyncio
 import shutil
 import tempfile
-import pickle
 import logging
 import time
 import shlex
+import functools
 
+from .accounting import directory_snapshot, process_usage, reset_peak_rss, written_bytes
+from .affinity import numa_node, thread_environment
+from .blobs import link_blob
+from .capture import StdoutCapture
+from .tracing import tracer
 from ..output import LammpsDump, LammpsLog
 
 
+def write_files(directory, files, links=None):
+    """ Write input files of a lammps job into `directory`
+
+    `links` maps filenames to blobs that are hard linked instead. Files
+    are replaced rather than truncated so a linked blob is never
+    overwritten.
+    """
+    for filename, content in files.items():
+        path = os.path.join(directory, filename)
+        if os.path.lexists(path):
+            os.remove(path)
+        with open(path, 'w') as f:
+            f.write(content)
+    for filename, source in (links or {}).items():
+        link_blob(source, os.path.join(directory, filename))
+
+
+def parse_results(directory, lammps_job_input):
+    """ Collect requested properties from the log and dump files of a
+    completed lammps job in `directory`
+
+    Array properties are returned as numpy arrays. `performance` is the
+    performance summary of every run (see `LammpsLog.performance`).
+    """
+    log_filename = 'log.lammps'
+    dump_filename = None
+    for line in lammps_job_input['stdin'].split('\n'):
+        tokens = line.split()
+        if len(tokens) == 0:
+            continue
+        if tokens[0] == 'log':
+            log_filename = tokens[1]
+        elif tokens[0] == 'dump':
+            dump_filename = tokens[5]
+
+    lammps_log = LammpsLog(os.path.join(directory, log_filename))
+    if dump_filename is None and ({'forces', 'lattice', 'positions', 'velocities'} & lammps_job_input['properties'] != set()):
+        raise ValueError('requested properties require dump file')
+    elif dump_filename:
+        lammps_dump = LammpsDump(os.path.join(directory, dump_filename))
+
+    results = {}
+    if 'stress' in lammps_job_input['properties']:
+        results['stress'] = lammps_log.get_stress(-1)
+    if 'energy' in lammps_job_input['properties']:
+        results['energy'] = lammps_log.get_energy(-1)
+    if 'performance' in lammps_job_input['properties']:
+        results['performance'] = lammps_log.performance
+    if 'forces' in lammps_job_input['properties']:
+        results['forces'] = lammps_dump.get_forces(-1)
+    if 'lattice' in lammps_job_input['properties']:
+        results['lattice'] = lammps_dump.get_lammps_box(-1).lattice.matrix
+    if 'positions' in lammps_job_input['properties']:
+        results['positions'] = lammps_dump.get_positions(-1)
+    if 'velocities' in lammps_job_input['properties']:
+        results['velocities'] = lammps_dump.get_velocities(-1)
+    return results
+
+
+def usage_baseline(directory, pid):
+    """ Snapshot of `directory` and cpu time of process `pid` before a job """
+    snapshot = directory_snapshot(directory)
+    reset_peak_rss(pid)
+    cpu_seconds, _ = process_usage(pid)
+    return snapshot, cpu_seconds
+
+
+def job_resources(directory, pid, snapshot, cpu_seconds):
+    """ Resources used by a job since `usage_baseline` """
+    end_cpu_seconds, peak_rss_bytes = process_usage(pid)
+    return {
+        'cpu_seconds': end_cpu_seconds - cpu_seconds if None not in (cpu_seconds, end_cpu_seconds) else None,
+        'peak_rss_bytes': peak_rss_bytes,
+        'written_bytes': written_bytes(directory, snapshot),
+    }
+
+
 class LammpsProcess:
-    def __init__(self, command=None):
+    """ A persistent lammps process that runs jobs read from stdin
+
+    With `ranks` greater than one lammps is started through `mpirun`
+    (rank 0 receives stdin). Input files are written with `io_executor`
+    and log/dump files parsed with `parse_executor` (e.g. a process pool)
+    when given so that the event loop shared by many lammps processes
+    is not blocked.
+
+    The process is supervised: it is restarted after a lammps error, a
+    crash, a job running past its `timeout` or a cancelled running job.
+    Jobs lost in a crash are requeued up to `MAX_RETRIES` times. Queued
+    jobs whose id is in `cancelled` are skipped (answered with an error).
+
+    The process (along with its mpi ranks) is pinned to `cpus` when
+    given and `threads` limits the openmp and math library threads of
+    every rank. The placement is recorded in the output of each job.
+
+    The screen output of a job is captured according to its `capture`
+    mode (see `StdoutCapture`), spilled files are written to
+    `stdout_directory`.
+
+    Each output reports the cpu time and peak resident memory of the
+    lammps process tree while running the job and the bytes it wrote
+    to the job directory (`resources`) along with the time spent in the
+    queue, writing inputs, executing and parsing results (`timings`).
+    """
+    MAX_RETRIES = 1
+
+    def __init__(self, command=None, ranks=1, mpirun='mpirun', io_executor=None, parse_executor=None, cancelled=None,
+                 cpus=None, threads=None, stdout_directory=None):
         self.directory = tempfile.mkdtemp()
+        self.stdout_directory = stdout_directory or os.path.join(tempfile.gettempdir(), 'pmg-lammps-stdout')
         self.command = shlex.split(command or 'lammps')
+        self.ranks = ranks
+        self.cpus = sorted(cpus) if cpus else None
+        self.threads = threads
+        self.placement = {
+            'cpus': self.cpus,
+            'numa_node': numa_node(self.cpus) if self.cpus else None,
+            'ranks': ranks,
+            'threads': threads,
+        }
+        self.io_executor = io_executor
+        self.parse_executor = parse_executor
+        self.cancelled = cancelled if cancelled is not None else set()
+        self.metrics = {'jobs': 0, 'errors': 0, 'timeouts': 0, 'cancelled': 0, 'crashes': 0, 'restarts': 0, 'busy_seconds': 0.0}
         self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
         if not shutil.which(self.command[0]): # simple test
             raise ValueError(f'lammps executable {self.command[0]} does not exist')
+        if ranks > 1:
+            mpirun = shlex.split(mpirun or 'mpirun')
+            if not shutil.which(mpirun[0]):
+                raise ValueError(f'mpi executable {mpirun[0]} does not exist')
+            self.command = [*mpirun, '-np', str(ranks), *self.command]
 
     async def create(self, pending_queue, completed_queue):
         self.process = await self.create_lammps_process()
         self.pending_queue = pending_queue
         self.completed_queue = completed_queue
+        self._running_job = None
+        self._cancelling = None
+        self.idle_since = time.monotonic()
         self._job_task = asyncio.ensure_future(self._handle_jobs())
 
     def shutdown(self):
-        self.process.kill() # TODO: not very nice
+        self._job_task.cancel()
+        if self.process.returncode is None:
+            self.process.kill() # TODO: not very nice
         shutil.rmtree(self.directory)
 
+    async def wait_closed(self):
+        await self.process.wait()
+
     async def create_lammps_process(self):
+        env = None
+        if self.threads is not None:
+            env = dict(os.environ, **thread_environment(self.threads, pinned=self.cpus is not None))
+        preexec_fn = None
+        if self.cpus is not None:
+            # pinned before exec so that mpi ranks inherit the cpu set
+            preexec_fn = functools.partial(os.sched_setaffinity, 0, self.cpus)
         process =  await asyncio.create_subprocess_exec(
             *self.command, cwd=self.directory,
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT)
+            stderr=asyncio.subprocess.STDOUT,
+            env=env, preexec_fn=preexec_fn)
         # check that lammps process started properly (using print statement)
         return process
 
-    def _write_inputs(self, lammps_job_input):
-        self.logger.debug(f'lammps job {lammps_job_input["id"]} writing stdin and files {lammps_job_input["files"].keys()}')
-        for filename, content in lammps_job_input['files'].items():
-            with open(os.path.join(self.directory, filename), 'w') as f:
-                f.write(content)
+    async def restart_lammps_process(self):
+        self.logger.warning('restarting lammps process')
+        if self.process.returncode is None:
+            self.process.kill()
+        await self.process.wait()
+        self.process = await self.create_lammps_process()
+        self.metrics['restarts'] += 1
+
+    @property
+    def busy(self):
+        return self._running_job is not None
+
+    def cancel(self, job_id):
+        """ Stop the running job if it is `job_id` """
+        if self._running_job is not None and self._running_job[0] == job_id:
+            self._cancelling = job_id
+            self._running_job[1].cancel()
+            return True
+        return False
+
+    async def _run_io(self, function, *args):
+        if self.io_executor is None:
+            return function(*args)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.io_executor, function, *args)
+
+    async def _write_files(self, lammps_job_input):
+        self.logger.debug(f'lammps job {lammps_job_input["id"]} writing files {lammps_job_input["files"].keys()}')
+        await self._run_io(write_files, self.directory, lammps_job_input['files'], lammps_job_input.get('links'))
+
+    def _write_stdin(self, lammps_job_input):
         self.process.stdin.write((
             f'{lammps_job_input["stdin"]}'
             f'\nprint "====={lammps_job_input["id"]}====="\nclear\n'
         ).encode('utf-8'))
         self.process.stdin.write(b'\nprint "' + b'hack to force flush' * 500 + b'"\n')
 
-    async def _monitor_job(self, lammps_job_output):
-        lammps_job_buffer = []
+    async def _monitor_job(self, lammps_job_output, capture):
         lammps_job_regex = re.compile(b"^={5}(.{32})={5}\n$")
         self.logger.debug(f'monitoring running lammps job {lammps_job_output["id"]}')
         async for line in self.process.stdout:
@@ -58,72 +229,118 @@ class LammpsProcess:
             if match:
                 if lammps_job_output['id'] != match.group(1).decode():
                     raise ValueError('job id does not match currently running job (should not happen)')
-                lammps_job_output['stdout'] = b''.join(lammps_job_buffer)
+                capture.completed = True
                 self.logger.debug(f'lammps job {lammps_job_output["id"]} completed')
                 return True
             elif b'ERROR' in line:
-                lammps_job_buffer.append(line)
-                lammps_job_output['stdout'] = b''.join(lammps_job_buffer)
+                capture.append(line)
                 self.logger.debug(f'lammps job {lammps_job_output["id"]} encountered error')
                 raise ValueError('error executing script')
             elif b'hack to force flush' not in line:
-                lammps_job_buffer.append(line)
-
-    def _process_results(self, lammps_job_input, lammps_job_output):
-        log_filename = 'log.lammps'
-        dump_filename = None
-        for line in lammps_job_input['stdin'].split('\n'):
-            tokens = line.split()
-            if len(tokens) == 0:
-                continue
-            if tokens[0] == 'log':
-                log_filename = tokens[1]
-            elif tokens[0] == 'dump':
-                dump_filename = tokens[5]
-
-        lammps_log = LammpsLog(os.path.join(self.directory, log_filename))
-        if dump_filename is None and ({'forces', 'lattice', 'positions', 'velocities'} & lammps_job_input['properties'] != set()):
-            raise ValueError('requested properties require dump file')
-        elif dump_filename:
-            lammps_dump = LammpsDump(os.path.join(self.directory, dump_filename))
+                capture.append(line)
+        raise ValueError('lammps process terminated')
 
+    async def _process_results(self, lammps_job_input, lammps_job_output):
         self.logger.debug(f'lammps job {lammps_job_input["id"]} properties {lammps_job_input["properties"]} being collected')
-        if 'stress' in lammps_job_input['properties']:
-            lammps_job_output['results']['stress'] = lammps_log.get_stress(-1).tolist()
-        if 'energy' in lammps_job_input['properties']:
-            lammps_job_output['results']['energy'] = lammps_log.get_energy(-1)
-        if 'forces' in lammps_job_input['properties']:
-            lammps_job_output['results']['forces'] = lammps_dump.get_forces(-1).tolist()
-        if 'lattice' in lammps_job_input['properties']:
-            lammps_job_output['results']['lattice'] = (lammps_dump.get_lammps_box(-1)).lattice.matrix.tolist()
-        if 'positions' in lammps_job_input['properties']:
-            lammps_job_output['results']['positions'] = lammps_dump.get_positions(-1).tolist()
-        if 'velocities' in lammps_job_input['properties']:
-            lammps_job_output['results']['velocities'] = lammps_dump.get_velocities(-1).tolist()
+        if self.parse_executor is None:
+            results = parse_results(self.directory, lammps_job_input)
+        else:
+            # input files are not needed to parse results
+            lammps_job_input = {key: lammps_job_input[key] for key in ('id', 'stdin', 'properties')}
+            loop = asyncio.get_event_loop()
+            results = await loop.run_in_executor(self.parse_executor, parse_results, self.directory, lammps_job_input)
+        lammps_job_output['results'].update(results)
+
+    async def _run_job(self, lammps_job_input, lammps_job_output):
+        timings = lammps_job_output['timings']
+        start_time = time.perf_counter()
+        await self._write_files(lammps_job_input)
+        # baselines are taken before lammps reads the script
+        pid = self.process.pid
+        snapshot, cpu_seconds = await self._run_io(usage_baseline, self.directory, pid)
+        self._write_stdin(lammps_job_input)
+        timings['write'] = time.perf_counter() - start_time
+        tracer().add_duration('process.write', lammps_job_output['id'], timings['write'])
+        self.logger.debug(f'lammps job {lammps_job_output["id"]} writing inputs {timings["write"]} [sec]')
+        start_time = time.perf_counter()
+        capture = StdoutCapture(
+            lammps_job_input.get('capture'),
+            os.path.join(self.stdout_directory, f'{lammps_job_input["id"]}.stdout'))
+        try:
+            await asyncio.wait_for(self._monitor_job(lammps_job_output, capture), lammps_job_input.get('timeout'))
+        except BaseException:
+            # measured inline as the io executor is shut down with the pool
+            lammps_job_output['resources'] = job_resources(self.directory, pid, snapshot, cpu_seconds)
+            raise
+        finally:
+            capture.close()
+            lammps_job_output['stdout'] = capture.output()
+            if capture.filename is not None:
+                lammps_job_output['stdout_file'] = capture.filename
+        lammps_job_output['resources'] = await self._run_io(job_resources, self.directory, pid, snapshot, cpu_seconds)
+        timings['execute'] = time.perf_counter() - start_time
+        tracer().add_duration('process.execute', lammps_job_output['id'], timings['execute'])
+        self.logger.debug(f'lammps job {lammps_job_output["id"]} completed in {timings["execute"]} [sec]')
+        start_time = time.perf_counter()
+        await self._process_results(lammps_job_input, lammps_job_output)
+        timings['parse'] = time.perf_counter() - start_time
+        tracer().add_duration('process.parse', lammps_job_output['id'], timings['parse'])
+        self.logger.debug(f'lammps job {lammps_job_output["id"]} processing results {timings["parse"]} [sec]')
 
     async def _handle_jobs(self):
         while True:
-            lammps_job_buffer = []
-            client_id, message = await self.pending_queue.get()
-            lammps_job_input = pickle.loads(message[0]) # lammps_job_input {id, stdin, files, properties}
-            lammps_job_output = {'id': lammps_job_input['id'], 'stdout': None, 'results': {}, 'error': None}
+            client_id, lammps_job_input = await self.pending_queue.get() # lammps_job_input {id, stdin, files, properties}
+            if lammps_job_input['id'] in self.cancelled:
+                # answered without running so that callers release the job
+                self.cancelled.discard(lammps_job_input['id'])
+                lammps_job_output = {'id': lammps_job_input['id'], 'stdout': None, 'results': {}, 'error': 'lammps job cancelled', 'timings': {}}
+                await self.completed_queue.put((client_id, lammps_job_output))
+                self.pending_queue.task_done()
+                continue
+            lammps_job_output = {'id': lammps_job_input['id'], 'stdout': None, 'results': {}, 'error': None, 'timings': {},
+                                 'placement': dict(self.placement)}
+            if 'queued_at' in lammps_job_input:
+                lammps_job_output['timings']['queue'] = time.monotonic() - lammps_job_input['queued_at']
+                tracer().add_duration('process.queue', lammps_job_output['id'], lammps_job_output['timings']['queue'])
+            start_time = time.perf_counter()
+            task = asyncio.ensure_future(self._run_job(lammps_job_input, lammps_job_output))
+            self._running_job = (lammps_job_input['id'], task)
             try:
-                start_time = time.perf_counter()
-                self._write_inputs(lammps_job_input)
-                self.logger.debug(f'lammps job {lammps_job_output["id"]} writing inputs {time.perf_counter() - start_time} [sec]')
-                start_time = time.perf_counter()
-                await self._monitor_job(lammps_job_output) # job error restart lammps process
-                self.logger.debug(f'lammps job {lammps_job_output["id"]} completed in {time.perf_counter() - start_time} [sec]')
-                start_time = time.perf_counter()
-                self._process_results(lammps_job_input, lammps_job_output)
-                self.logger.debug(f'lammps job {lammps_job_output["id"]} processing results {time.perf_counter() - start_time} [sec]')
+                await task
+            except asyncio.CancelledError:
+                if self._cancelling != lammps_job_input['id']:
+                    raise # shutdown
+                self.metrics['cancelled'] += 1
+                lammps_job_output['error'] = 'lammps job cancelled'
+            except asyncio.TimeoutError:
+                self.metrics['timeouts'] += 1
+                lammps_job_output['error'] = f'lammps job timed out after {lammps_job_input["timeout"]} [sec]'
             except ValueError as error:
-                if 'error executing script' in error.message:
-                    self.logger.warning('restarting lammps process')
-                    self.process.kill()
-                    self.process = await self.create_lammps_process()
-                lammps_job_output['error'] = error.message
-            except Exception as e: # debugging (remove later)
-                print(e)
-            await self.completed_queue.put((client_id, [pickle.dumps(lammps_job_output)]))
+                lammps_job_output['error'] = str(error)
+                if str(error) == 'lammps process terminated':
+                    self.metrics['crashes'] += 1
+                    retries = lammps_job_input.get('retries', 0)
+                    if retries < self.MAX_RETRIES:
+                        self.logger.warning(f'lammps job {lammps_job_input["id"]} interrupted requeueing')
+                        await self.restart_lammps_process()
+                        self._running_job = None
+                        self.pending_queue.task_done()
+                        await self.pending_queue.put((client_id, dict(lammps_job_input, retries=retries + 1)))
+                        continue
+            except Exception as error:
+                self.logger.exception(f'lammps job {lammps_job_input["id"]} failed')
+                lammps_job_output['error'] = f'{error.__class__.__name__}: {error}'
+            finally:
+                self._running_job = None
+                self.metrics['busy_seconds'] += time.perf_counter() - start_time
+                self.idle_since = time.monotonic()
+            if lammps_job_output['error'] is not None:
+                self.metrics['errors'] += 1
+                if 'execute' not in lammps_job_output['timings']:
+                    # lammps did not finish the job and may still be running it
+                    await self.restart_lammps_process()
+            elif hasattr(self.pending_queue, 'record'): # runtime history of `LammpsJobQueue`
+                self.pending_queue.record(lammps_job_input, lammps_job_output['timings']['execute'])
+            self.metrics['jobs'] += 1
+            await self.completed_queue.put((client_id, lammps_job_output))
             self.pending_queue.task_done()
@@ -0,0 +1,88 @@
+import json
+import zlib
+
+import numpy as np
+
+
+PROTOCOL_VERSION = 1
+
+
+def encode(message, compress_threshold=None):
+    """ Encode a lammps job or output into a list of zmq frames
+
+    The first frame is a json header describing the message. Numpy
+    arrays and bytes are sent as separate frames of raw (little-endian)
+    data that are zlib compressed when larger than `compress_threshold`
+    bytes. Sets and numpy scalars are also supported.
+    """
+    frames = [None]
+
+    def add_frame(buffer):
+        compressed = compress_threshold is not None and buffer.nbytes > compress_threshold
+        frames.append(zlib.compress(buffer) if compressed else buffer)
+        return len(frames) - 1, compressed
+
+    def encode_value(value):
+        if isinstance(value, dict):
+            return {str(key): encode_value(_) for key, _ in value.items()}
+        elif isinstance(value, (list, tuple)):
+            return [encode_value(_) for _ in value]
+        elif isinstance(value, (set, frozenset)):
+            return {'__set__': [encode_value(_) for _ in sorted(value)]}
+        elif isinstance(value, np.ndarray):
+            if value.dtype.hasobject:
+                raise ValueError('cannot encode numpy arrays of python objects')
+            array = np.ascontiguousarray(value, dtype=value.dtype.newbyteorder('<'))
+            index, compressed = add_frame(memoryview(array.reshape(-1)).cast('B'))
+            return {'__ndarray__': [index, array.dtype.str, list(array.shape), compressed]}
+        elif isinstance(value, (bytes, bytearray)):
+            index, compressed = add_frame(memoryview(value))
+            return {'__bytes__': [index, compressed]}
+        elif isinstance(value, np.generic):
+            return value.item()
+        elif value is None or isinstance(value, (str, int, float)):
+            return value
+        raise ValueError(f'cannot encode {type(value).__name__} in lammps message')
+
+    body = encode_value(message)
+    frames[0] = json.dumps({'version': PROTOCOL_VERSION, 'body': body}).encode('utf-8')
+    return frames
+
+
+def header(frames):
+    """ Json header of an encoded message without decoding its frames
+
+    Arrays and bytes appear as `{'__ndarray__': ...}`/`{'__bytes__': [index, compressed]}`.
+    """
+    data = json.loads(bytes(frames[0]).decode('utf-8'))
+    if data.get('version') != PROTOCOL_VERSION:
+        raise ValueError(f'unsupported lammps message version {data.get("version")}')
+    return data['body']
+
+
+def decode(frames):
+    """ Decode zmq frames created with `encode`
+
+    Uncompressed arrays are read-only views of the received frames.
+    """
+    def read_frame(index, compressed):
+        buffer = frames[index]
+        if hasattr(buffer, 'buffer'): # zmq.Frame
+            buffer = buffer.buffer
+        return zlib.decompress(buffer) if compressed else buffer
+
+    def decode_value(value):
+        if isinstance(value, dict):
+            if '__ndarray__' in value:
+                index, dtype, shape, compressed = value['__ndarray__']
+                return np.frombuffer(read_frame(index, compressed), dtype=dtype).reshape(shape)
+            elif '__bytes__' in value:
+                return bytes(read_frame(*value['__bytes__']))
+            elif '__set__' in value:
+                return {decode_value(_) for _ in value['__set__']}
+            return {key: decode_value(_) for key, _ in value.items()}
+        elif isinstance(value, list):
+            return [decode_value(_) for _ in value]
+        return value
+
+    return decode_value(header(frames))
@@ -6,19 +6,31 @@ import logging
 
 
 class LammpsMaster:
-    def __init__(self, stop_event, scheduler, loop=None):
-        from zmq_legos.mdp import Scheduler as MDPScheduler
+    """ Scheduler of lammps jobs between distributed clients and workers
+
+    Jobs are routed to workers holding their input files and dispatched
+    by priority, fair share (weighted by `shares`) and estimated runtime.
+    Stragglers are speculatively run on a second worker and jobs of
+    workers missing heartbeats requeued (see `LammpsScheduler`).
+    """
+    def __init__(self, stop_event, scheduler, shares=None, speculate=True, heartbeat_timeout=10.0, loop=None):
+        from .dispatch import LammpsScheduler
 
         self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
         parsed = urllib.parse.urlparse(scheduler)
 
-        self.mdp_scheduler = MDPScheduler(
+        self.mdp_scheduler = LammpsScheduler(
             stop_event,
             protocol=parsed.scheme, port=parsed.port, hostname=parsed.hostname,
+            shares=shares, speculate=speculate, heartbeat_timeout=heartbeat_timeout,
             loop=loop)
 
     def run(self):
         self.mdp_scheduler.run()
 
+    def stats(self):
+        """ Cache affinity, queue wait and speculation statistics of the scheduler """
+        return self.mdp_scheduler.stats()
+
     def disconnect(self):
         self.mdp_scheduler.disconnect()
@@ -0,0 +1,199 @@
+import re
+import time
+import asyncio
+import heapq
+import itertools
+from collections import OrderedDict
+
+from .cache import canonical_script
+
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+
+def priority_class(priority):
+    """ Rank of a priority class name or integer (lower runs first) """
+    if priority is None:
+        return PRIORITIES['normal']
+    elif isinstance(priority, str):
+        if priority not in PRIORITIES:
+            raise ValueError(f'unknown priority {priority} must be one of {list(PRIORITIES)}')
+        return PRIORITIES[priority]
+    return int(priority)
+
+
+def priority_name(rank):
+    for name, _rank in PRIORITIES.items():
+        if _rank == rank:
+            return name
+    return str(rank)
+
+
+NUMBER_REGEX = re.compile(r'(?<![\w.$])[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?(?![\w.])')
+# arguments kept in templates: run steps and minimize maxiter, maxeval
+STEP_ARGUMENTS = {'run': {1}, 'minimize': {3, 4}}
+
+
+def script_template(stdin):
+    """ Canonical lammps script with numbers replaced
+
+    Jobs that only differ by parameters (temperatures, timesteps, ...)
+    share a template. Step counts of `run` and `minimize` are kept since
+    they set the length of a job.
+    """
+    lines = []
+    for line in canonical_script(stdin).split('\n'):
+        tokens = line.split(' ')
+        kept = STEP_ARGUMENTS.get(tokens[0], set())
+        lines.append(' '.join(token if index in kept else NUMBER_REGEX.sub('#', token) for index, token in enumerate(tokens)))
+    return '\n'.join(lines)
+
+
+class RuntimeHistory:
+    """ Exponentially weighted runtimes of lammps jobs per script template
+
+    A job with a cost (atoms or `cost_hint`) is estimated from the
+    runtime per cost unit of its template otherwise from the runtime of
+    the template. Jobs of unseen templates are estimated with the mean
+    runtime of all jobs (None before any job completed). The spread of
+    runtimes relative to the estimates is tracked as well. At most
+    `maxsize` templates are remembered.
+    """
+    ALPHA = 0.3
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._templates = OrderedDict()
+        self._mean = None
+
+    def _average(self, previous, value):
+        return value if previous is None else (1 - self.ALPHA) * previous + self.ALPHA * value
+
+    def record(self, stdin, cost, seconds):
+        template = script_template(stdin)
+        runtime, rate, deviation = self._templates.pop(template, (None, None, None))
+        estimate = rate * cost if cost and rate is not None else runtime
+        if estimate:
+            deviation = self._average(deviation, (seconds / estimate - 1) ** 2)
+        runtime = self._average(runtime, seconds)
+        if cost:
+            rate = self._average(rate, seconds / cost)
+        self._templates[template] = (runtime, rate, deviation)
+        if len(self._templates) > self.maxsize:
+            self._templates.popitem(last=False)
+        self._mean = self._average(self._mean, seconds)
+
+    def estimate(self, stdin, cost=None):
+        """ Estimated runtime [sec] of a job """
+        template = script_template(stdin)
+        if template not in self._templates:
+            return self._mean
+        self._templates.move_to_end(template)
+        runtime, rate, _ = self._templates[template]
+        if cost and rate is not None:
+            return rate * cost
+        return runtime
+
+    def spread(self, stdin):
+        """ Relative standard deviation of the runtimes of a template (None if unknown) """
+        _, _, deviation = self._templates.get(script_template(stdin), (None, None, None))
+        return None if deviation is None else deviation ** 0.5
+
+
+class LammpsJobQueue(asyncio.Queue):
+    """ Queue of lammps jobs ordered by priority class, fair share and estimated runtime
+
+    The job with the highest priority class (see `PRIORITIES`) is
+    dequeued first. Within a class named submitters share the slots:
+    the submitter with the least estimated runtime dequeued so far
+    (divided by its share in `shares`, default 1) goes next and of its
+    jobs the one with the shortest estimated runtime from `history`.
+    Jobs without an estimate go first in submission order.
+
+    `job` extracts the job dict from a queued item and `cost` the job
+    cost used for runtime estimates. Queue wait times are collected per
+    priority class see `stats`.
+    """
+    def __init__(self, history=None, cost=None, shares=None, job=None, maxsize=0, **kwargs):
+        super().__init__(maxsize=maxsize, **kwargs)
+        self.history = history if history is not None else RuntimeHistory()
+        self.cost = cost or (lambda lammps_job_input: lammps_job_input.get('cost_hint'))
+        self.shares = shares or {}
+        self.job = job or (lambda item: item[1])
+        self.usage = {}
+        self.wait_stats = {}
+        self._virtual_time = 0.0
+
+    def _init(self, maxsize):
+        self._queue = {}
+        self._classes = {}
+        self._counter = itertools.count()
+
+    def _put(self, item):
+        lammps_job_input = self.job(item)
+        rank = priority_class(lammps_job_input.get('priority'))
+        submitter = lammps_job_input.get('submitter')
+        estimate = self.history.estimate(lammps_job_input['stdin'], self.cost(lammps_job_input))
+        submitters = self._classes.setdefault(rank, {})
+        if submitter not in submitters:
+            # a submitter (re)joining does not get credit for the time it was idle
+            self.usage[submitter] = max(self.usage.get(submitter, 0.0), self._virtual_time)
+        seq = next(self._counter)
+        heapq.heappush(submitters.setdefault(submitter, []), (estimate or 0.0, seq))
+        self._queue[seq] = (item, time.monotonic(), rank, submitter, estimate)
+
+    def _get(self):
+        rank = min(self._classes)
+        submitters = self._classes[rank]
+        submitter = min(submitters, key=lambda _: (self.usage[_], submitters[_][0][1]))
+        _, seq = heapq.heappop(submitters[submitter])
+        if not submitters[submitter]:
+            del submitters[submitter]
+            if not submitters:
+                del self._classes[rank]
+        item, enqueue_time, rank, submitter, estimate = self._queue.pop(seq)
+        self._virtual_time = self.usage[submitter]
+        self.usage[submitter] += (estimate if estimate is not None else 1.0) / self.shares.get(submitter, 1)
+
+        stats = self.wait_stats.setdefault(priority_name(rank), {'jobs': 0, 'total_wait': 0.0, 'max_wait': 0.0})
+        wait = time.monotonic() - enqueue_time
+        stats['jobs'] += 1
+        stats['total_wait'] += wait
+        stats['max_wait'] = max(stats['max_wait'], wait)
+        return item
+
+    def __contains__(self, job_id):
+        """ Whether the job with id `job_id` is queued """
+        return any(self.job(item)['id'] == job_id for item, *_ in self._queue.values())
+
+    def record(self, lammps_job_input, seconds):
+        """ Add the runtime of a completed job to the history """
+        self.history.record(lammps_job_input['stdin'], self.cost(lammps_job_input), seconds)
+
+    def stats(self):
+        """ Dequeued jobs, mean/max queue wait [sec] and queued jobs per priority class """
+        queued = {}
+        for rank, submitters in self._classes.items():
+            queued[priority_name(rank)] = sum(len(_) for _ in submitters.values())
+        stats = {}
+        for name in set(self.wait_stats) | set(queued):
+            wait_stats = self.wait_stats.get(name, {'jobs': 0, 'total_wait': 0.0, 'max_wait': 0.0})
+            stats[name] = dict(
+                wait_stats, queued=queued.get(name, 0),
+                mean_wait=wait_stats['total_wait'] / wait_stats['jobs'] if wait_stats['jobs'] else None)
+        return stats
+
+
+def merge_queue_stats(stats_list):
+    """ Combine `LammpsJobQueue.stats` of several queues """
+    merged = {}
+    for stats in stats_list:
+        for name, stat in stats.items():
+            total = merged.setdefault(name, {'jobs': 0, 'total_wait': 0.0, 'max_wait': 0.0, 'queued': 0})
+            total['jobs'] += stat['jobs']
+            total['total_wait'] += stat['total_wait']
+            total['max_wait'] = max(total['max_wait'], stat['max_wait'])
+            total['queued'] += stat['queued']
+    for stat in merged.values():
+        stat['mean_wait'] = stat['total_wait'] / stat['jobs'] if stat['jobs'] else None
+    return merged
@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import contextlib
+
+
+class Tracer:
+    """ Collect spans of lammps job stages as chrome trace events
+
+    Spans are async events keyed by the job id so that every job gets
+    its own track in chrome://tracing or https://ui.perfetto.dev. Times
+    are wall clock so that traces of the client, master and workers
+    written on one host (see `merge_traces`) line up.
+    """
+    def __init__(self, filename=None, process_name=None, enabled=True):
+        self.filename = filename
+        self.process_name = process_name or os.path.basename(sys.argv[0])
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self.events = []
+        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+
+    def add(self, name, job_id, start, end, **args):
+        """ Add span `name` of job `job_id` from `start` to `end` (`time.time()`) """
+        if not self.enabled:
+            return
+        event = {'name': name, 'cat': 'lammps', 'id': job_id, 'pid': self.pid, 'tid': self.pid}
+        self.events.append(dict(event, ph='b', ts=start * 1e6, args=dict(args, job=job_id)))
+        self.events.append(dict(event, ph='e', ts=max(start, end) * 1e6))
+
+    def add_duration(self, name, job_id, seconds, **args):
+        """ Add span `name` of job `job_id` lasting `seconds` until now """
+        end = time.time()
+        self.add(name, job_id, end - seconds, end, **args)
+
+    @contextlib.contextmanager
+    def span(self, name, job_id, **args):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, job_id, start, time.time(), **args)
+
+    def trace(self):
+        metadata = {'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': self.process_name}}
+        return {'traceEvents': [metadata] + self.events, 'displayTimeUnit': 'ms'}
+
+    def save(self, filename=None):
+        filename = filename or self.filename
+        with open(filename, 'w') as f:
+            json.dump(self.trace(), f)
+        self.logger.info(f'wrote {len(self.events) // 2} spans to trace {filename}')
+
+
+_tracer = Tracer(enabled=False)
+
+
+def tracer():
+    """ Active tracer (disabled unless `enable_tracing` was called) """
+    return _tracer
+
+
+def enable_tracing(filename, process_name=None):
+    """ Trace lammps job stages of this process into chrome trace `filename`
+
+    The trace is written when the process exits.
+    """
+    global _tracer
+    _tracer = Tracer(filename, process_name=process_name)
+    atexit.register(_tracer.save)
+    return _tracer
+
+
+def disable_tracing():
+    """ Stop tracing and write the trace of the active tracer """
+    global _tracer
+    if _tracer.enabled:
+        atexit.unregister(_tracer.save)
+        _tracer.save()
+    _tracer = Tracer(enabled=False)
+
+
+def merge_traces(filenames, output):
+    """ Merge chrome traces of several components into `output` """
+    events = []
+    for filename in filenames:
+        with open(filename) as f:
+            events.extend(json.load(f)['traceEvents'])
+    with open(output, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import multiprocessing
+import shutil
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .client import LammpsLocalClient
+from ..inputs import LammpsScript
+
+
+def short_script(lammps_script, steps):
+    """ Copy of a script running `steps` md steps (or minimizer
+    iterations) without writing restart and data files
+    """
+    lammps_script = LammpsScript(lammps_script)
+    if 'run' in lammps_script:
+        runs = lammps_script['run']
+        lammps_script['run'] = [steps] * len(runs) if isinstance(runs, list) else steps
+    if 'minimize' in lammps_script:
+        etol, ftol = str(lammps_script['minimize']).split()[:2]
+        lammps_script['minimize'] = f'{etol} {ftol} {steps} {steps * 10}'
+    for key in ('restart', 'write_restart', 'write_data'):
+        if key in lammps_script:
+            lammps_script[key] = []
+    return lammps_script
+
+
+def input_files(lammps_input):
+    """ Files of a `LammpsInput` as submitted to the calculator """
+    files = {lammps_input.lammps_script.data_filenames[0]: str(lammps_input.lammps_data)}
+    for file_buffer, filename in lammps_input.additional_files:
+        files[filename] = file_buffer
+    return files
+
+
+def _scale_interval(command, index, factors):
+    tokens = str(command).split()
+    values = []
+    for factor in factors:
+        values.append(' '.join(tokens[:index] + [str(int(tokens[index]) * factor)] + tokens[index + 1:]))
+    return values
+
+
+def setting_variants(lammps_script):
+    """ Candidate values of the neighbor, kspace and output settings of a script
+
+    The current value of each setting comes first. An empty list
+    removes a command from the script.
+    """
+    variants = OrderedDict()
+    if lammps_script.get('neighbor'):
+        skin, style = str(lammps_script['neighbor']).split()[:2]
+        variants['neighbor'] = [lammps_script['neighbor']] + [
+            f'{float(skin) * factor:g} {style}' for factor in (0.5, 0.75, 1.5)]
+    if lammps_script.get('kspace_style') and str(lammps_script['kspace_style']).startswith('pppm'):
+        style, accuracy = str(lammps_script['kspace_style']).split()[:2]
+        variants['kspace_style'] = [lammps_script['kspace_style']] + [
+            f'{style} {float(accuracy) * factor:g}' for factor in (10, 100)]
+        # the stencil order sets the pppm grid needed for the accuracy
+        variants['kspace_modify'] = [lammps_script.get('kspace_modify', [])] + [
+            'order 3', 'order 7', 'diff ad']
+    if isinstance(lammps_script.get('thermo'), int):
+        variants['thermo'] = [lammps_script['thermo']] + [lammps_script['thermo'] * factor for factor in (2, 10)]
+    if isinstance(lammps_script.get('dump'), str):
+        variants['dump'] = [lammps_script['dump']] + _scale_interval(lammps_script['dump'], 3, (2, 10))
+    return variants
+
+
+def within_tolerance(results, reference, tolerance):
+    """ Largest absolute difference of every result is within `tolerance`
+    (a number or a dict of tolerances per property)
+    """
+    for key, value in reference.items():
+        if key == 'performance':
+            continue
+        _tolerance = tolerance.get(key, 0.0) if isinstance(tolerance, dict) else tolerance
+        if key not in results or np.max(np.abs(np.asarray(results[key]) - np.asarray(value))) > _tolerance:
+            return False
+    return True
+
+
+class LammpsSettingsTuner:
+    """ Find the fastest neighbor, kspace and output settings of a lammps input
+
+    Short runs of `steps` steps of the script are submitted to a lammps
+    `client` and timed with the loop time lammps reports. Settings are
+    tuned one after another (see `setting_variants`): the variants of a
+    setting run concurrently `repeats` times each, variants whose
+    `properties` differ from the untuned run by more than `tolerance`
+    are rejected and the fastest remaining variant is kept when it is at
+    least `min_speedup` faster. Concurrent runs compete for the cores of
+    the pool, pin the pool for reliable timings.
+    """
+    def __init__(self, client, steps=100, properties=None, tolerance=1e-3, repeats=1, min_speedup=0.02):
+        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.client = client
+        self.steps = steps
+        self.properties = set(properties or {'energy'})
+        self.tolerance = tolerance
+        self.repeats = repeats
+        self.min_speedup = min_speedup
+        self._trials = 0
+
+    async def _run(self, lammps_script, files):
+        """ Fastest of `repeats` runs: (loop time, performance, results) """
+        futures = []
+        for _ in range(self.repeats):
+            # distinct scripts so that repeats are not answered by the cache
+            self._trials += 1
+            stdin = f'variable tuning_trial equal {self._trials}\n' + str(lammps_script)
+            futures.append(await self.client.submit(stdin, files, properties=self.properties | {'performance'}))
+        fastest = None
+        for lammps_job_output in await asyncio.gather(*futures):
+            if lammps_job_output['error']:
+                raise ValueError(lammps_job_output['error'])
+            results = dict(lammps_job_output['results'])
+            performance = results.pop('performance')
+            loop_time = sum(run['loop_time'] for run in performance)
+            if fastest is None or loop_time < fastest[0]:
+                fastest = (loop_time, performance, results)
+        return fastest
+
+    async def _trial(self, lammps_script, files, settings, reference):
+        trial = {'settings': settings, 'loop_time': None, 'performance': None, 'accepted': False, 'error': None}
+        script = LammpsScript(lammps_script)
+        script.update(settings)
+        try:
+            trial['loop_time'], trial['performance'], results = await self._run(script, files)
+        except ValueError as error:
+            trial['error'] = str(error)
+            return trial
+        trial['accepted'] = within_tolerance(results, reference, self.tolerance)
+        return trial
+
+    async def tune(self, lammps_input, variants=None):
+        """ Tune the settings of a `LammpsInput`
+
+        `variants` maps script commands to candidate values (default
+        `setting_variants`). Returns a dict with the `settings` to
+        update the script with, their `loop_time`, the `baseline`
+        loop time, the `speedup` and every trial in `trials`. Fails with
+        a ValueError when the untuned script fails.
+        """
+        lammps_script = short_script(lammps_input.lammps_script, self.steps)
+        files = input_files(lammps_input)
+        if variants is None:
+            variants = setting_variants(lammps_input.lammps_script)
+
+        loop_time, performance, reference = await self._run(lammps_script, files)
+        baseline = {'settings': {}, 'loop_time': loop_time, 'performance': performance, 'accepted': True, 'error': None}
+        best = baseline
+        trials = [baseline]
+        for key, values in variants.items():
+            candidates = [dict(best['settings'], **{key: value}) for value in values
+                          if value != lammps_script.get(key, [])]
+            for trial in await asyncio.gather(*[self._trial(lammps_script, files, settings, reference) for settings in candidates]):
+                trials.append(trial)
+                if not trial['accepted']:
+                    self.logger.debug(f'settings {trial["settings"]} rejected {trial["error"] or "results outside tolerance"}')
+                elif trial['loop_time'] < best['loop_time'] * (1 - self.min_speedup):
+                    best = trial
+            self.logger.info(f'tuned {key} {best["settings"].get(key, lammps_script.get(key))} loop time {best["loop_time"]:.4g} sec')
+        return {
+            'settings': best['settings'],
+            'loop_time': best['loop_time'],
+            'baseline': baseline['loop_time'],
+            'speedup': baseline['loop_time'] / best['loop_time'] if best['loop_time'] else None,
+            'trials': trials,
+        }
+
+
+def fit_scalability(num_workers, throughputs):
+    """ Fit the universal scalability law X(n) = X1 n / (1 + s (n - 1) + k n (n - 1))
+    to throughputs measured with `num_workers` workers
+
+    Returns `(X1, s, k)`: the throughput of a single worker, the
+    contention and the coherency coefficient.
+    """
+    num_workers = np.asarray(num_workers, dtype=float)
+    throughputs = np.asarray(throughputs, dtype=float)
+    if np.any(num_workers == 1):
+        single = throughputs[num_workers == 1].mean()
+    else:
+        single = np.max(throughputs / num_workers)
+    mask = num_workers > 1
+    if not np.any(mask):
+        return single, 0.0, 0.0
+    n = num_workers[mask]
+    # linear in s and k: X1 n / X(n) - 1 = s (n - 1) + k n (n - 1)
+    A = np.stack([n - 1, n * (n - 1)], axis=1)
+    y = single * n / throughputs[mask] - 1
+    (contention, coherency), *_ = np.linalg.lstsq(A, y, rcond=None)
+    return single, max(contention, 0.0), max(coherency, 0.0)
+
+
+def predict_throughput(model, num_workers):
+    single, contention, coherency = model
+    return single * num_workers / (1 + contention * (num_workers - 1) + coherency * num_workers * (num_workers - 1))
+
+
+def _powers_of_two(maximum):
+    values, value = [], 1
+    while value <= maximum:
+        values.append(value)
+        value *= 2
+    return values
+
+
+class LammpsPoolTuner:
+    """ Recommend the lammps processes, mpi ranks per job and threads per
+    rank of a pool for a representative job
+
+    For every combination of `ranks` and `threads` (default powers of
+    two, ranks > 1 only when `mpirun` is installed) copies of the job
+    are run with a few worker counts fitting into `max_cpus` (default
+    all cpus). The throughput is measured over `jobs_per_worker` jobs
+    per worker, a universal scalability model is fitted to the
+    measurements (see `fit_scalability`) and the configuration with the
+    highest predicted throughput is recommended. The recommendation is
+    a pool config (see `write_pool_config`) for `LammpsLocalClient.from_config`
+    and the worker cli.
+    """
+    def __init__(self, command=None, max_cpus=None, ranks=None, threads=None, mpirun='mpirun', pin=None,
+                 jobs_per_worker=8, parse_processes=None):
+        self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.command = command
+        self.max_cpus = max_cpus or multiprocessing.cpu_count()
+        if ranks is None:
+            ranks = _powers_of_two(self.max_cpus) if shutil.which(mpirun) else [1]
+        self.ranks = ranks
+        self.threads = threads or _powers_of_two(self.max_cpus)
+        self.mpirun = mpirun
+        self.pin = pin
+        self.jobs_per_worker = jobs_per_worker
+        self.parse_processes = parse_processes
+
+    async def _measure(self, job, num_workers, ranks, threads):
+        """ Completed jobs per second """
+        client = LammpsLocalClient(
+            command=self.command, slots=f'{num_workers}x{ranks}', mpirun=self.mpirun,
+            pin=self.pin, threads_per_rank=threads, parse_processes=self.parse_processes,
+            # identical jobs would otherwise be coalesced into one run
+            deduplicate=False, max_pending_jobs=4 * num_workers)
+        await client.create()
+        try:
+            num_jobs = self.jobs_per_worker * num_workers
+            start_time = time.perf_counter()
+            futures = [await client.submit(*job) for _ in range(num_jobs)]
+            outputs = await asyncio.gather(*futures)
+            elapsed = time.perf_counter() - start_time
+        finally:
+            client.shutdown()
+        for lammps_job_output in outputs:
+            if lammps_job_output['error']:
+                raise ValueError(f'job failed with {num_workers}x{ranks} slots: {lammps_job_output["error"]}')
+        return num_jobs / elapsed
+
+    async def tune(self, stdin, files=None, properties=None):
+        """ Recommended pool config for a job
+
+        Besides the pool options (`slots`, `threads_per_rank`, ...) the
+        predicted `throughput` [jobs/sec] and all `measurements` are
+        returned.
+        """
+        job = (stdin, files, properties)
+        measurements = []
+        best = None
+        for ranks in self.ranks:
+            for threads in self.threads:
+                max_workers = self.max_cpus // (ranks * threads)
+                if max_workers < 1:
+                    continue
+                worker_counts = sorted({1, 2, max_workers // 2, max_workers} & set(range(1, max_workers + 1)))
+                throughputs = []
+                for num_workers in worker_counts:
+                    throughput = await self._measure(job, num_workers, ranks, threads)
+                    self.logger.info(f'{num_workers}x{ranks} slots {threads} threads {throughput:.3f} jobs/sec')
+                    measurements.append({'num_workers': num_workers, 'ranks': ranks, 'threads_per_rank': threads,
+                                         'throughput': throughput})
+                    throughputs.append(throughput)
+                model = fit_scalability(worker_counts, throughputs)
+                for num_workers in range(1, max_workers + 1):
+                    predicted = predict_throughput(model, num_workers)
+                    if best is None or predicted > best[0]:
+                        best = (predicted, num_workers, ranks, threads)
+        if best is None:
+            raise ValueError(f'no ranks {self.ranks} and threads {self.threads} fit into {self.max_cpus} cpus')
+
+        throughput, num_workers, ranks, threads = best
+        config = {'slots': f'{num_workers}x{ranks}', 'threads_per_rank': threads,
+                  'throughput': throughput, 'measurements': measurements}
+        if ranks > 1:
+            config['mpirun'] = self.mpirun
+        if self.pin:
+            config['pin'] = self.pin
+        if self.command:
+            config['command'] = self.command
+        return config
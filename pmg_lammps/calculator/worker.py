@@ -1,20 +1,33 @@
 import urllib.parse
 import asyncio
-import multiprocessing
 import logging
+import time
 
-from .process import LammpsProcess
+from .pool import LammpsPool
+from .blobs import LammpsBlobStore
+from . import protocol
+from .tracing import tracer
 
 
 class LammpsWorker:
-    def __init__(self, stop_event, scheduler, command=None, num_workers=None, loop=None):
+    def __init__(self, stop_event, scheduler, command=None, num_workers=None, slots=None,
+                 mpirun='mpirun', atoms_per_rank=LammpsPool.DEFAULT_ATOMS_PER_RANK, parse_processes=None,
+                 min_workers=None, idle_timeout=None, pin=None, threads_per_rank=None, stdout_directory=None,
+                 compress_threshold=None, blob_directory=None, max_blob_bytes=2**30, loop=None):
         from zmq_legos.mdp import Worker as MDPWorker
 
         self.logger = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
-        self.command = command
-        self.num_workers = num_workers or multiprocessing.cpu_count()
-        if self.num_workers > multiprocessing.cpu_count():
-            raise ValueError('cannot have more workers than cpus')
+        self.pool = LammpsPool(
+            command=command, num_workers=num_workers, slots=slots,
+            mpirun=mpirun, atoms_per_rank=atoms_per_rank,
+            parse_processes=parse_processes,
+            min_workers=min_workers, idle_timeout=idle_timeout,
+            pin=pin, threads_per_rank=threads_per_rank,
+            stdout_directory=stdout_directory)
+        self.num_workers = self.pool.num_slots
+        self.compress_threshold = compress_threshold
+        self.blob_store = LammpsBlobStore(blob_directory, max_bytes=max_blob_bytes)
+        self._job_blobs = {}
 
         parsed = urllib.parse.urlparse(scheduler)
         self.mdp_worker = MDPWorker(
@@ -24,17 +37,84 @@ class LammpsWorker:
             loop=loop)
 
     async def create(self):
-        self._processes = []
         self.logger.info(f'starting {self.num_workers} lammps processes')
-        for _ in range(self.num_workers):
-            process = LammpsProcess(command=self.command)
-            await process.create(self.mdp_worker.queued_messages, self.mdp_worker.completed_messages)
-            self._processes.append(process)
+        self._completed_queue = asyncio.Queue()
+        await self.pool.create(self._completed_queue)
+        self._route_task = asyncio.ensure_future(self._route_jobs())
+        self._reply_task = asyncio.ensure_future(self._reply_jobs())
+
+    async def _route_jobs(self):
+        while True:
+            client_id, message = await self.mdp_worker.queued_messages.get()
+            start_time = time.time()
+            lammps_job_input = protocol.decode(message)
+            if 'cancel' in lammps_job_input:
+                # sent by the scheduler once another copy of a job completed
+                self.logger.debug(f'lammps job {lammps_job_input["cancel"]} cancelled by scheduler')
+                self.pool.cancel(lammps_job_input['cancel'])
+                await self.mdp_worker.completed_messages.put((client_id, protocol.encode(lammps_job_input)))
+                self.mdp_worker.queued_messages.task_done()
+                continue
+            missing = self._link_blobs(lammps_job_input)
+            if missing:
+                self.logger.debug(f'lammps job {lammps_job_input["id"]} missing blobs {missing}')
+                lammps_job_output = {'id': lammps_job_input['id'], 'missing': missing}
+                await self.mdp_worker.completed_messages.put((client_id, protocol.encode(lammps_job_output)))
+            else:
+                tracer().add('worker.deserialize', lammps_job_input['id'], start_time, time.time())
+                await self.pool.put(client_id, lammps_job_input)
+            self.mdp_worker.queued_messages.task_done()
+
+    def _link_blobs(self, lammps_job_input):
+        """ Store blobs sent with a job and pin the blobs of its files
+
+        Files are hard linked from the blob store into the job directory.
+        Returns the hashes the worker does not have.
+        """
+        file_hashes = lammps_job_input.pop('file_hashes', None) or {}
+        blobs = lammps_job_input.pop('blobs', None) or {}
+        keys = set(file_hashes.values())
+        missing = set(self.blob_store.missing(keys))
+        acquired = list(keys - missing)
+        self.blob_store.acquire(acquired)
+        for key in missing & set(blobs):
+            try:
+                self.blob_store.put(key, blobs[key])
+            except ValueError as error:
+                self.logger.warning(f'lammps job {lammps_job_input["id"]} {error}')
+                continue
+            self.blob_store.acquire([key])
+            acquired.append(key)
+        missing = sorted(keys - set(acquired))
+        if missing:
+            self.blob_store.release(acquired)
+            return missing
+        lammps_job_input['links'] = {filename: self.blob_store.path(key) for filename, key in file_hashes.items()}
+        self._job_blobs[lammps_job_input['id']] = acquired
+        return []
+
+    async def _reply_jobs(self):
+        while True:
+            client_id, lammps_job_output = await self._completed_queue.get()
+            self.blob_store.release(self._job_blobs.pop(lammps_job_output['id'], []))
+            with tracer().span('worker.serialize', lammps_job_output['id']):
+                message = protocol.encode(lammps_job_output, self.compress_threshold)
+            await self.mdp_worker.completed_messages.put((client_id, message))
+
+    def metrics(self):
+        """ Job and supervision counters of the lammps processes and blob store hits """
+        return dict(self.pool.metrics(), blob_hits=self.blob_store.hits, blob_misses=self.blob_store.misses)
+
+    def queue_stats(self):
+        """ Queue wait times per priority class of jobs waiting on this worker """
+        return self.pool.queue_stats()
 
     async def shutdown(self):
         self.logger.info(f'shutting down {self.num_workers} lammps processes')
-        for process in self._processes:
-            process.shutdown()
+        self._route_task.cancel()
+        self._reply_task.cancel()
+        self.pool.shutdown()
+        self.blob_store.close()
         await self.mdp_worker.disconnect()
 
     async def run(self):
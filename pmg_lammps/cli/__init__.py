@@ -1,18 +1,25 @@
 import argparse
+import atexit
 import sys
 
 from . import calculator
 from . import benchmark
 from ..logging import LOG_LEVELS, init_logging
+from ..profiling import SamplingProfiler
+from ..calculator.tracing import enable_tracing
 
 
 def init_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('-l', '--loglevel', choices=LOG_LEVELS, default='WARNING')
+    parser.add_argument('--trace', help='write a chrome trace of lammps job stages to file at exit')
+    parser.add_argument('--profile', help='sample python stacks and write them collapsed (flamegraph) to file at exit')
+    parser.add_argument('--profile-interval', type=float, default=0.005, help='profiler sampling interval [sec]')
     subparsers = parser.add_subparsers()
     calculator.add_subcommand_master(subparsers)
     calculator.add_subcommand_worker(subparsers)
     benchmark.add_subcommand_benchmark(subparsers)
+    benchmark.add_subcommand_autotune(subparsers)
     return parser
 
 
@@ -25,4 +32,22 @@ def cli():
         sys.exit(1)
 
     init_logging(args.loglevel)
+    component = args.func.__name__.replace('handle_subcommand_', '')
+    if args.trace:
+        enable_tracing(args.trace, process_name=f'pmg_lammps {component}')
+    if args.profile:
+        start_profiler(args.profile, args.profile_interval)
     args.func(args)
+
+
+def start_profiler(filename, interval):
+    profiler = SamplingProfiler(interval)
+
+    def stop_profiler():
+        profiler.stop()
+        profiler.save(filename)
+        print(profiler.report(), file=sys.stderr)
+
+    profiler.start()
+    atexit.register(stop_profiler)
+    return profiler
@@ -1,9 +1,11 @@
 import argparse
-import multiprocessing
 import asyncio
-import time
+import os
+import sys
 
-from ..calculator import LammpsLocalClient
+from ..benchmark import BENCHMARKS, PERCENTILES, compare, load_results, run_suite, save_results
+from ..calculator import LammpsPoolTuner
+from ..calculator.config import write_pool_config
 
 
 script = """
@@ -57,35 +59,95 @@ Atoms
 }
 
 
+def param_type(param):
+    """ Parse a benchmark parameter "name=value[,value...]" """
+    key, sep, values = param.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f'parameter {param} must be of the form name=value')
+
+    def convert(value):
+        for _type in (int, float):
+            try:
+                return _type(value)
+            except ValueError:
+                pass
+        return value
+    return key, [convert(value) for value in values.split(',')]
+
+
 def add_subcommand_benchmark(subparsers):
     parser = subparsers.add_parser('benchmark', help='benchmark lammps package')
     parser.set_defaults(func=handle_subcommand_benchmark)
-    parser.add_argument('test', choices={'local_client',}, help='benchmark to run')
-    parser.add_argument('--max-workers', type=int, default=multiprocessing.cpu_count())
-    parser.add_argument('--num-tasks', type=int, default=1000)
+    parser.add_argument('benchmarks', nargs='*', help=f'benchmarks to run (default all) of {", ".join(BENCHMARKS)}')
+    parser.add_argument('-p', '--param', type=param_type, action='append', default=[],
+                        help='benchmark parameter e.g. atoms=1000,10000 (every combination is run)')
+    parser.add_argument('-r', '--repeats', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('-o', '--output', help='write results as json')
+    parser.add_argument('-b', '--baseline', help='json results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='fail when latency grows by more than this fraction')
+    parser.add_argument('--statistic', default='p50', choices=['min', 'mean', 'max'] + [f'p{_}' for _ in PERCENTILES])
+
+
+def add_subcommand_autotune(subparsers):
+    parser = subparsers.add_parser('autotune', help='recommend a lammps pool config for a representative job')
+    parser.set_defaults(func=handle_subcommand_autotune)
+    parser.add_argument('-o', '--output', default='pool.json', help='config file to write (other keys are kept)')
+    parser.add_argument('--script', help='lammps script of the job (default a small MgO job)')
+    parser.add_argument('--files', nargs='*', default=[], help='input files of the job')
+    parser.add_argument('--properties', nargs='*', default=['energy'])
+    parser.add_argument('--max-cpus', type=int)
+    parser.add_argument('--ranks', type=int, nargs='*', help='mpi ranks per job to try (default powers of two)')
+    parser.add_argument('--threads', type=int, nargs='*', help='openmp threads per rank to try (default powers of two)')
+    parser.add_argument('--jobs-per-worker', type=int, default=8)
+    parser.add_argument('--mpirun', default='mpirun')
+    parser.add_argument('--pin', choices=['compact', 'spread'])
     parser.add_argument('--command', default='lammps_serial')
 
 
+def handle_subcommand_autotune(args):
+    job_script, job_files = script, files
+    if args.script:
+        with open(args.script) as f:
+            job_script = f.read()
+        job_files = {}
+        for filename in args.files:
+            with open(filename) as f:
+                job_files[os.path.basename(filename)] = f.read()
+
+    tuner = LammpsPoolTuner(
+        command=args.command, max_cpus=args.max_cpus, ranks=args.ranks, threads=args.threads,
+        mpirun=args.mpirun, pin=args.pin, jobs_per_worker=args.jobs_per_worker)
+    loop = asyncio.get_event_loop()
+    config = loop.run_until_complete(tuner.tune(job_script, job_files, set(args.properties)))
+    for measurement in config['measurements']:
+        print('slots', f'{measurement["num_workers"]}x{measurement["ranks"]}', 'threads', measurement['threads_per_rank'],
+              'tasks/sec', measurement['throughput'])
+    print('recommended slots', config['slots'], 'threads', config['threads_per_rank'],
+          'predicted tasks/sec', config['throughput'], 'written to', args.output)
+    write_pool_config(args.output, config)
+
+
 def handle_subcommand_benchmark(args):
-    max_workers = min([multiprocessing.cpu_count(), args.max_workers])
-
-    async def run_lammps_job(client, num_workers, num_tasks):
-        jobs = []
-        start_time = time.perf_counter()
-        for _ in range(num_tasks):
-            jobs.append(await client.submit(script, files, properties={'stress', 'forces', 'energy'}))
-        results = await asyncio.gather(*jobs)
-        end_time = time.perf_counter()
-        print('LammpsLocalClient num_workers', num_workers, 'time', num_tasks, end_time - start_time, 'tasks/sec', num_tasks / (end_time - start_time), 'tasks/(sec worker)', num_tasks / (end_time - start_time) / num_workers)
-        return results
-
-    if args.test == 'local_client':
-        loop = asyncio.get_event_loop()
-
-        for num_workers in range(1, max_workers+1):
-            try:
-                client = LammpsLocalClient(command=args.command, num_workers=num_workers)
-                loop.run_until_complete(client.create())
-                loop.run_until_complete(run_lammps_job(client, num_workers, args.num_tasks))
-            finally:
-                client.shutdown()
+    results = run_suite(args.benchmarks, params=dict(args.param), repeats=args.repeats, warmup=args.warmup)
+    for key, result in results['benchmarks'].items():
+        if 'skipped' in result:
+            print(key, 'skipped', result['skipped'])
+            continue
+        latency = result['latency']
+        print(key, ' '.join(f'p{_} {latency[f"p{_}"] * 1000:.3f} ms' for _ in PERCENTILES),
+              'items/sec', f'{result["throughput"]:.1f}',
+              *[f'{name} p50 {metric["p50"]:.4g}' for name, metric in result['metrics'].items()])
+    if args.output:
+        save_results(results, args.output)
+
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), threshold=args.threshold, statistic=args.statistic)
+        for regression in regressions:
+            if regression['reason']:
+                print('regression', regression['name'], regression['reason'])
+                continue
+            print('regression', regression['name'], f'{args.statistic} {regression["baseline"] * 1000:.3f} ms ->',
+                  f'{regression["latency"] * 1000:.3f} ms ({regression["change"]:+.1%})')
+        if regressions:
+            sys.exit(1)
@@ -4,7 +4,10 @@
    'master': 'tcp://localhost:8555'
 }
 
+Worker configs may also hold pool options e.g. written by
+`pmg_lammps autotune`, command line options take precedence.
 """
+import argparse
 import os
 import json
 import asyncio
@@ -13,6 +16,7 @@ import urllib.parse
 
 import zmq.asyncio
 from ..calculator import LammpsWorker, LammpsMaster
+from ..calculator.config import POOL_OPTIONS, load_pool_config
 
 
 def filename_type(filename):
@@ -26,6 +30,18 @@ def add_subcommand_worker(subparsers):
     parser.set_defaults(func=handle_subcommand_worker)
     parser.add_argument('-m', '--master', help='uri of lammps master')
     parser.add_argument('-n', '--num-workers', type=int)
+    parser.add_argument('-s', '--slots', help='lammps process widths in partition syntax e.g. "8x1 2x8"')
+    parser.add_argument('--atoms-per-rank', type=int, help='atoms per mpi rank used to route jobs to slots')
+    parser.add_argument('--mpirun', help='mpi launcher of processes wider than one rank (default mpirun)')
+    parser.add_argument('--parse-processes', type=int, help='processes parsing lammps output (0 parses in the event loop)')
+    parser.add_argument('--min-workers', type=int, help='lammps processes kept running when idle (default all)')
+    parser.add_argument('--idle-timeout', type=float, help='stop lammps processes idle for this many seconds')
+    parser.add_argument('--pin', choices=['compact', 'spread'], help='pin lammps processes to numa aware cpu sets')
+    parser.add_argument('--threads-per-rank', type=int, help='openmp threads of each lammps rank')
+    parser.add_argument('--stdout-directory', help='directory of lammps screen output of jobs captured to files')
+    parser.add_argument('--compress-threshold', type=int, help='compress result arrays larger than this many bytes')
+    parser.add_argument('--blob-directory', help='directory of cached input files (default temporary)')
+    parser.add_argument('--max-blob-bytes', type=int, default=2**30)
     parser.add_argument('--command')
     parser.add_argument('-c', '--config', type=filename_type)
 
@@ -58,10 +74,14 @@ def handle_subcommand_worker(args):
         with open(args.config) as f:
             config = json.load(f)
     else:
-        config = {'master': args.master}
-    master_uri = config.get('master', master)
+        config = {}
+    master_uri = args.master or config.get('master')
     if master_uri is None:
         raise ValueError('must specify master uri')
+    pool_options = load_pool_config(args.config) if args.config else {}
+    for key in POOL_OPTIONS:
+        if getattr(args, key) is not None:
+            pool_options[key] = getattr(args, key)
 
     async def run_worker(worker):
         await worker.create()
@@ -70,7 +90,11 @@ def handle_subcommand_worker(args):
     try:
         stop_event = asyncio.Event()
         loop = init_event_loop()
-        worker = LammpsWorker(stop_event, normalize_uri(master_uri), num_workers=args.num_workers, command=args.command, loop=loop)
+        worker = LammpsWorker(
+            stop_event, normalize_uri(master_uri),
+            compress_threshold=args.compress_threshold,
+            blob_directory=args.blob_directory, max_blob_bytes=args.max_blob_bytes,
+            loop=loop, **pool_options)
         loop.run_until_complete(run_worker(worker))
     except KeyboardInterrupt:
         stop_event.set()
@@ -82,8 +106,8 @@ def handle_subcommand_master(args):
         with open(args.config) as f:
             config = json.load(f)
     else:
-        config = {'master': args.master}
-    master_uri = config.get('master')
+        config = {}
+    master_uri = args.master or config.get('master')
     if master_uri is None:
         raise ValueError('must specify master uri')
 
@@ -163,7 +163,21 @@ class LammpsDump(object):
 class LammpsLog(object):
     """
     Parser for LAMMPS log file.
+
+    Besides the thermodynamic data the performance summary printed after
+    every run is collected in `performance` (one dict per run): loop
+    time, timesteps/s, cpu use, the MPI task timing breakdown per
+    section (Pair, Bond, Kspace, Neigh, Comm, Output, Modify, Other),
+    the per processor atom/neighbor distribution and neighbor list
+    statistics.
     """
+    PERFORMANCE_UNITS = {
+        'tau/day': 'tau_per_day',
+        'ns/day': 'ns_per_day',
+        'hours/ns': 'hours_per_ns',
+        'timesteps/s': 'timesteps_per_second',
+        'katom-step/s': 'katom_steps_per_second',
+    }
 
     def __init__(self, log_file="lammps.log"):
         """
@@ -201,6 +215,80 @@ class LammpsLog(object):
             raise ValueError('Atom dumps mult include TotEng to get total energy')
         return float(timestep['TotEng'])
 
+    def get_performance(self, index):
+        return self.performance[index]
+
+    def _parse_loop_time(self, line):
+        match = re.search(r'Loop time of (\S+) on (\d+) procs for (\d+) steps with (\d+) atoms', line)
+        loop_time, steps = float(match.group(1)), int(match.group(3))
+        return {
+            'loop_time': loop_time,
+            'procs': int(match.group(2)),
+            'steps': steps,
+            'atoms': int(match.group(4)),
+            'timesteps_per_second': steps / loop_time if loop_time > 0 else None,
+            'sections': {},
+            'distribution': {},
+            'neighbors': {},
+        }
+
+    def _parse_performance(self, line, run):
+        """
+        Parse a line of the performance summary following a run into `run`.
+        """
+        def number(value):
+            value = value.strip()
+            return float(value) if value else None
+
+        if line.startswith('Performance:'):
+            for token in line.split(':', 1)[1].split(','):
+                value, unit = token.split()
+                if unit in self.PERFORMANCE_UNITS:
+                    run[self.PERFORMANCE_UNITS[unit]] = float(value)
+            return
+
+        match = re.match(r'([0-9.]+)% CPU use with (\d+) MPI tasks x (\d+|no) OpenMP threads', line)
+        if match:
+            run['cpu_use'] = float(match.group(1))
+            run['mpi_tasks'] = int(match.group(2))
+            # lammps without openmp runs a single thread per task
+            run['openmp_threads'] = 1 if match.group(3) == 'no' else int(match.group(3))
+            return
+
+        # table since lammps 2016 "Pair | min | avg | max | %varavg | %total"
+        match = re.match(r'(\w+)\s*\|([^|]*)\|([^|]*)\|([^|]*)\|([^|]*)\|([^|]*)$', line.strip())
+        if match and match.group(1) != 'Section':
+            minimum, average, maximum, varavg, percent = [number(_) for _ in match.groups()[1:]]
+            run['sections'][match.group(1)] = {
+                'min': minimum, 'avg': average, 'max': maximum, 'varavg': varavg, 'percent': percent}
+            return
+
+        # older lammps "Pair  time (%) = 0.0250154 (69.7467)"
+        match = re.match(r'(\w+)\s+time \(%\) = (\S+) \((\S+)\)', line)
+        if match:
+            section = {'Outpt': 'Output'}.get(match.group(1), match.group(1))
+            run['sections'][section] = {
+                'min': None, 'avg': float(match.group(2)), 'max': None, 'varavg': None, 'percent': float(match.group(3))}
+            return
+
+        match = re.match(r'(Nlocal|Nghost|Neighs|FullNghs):\s+(\S+) ave (\S+) max (\S+) min', line)
+        if match:
+            run['distribution'][match.group(1).lower()] = {
+                'ave': float(match.group(2)), 'max': float(match.group(3)), 'min': float(match.group(4))}
+            return
+
+        neighbor_statistics = [
+            ('total', r'Total # of neighbors = (\d+)', int),
+            ('per_atom', r'Ave neighs/atom = (\S+)', float),
+            ('special_per_atom', r'Ave special neighs/atom = (\S+)', float),
+            ('builds', r'Neighbor list builds = (\d+)', int),
+            ('dangerous_builds', r'Dangerous builds = (\d+)', int),
+        ]
+        for key, pattern, nptype in neighbor_statistics:
+            match = re.match(pattern, line)
+            if match:
+                run['neighbors'][key] = nptype(match.group(1))
+
     def _parse_log(self):
         """
         Parse the log file for the thermodynamic data.
@@ -217,6 +305,7 @@ class LammpsLog(object):
         thermo_data = []
         inside_thermo_block = False
         read_thermo_header = False
+        performance = []
         with open(self.log_file, 'r') as logfile:
             for line in logfile:
                 # timestep, the unit depedns on the 'units' command
@@ -234,6 +323,12 @@ class LammpsLog(object):
                 if thermo and not thermo_data:
                     self.interval = float(thermo.group(1))
 
+                # performance summary following each run
+                if "Loop time of " in line:
+                    performance.append(self._parse_loop_time(line))
+                elif performance and not inside_thermo_block:
+                    self._parse_performance(line, performance[-1])
+
                 # thermodynamic data, set by the thermo_style command
                 if "Memory usage per processor = " in line or \
                    "Per MPI rank memory allocation" in line:
@@ -255,3 +350,4 @@ class LammpsLog(object):
                         thermo_data.append(tuple(t(v) for t, v in zip(thermo_types, line.split())))
         thermo_data_dtype = np.dtype([(header, nptype) for header, nptype in zip(thermo_header, thermo_types)])
         self.thermo_data = np.array(thermo_data, dtype=thermo_data_dtype)
+        self.performance = performance
@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import collections
+
+
+class SamplingProfiler:
+    """ Sample the python stacks of every thread of this process
+
+    A daemon thread records the stack of all other threads every
+    `interval` seconds. Stacks are written in the collapsed format
+    ("outer;inner count" per line) read by flamegraph.pl and speedscope.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def sample(self):
+        """ Record the current stack of every other thread """
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == threading.get_ident():
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='pmg_lammps-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def top(self, n=20):
+        """ `n` functions with the most samples as `(name, self, total)`
+
+        `self` counts samples in the function itself and `total`
+        samples with the function anywhere on the stack.
+        """
+        self_counts, total_counts = collections.Counter(), collections.Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            self_counts[frames[-1]] += count
+            for name in set(frames):
+                total_counts[name] += count
+        return [(name, count, total_counts[name]) for name, count in self_counts.most_common(n)]
+
+    def report(self, n=20):
+        lines = [f'{self.samples} samples every {self.interval * 1000:g} [ms]', f'{"self":>7} {"total":>7}  function']
+        for name, count, total in self.top(n):
+            lines.append(f'{count:7d} {total:7d}  {name}')
+        return '\n'.join(lines)
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
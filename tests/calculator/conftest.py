@@ -0,0 +1,56 @@
+import os
+import asyncio
+
+import pytest
+
+from pmg_lammps.calculator import mock
+
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test_files')
+
+ENERGY_SCRIPT = """
+log  lammps.log
+read_data  initial.data
+thermo_style  custom step etotal pxx pyy pzz pxy pxz pyz
+run  {steps}
+"""
+
+
+@pytest.fixture
+def mock_command():
+    """ Command running the mock lammps engine """
+    return mock.mock_command()
+
+
+@pytest.fixture
+def simple_data_filename():
+    return os.path.join(TEST_FILES, 'inputs', 'simple', 'initial.data')
+
+
+@pytest.fixture
+def simple_files(simple_data_filename):
+    """ Input files of the 8 atom test structure read by `energy_script` """
+    with open(simple_data_filename) as f:
+        return {'initial.data': f.read()}
+
+
+@pytest.fixture
+def energy_script():
+    """ Function returning a script evaluating energy and stress over `steps` """
+    def script(steps=0):
+        return ENERGY_SCRIPT.format(steps=steps)
+    return script
+
+
+@pytest.fixture
+def run_client():
+    """ Function creating `client` (with `create_args`), running `coroutine()` and closing the client """
+    def run(client, coroutine, *create_args, timeout=30):
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(client.create(*create_args))
+            return loop.run_until_complete(asyncio.wait_for(coroutine(), timeout))
+        finally:
+            client.shutdown()
+            loop.run_until_complete(asyncio.wait_for(client.wait_closed(), 30))
+    return run
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from pmg_lammps.calculator.accounting import (
+    RunningStats, directory_snapshot, process_tree, process_usage, written_bytes)
+
+
+def test_running_stats():
+    stats = RunningStats()
+    for value in [1.0, 2.0, 3.0, 4.0]:
+        stats.add(value)
+    assert stats.as_dict() == pytest.approx({'count': 4, 'mean': 2.5, 'std': 1.2909944, 'min': 1.0, 'max': 4.0, 'total': 10.0})
+
+
+def test_process_usage():
+    assert process_tree(os.getpid())[0] == os.getpid()
+    cpu_seconds, peak_rss_bytes = process_usage(os.getpid())
+    assert cpu_seconds > 0 and peak_rss_bytes > 0
+
+
+def test_written_bytes(tmp_path):
+    (tmp_path / 'input.data').write_text('input')
+    snapshot = directory_snapshot(str(tmp_path))
+    (tmp_path / 'lammps.log').write_text('x' * 100)
+    assert written_bytes(str(tmp_path), snapshot) == 100
@@ -0,0 +1,44 @@
+import pytest
+
+from pmg_lammps.calculator.affinity import parse_cpulist, cpu_layout, numa_node, thread_environment
+
+
+NODES = [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+
+def test_parse_cpulist():
+    assert parse_cpulist('0-3,8-9,12\n') == [0, 1, 2, 3, 8, 9, 12]
+    assert parse_cpulist('') == []
+
+
+def test_cpu_layout_compact():
+    assert cpu_layout([1, 1, 2], nodes=NODES) == [[0], [1], [2, 3]]
+    assert cpu_layout([2, 1], threads_per_rank=2, nodes=NODES) == [[0, 1, 2, 3], [4, 5]]
+
+
+def test_cpu_layout_spread():
+    assert cpu_layout([1, 1, 1, 1], layout='spread', nodes=NODES) == [[0], [4], [1], [5]]
+
+
+def test_cpu_layout_keeps_slots_on_one_node():
+    assert cpu_layout([1, 4], nodes=NODES) == [[0], [4, 5, 6, 7]]
+    # a slot wider than any node straddles nodes
+    assert cpu_layout([6], nodes=NODES) == [[0, 1, 2, 3, 4, 5]]
+    with pytest.raises(ValueError):
+        cpu_layout([8, 1], nodes=NODES)
+
+
+def test_numa_node():
+    assert numa_node([5, 6], nodes=NODES) == 1
+
+
+def test_thread_environment():
+    environment = thread_environment(2)
+    assert environment['OMP_NUM_THREADS'] == '2' and environment['MKL_NUM_THREADS'] == '2'
+    assert 'OMP_PROC_BIND' not in environment and 'OMP_PLACES' not in environment
+
+
+def test_thread_environment_pinned():
+    environment = thread_environment(2, pinned=True)
+    assert environment['OMP_NUM_THREADS'] == '2'
+    assert environment['OMP_PROC_BIND'] == 'true' and environment['OMP_PLACES'] == 'cores'
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from pmg_lammps.calculator.blobs import LammpsBlobStore, blob_key
+from pmg_lammps.calculator.process import write_files
+
+
+def test_blob_store_links_read_only_blobs(tmpdir):
+    store = LammpsBlobStore(str(tmpdir.join('blobs')))
+    key = blob_key('8 atoms\n')
+    assert store.missing([key]) == [key]
+    store.put(key, '8 atoms\n')
+    assert store.missing([key]) == [] and store.hits == 1 and store.misses == 1
+    assert os.stat(store.path(key)).st_mode & 0o777 == 0o444
+
+    directory = str(tmpdir.mkdir('job'))
+    write_files(directory, {'in.lammps': 'run 0'}, {'initial.data': store.path(key)})
+    assert os.path.samefile(os.path.join(directory, 'initial.data'), store.path(key))
+    # rewriting a linked filename replaces the link and leaves the blob intact
+    write_files(directory, {'initial.data': 'changed'})
+    with open(store.path(key)) as f:
+        assert f.read() == '8 atoms\n'
+
+    with pytest.raises(ValueError):
+        store.put(key, 'other content')
+
+
+def test_blob_store_eviction(tmpdir):
+    store = LammpsBlobStore(str(tmpdir), max_bytes=20)
+    keys = [blob_key(content) for content in ('a' * 10, 'b' * 10, 'c' * 10)]
+    store.put(keys[0], 'a' * 10)
+    store.acquire([keys[0]])
+    store.put(keys[1], 'b' * 10)
+    store.put(keys[2], 'c' * 10)
+    # pinned blob survives eviction of the least recently used blob
+    assert keys[0] in store and keys[1] not in store and keys[2] in store
+    store.release([keys[0]])
+    assert store.num_bytes == 20
+
+    reloaded = LammpsBlobStore(str(tmpdir), max_bytes=20)
+    assert len(reloaded) == 2 and reloaded.num_bytes == 20
@@ -0,0 +1,131 @@
+import os
+import asyncio
+
+from pmg_lammps.calculator import LammpsLocalClient, LammpsResultCache
+from pmg_lammps.calculator.cache import command_identity, job_key
+
+
+def test_job_key_canonical(simple_files, energy_script):
+    job = {'stdin': energy_script(), 'files': simple_files, 'properties': {'energy', 'stress'}}
+    same_job = {'stdin': '# comment\n' + energy_script().replace('  ', ' ') + '\n\n', 'files': dict(simple_files), 'properties': {'stress', 'energy'}}
+    assert job_key(job) == job_key(same_job)
+    assert job_key(job) != job_key(dict(job, stdin=energy_script().replace('run  0', 'run 1')))
+    assert job_key(job) != job_key(dict(job, files={'initial.data': simple_files['initial.data'] + '\n'}))
+    assert job_key(job) != job_key(dict(job, properties={'energy'}))
+    assert job_key(job) == job_key(dict(job, capture=None, timeout=None)) == job_key(dict(job, capture='all'))
+    assert job_key(job) != job_key(dict(job, capture='discard'))
+    assert job_key(job) != job_key(dict(job, capture=5))
+    assert job_key(job) != job_key(dict(job, timeout=10))
+    assert job_key(job, 'lmp_a') == job_key(job, 'lmp_a') != job_key(job, 'lmp_b')
+    assert job_key(job, 'lmp_a') != job_key(job)
+
+
+def test_command_identity(tmpdir):
+    binary = tmpdir.join('lmp_serial')
+    binary.write('build 1')
+    binary.chmod(0o755)
+    identity = command_identity(f'{binary} -sf omp')
+    assert identity.startswith(f'{binary} -sf omp') and str(binary) in identity.split('\n', 1)[1]
+    binary.write('rebuilt 2')
+    assert command_identity(f'{binary} -sf omp') != identity
+    assert command_identity('lmp_missing') == 'lmp_missing'
+
+
+def test_result_cache_lru_and_disk(tmpdir):
+    cache = LammpsResultCache(maxsize=2, directory=str(tmpdir), max_disk_bytes=10**6)
+    for key in 'abc':
+        cache.put(key, {'id': key, 'results': {'energy': 1.0}})
+    assert list(cache._memory) == ['b', 'c']
+    assert cache.get('a')['id'] == 'a'
+    assert cache.get('missing') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache = LammpsResultCache(maxsize=2, directory=str(tmpdir), max_disk_bytes=10**6)
+    assert len(cache) == 3 and cache.get('b')['id'] == 'b'
+
+    size = os.path.getsize(os.path.join(str(tmpdir), 'b.pickle'))
+    cache = LammpsResultCache(directory=str(tmpdir), max_disk_bytes=2 * size)
+    cache.put('d', {'id': 'd', 'results': {'energy': 1.0}})
+    assert 'b' in cache and 'd' in cache and 'c' not in cache
+
+    # written to disk in an executor and available from memory meanwhile
+    loop = asyncio.get_event_loop()
+    write = cache.put_async('e', {'id': 'e', 'results': {'energy': 1.0}})
+    assert cache.get('e')['id'] == 'e'
+    loop.run_until_complete(write)
+    assert LammpsResultCache(directory=str(tmpdir)).get('e')['id'] == 'e'
+
+
+def test_local_client_cache(tmpdir, mock_command, simple_files, energy_script, run_client):
+    cache = LammpsResultCache(directory=str(tmpdir))
+    client = LammpsLocalClient(command=mock_command, num_workers=1, cache=cache)
+
+    async def run():
+        first = await (await client.submit(energy_script(), simple_files, properties={'energy'}))
+        future = await client.submit(energy_script(), simple_files, properties={'energy'})
+        assert future.done()
+        return first, future.result()
+
+    first, second = run_client(client, run)
+    assert first['id'] != second['id'] and first['results'] == second['results']
+    assert cache.hits == 1
+
+    # results of another lammps command are not reused
+    cache = LammpsResultCache(directory=str(tmpdir))
+    client = LammpsLocalClient(command=mock_command + ' -mock-seed 1', num_workers=1, cache=cache)
+
+    async def run_other():
+        future = await client.submit(energy_script(), simple_files, properties={'energy'})
+        assert not future.done()
+        return await future
+
+    run_client(client, run_other)
+    assert cache.hits == 0 and len(cache) == 2
+
+
+def test_local_client_keys_jobs_by_capture(mock_command, simple_files, energy_script, run_client):
+    cache = LammpsResultCache()
+    client = LammpsLocalClient(command=mock_command, num_workers=1, cache=cache, deduplicate=True)
+
+    async def run():
+        # submitted together so that they would be coalesced
+        futures = [await client.submit(energy_script(), simple_files, properties={'energy'}, capture=capture) for capture in ('discard', None)]
+        outputs = await asyncio.gather(*futures)
+        cached = await client.submit(energy_script(), simple_files, properties={'energy'})
+        assert cached.done()
+        return outputs + [cached.result()]
+
+    discarded, full, cached = run_client(client, run)
+    assert discarded['stdout'] == b''
+    assert full['stdout'] and cached['stdout'] == full['stdout']
+    assert cache.hits == 1
+
+
+def test_local_client_survives_cache_errors(mock_command, simple_files, energy_script, run_client):
+    cache = LammpsResultCache()
+    client = LammpsLocalClient(command=mock_command, num_workers=1, cache=cache)
+
+    def put_async(key, result, executor=None):
+        raise OSError('disk full')
+    cache.put_async = put_async
+
+    async def run():
+        output = await (await client.submit(energy_script(), simple_files, properties={'energy'}))
+        cached = await client.submit(energy_script(), simple_files, properties={'energy'})
+        assert not cached.done()
+        return output, await cached
+
+    output, second = run_client(client, run)
+    assert output['results']['energy'] == second['results']['energy'] == -8.0
+
+
+def test_local_client_cached_results_are_copies(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, cache=LammpsResultCache())
+
+    async def run():
+        first = await (await client.submit(energy_script(), simple_files, properties={'energy'}))
+        first['results']['energy'] = 0.0
+        return await (await client.submit(energy_script(), simple_files, properties={'energy'}))
+
+    second = run_client(client, run)
+    assert second['results']['energy'] == -8.0
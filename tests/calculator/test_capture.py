@@ -0,0 +1,39 @@
+import pytest
+
+from pmg_lammps.calculator.capture import StdoutCapture, capture_mode
+
+
+def lines(num_lines):
+    return [f'line {i}\n'.encode() for i in range(num_lines)]
+
+
+def test_capture_mode():
+    assert capture_mode(None) == 'all' and capture_mode(10) == 10
+    for capture in [0, 'tail', True]:
+        with pytest.raises(ValueError):
+            capture_mode(capture)
+
+
+def test_capture_tail_and_discard():
+    tail, discard = StdoutCapture(3), StdoutCapture('discard')
+    for capture in [tail, discard]:
+        for line in lines(100):
+            capture.append(line)
+        capture.completed = True
+    assert tail.output() == b'line 97\nline 98\nline 99\n'
+    assert discard.output() == b''
+
+
+def test_capture_keeps_error_context(tmp_path):
+    filename = str(tmp_path / 'stdout' / 'job.stdout')
+    captures = [StdoutCapture('discard'), StdoutCapture(2), StdoutCapture('file', filename)]
+    for capture in captures:
+        for line in lines(100) + [b'ERROR: unknown command\n']:
+            capture.append(line)
+        capture.close()
+    for capture in captures:
+        output = capture.output()
+        assert output.endswith(b'line 99\nERROR: unknown command\n')
+        assert len(output.splitlines()) == StdoutCapture.ERROR_CONTEXT
+    with open(filename, 'rb') as f:
+        assert len(f.read().splitlines()) == 101
@@ -0,0 +1,222 @@
+import asyncio
+
+import numpy as np
+
+from pmg_lammps.calculator import LammpsLocalClient
+
+
+def test_local_client_deduplicates_inflight_jobs(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1)
+    submitted = []
+
+    async def _submit(lammps_job_input):
+        submitted.append(lammps_job_input['id'])
+        await LammpsLocalClient._submit(client, lammps_job_input)
+    client._submit = _submit
+
+    async def run():
+        futures = [await client.submit(energy_script(0), simple_files, properties={'energy'}) for _ in range(3)]
+        futures.append(await client.submit(energy_script(1), simple_files, properties={'energy'}))
+        return await asyncio.gather(*futures)
+
+    results = run_client(client, run)
+    assert len(submitted) == 2
+    assert results[0]['id'] == results[1]['id'] == results[2]['id'] == submitted[0]
+    assert all(_['results']['energy'] == -8.0 for _ in results)
+    results[0]['results']['energy'] = 0.0
+    assert results[1]['results']['energy'] == results[2]['results']['energy'] == -8.0
+    assert client._inflight_jobs == {}
+
+
+def test_local_client_copies_job_inputs(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1)
+    files, properties = dict(simple_files), {'energy'}
+
+    async def run():
+        futures = []
+        for num_atoms in (8, 16, 32):
+            # inputs are reused and changed while earlier jobs are queued
+            files['initial.data'] = simple_files['initial.data'].replace('8 atoms', f'{num_atoms} atoms')
+            futures.append(await client.submit(energy_script(0), files, properties=properties))
+        properties.add('stress')
+        return await asyncio.gather(*futures)
+
+    outputs = run_client(client, run)
+    assert [output['results']['energy'] for output in outputs] == [-8.0, -16.0, -32.0]
+    assert all(set(output['results']) == {'energy'} for output in outputs)
+
+
+def test_local_client_backpressure(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, deduplicate=False, max_pending_jobs=2)
+    max_pending = []
+
+    async def submit_jobs():
+        for steps in range(6):
+            yield await client.submit(energy_script(steps), simple_files, properties={'energy'})
+            max_pending.append(len(client.lammps_jobs))
+
+    async def run():
+        return [future.result() async for future in client.as_completed(submit_jobs())]
+
+    results = run_client(client, run)
+    assert len(results) == 6 and max(max_pending) == 2
+    assert client._pending_bytes == 0
+
+
+def test_local_client_as_completed_list(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1)
+
+    async def run():
+        futures = [await client.submit(energy_script(steps), simple_files, properties={'energy'}) for steps in range(3)]
+        return [future async for future in client.as_completed(futures)], futures
+
+    completed, futures = run_client(client, run)
+    assert set(completed) == set(futures)
+
+
+def test_local_client_map(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1)
+    jobs = [(energy_script(steps), simple_files, {'energy'}) for steps in range(4)]
+    jobs.append({'stdin': energy_script(10), 'files': simple_files, 'properties': {'energy'}})
+
+    async def run():
+        ordered = [_ async for _ in client.map(jobs, ordered=True)]
+        unordered = [_ async for _ in client.map(iter(jobs), chunksize=2)]
+        return ordered, unordered
+
+    ordered, unordered = run_client(client, run)
+    assert [index for index, _ in ordered] == list(range(5))
+    assert sorted(index for index, _ in unordered) == list(range(5))
+    assert all(output['results']['energy'] == -8.0 for _, output in ordered + unordered)
+
+
+def test_local_client_offloaded_parsing_timings(mock_command, simple_files, energy_script, run_client):
+    for parse_processes in (0, 1):
+        client = LammpsLocalClient(command=mock_command, num_workers=1, parse_processes=parse_processes)
+
+        async def run():
+            return await (await client.submit(energy_script(0), simple_files, properties={'energy'}))
+
+        output = run_client(client, run)
+        assert output['results']['energy'] == -8.0
+        assert set(output['timings']) == {'queue', 'write', 'execute', 'parse'}
+
+
+def test_local_client_results_are_arrays(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, parse_processes=0)
+
+    async def run():
+        return await (await client.submit(energy_script(0), simple_files, properties={'energy', 'stress'}))
+
+    output = run_client(client, run)
+    assert isinstance(output['results']['stress'], np.ndarray)
+    assert output['results']['stress'].shape == (3, 3)
+
+
+def test_local_client_timeout_restarts_process(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, parse_processes=0)
+
+    async def run():
+        hung = await (await client.submit('shell sleep 10', timeout=0.5))
+        output = await (await client.submit(energy_script(0), simple_files, properties={'energy'}))
+        return hung, output
+
+    hung, output = run_client(client, run)
+    assert 'timed out' in hung['error']
+    assert output['error'] is None and output['results']['energy'] == -8.0
+    metrics = client.metrics()
+    assert metrics['timeouts'] == 1 and metrics['restarts'] == 1
+
+
+def test_local_client_cancel_running_and_queued_jobs(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, parse_processes=0)
+
+    async def run():
+        running = await client.submit('shell sleep 10')
+        queued = await client.submit('shell sleep 10 # queued')
+        await asyncio.sleep(0.5)
+        queued.cancel()
+        running.cancel()
+        output = await (await client.submit(energy_script(0), simple_files, properties={'energy'}))
+        return running, queued, output
+
+    running, queued, output = run_client(client, run)
+    assert running.cancelled() and queued.cancelled()
+    assert output['results']['energy'] == -8.0 and not client.lammps_jobs
+    metrics = client.metrics()
+    assert metrics['cancelled'] == 1 and metrics['jobs'] == 2
+    # a job that already completed is not remembered as cancelled
+    client.pool.cancel(output['id'])
+    assert not client.pool._cancelled
+
+
+def test_local_client_script_error_and_crash(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, parse_processes=0)
+
+    async def run():
+        failed = await (await client.submit('error invalid command'))
+        process = client.pool._processes[0]
+        future = await client.submit('shell sleep 1\n' + energy_script(0), simple_files, properties={'energy'})
+        await asyncio.sleep(0.5)
+        process.process.kill()
+        # requeued job sleeps again so it is given time to finish
+        return failed, await future
+
+    failed, output = run_client(client, run)
+    assert failed['error'] == 'error executing script'
+    assert output['error'] is None and output['results']['energy'] == -8.0
+    assert client.metrics()['crashes'] == 1
+
+
+def test_local_client_stdout_capture(tmp_path, mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, parse_processes=0,
+                               stdout_directory=str(tmp_path), deduplicate=False)
+    verbose = ''.join(f'print "step {i}"\n' for i in range(100)) + energy_script(0)
+
+    async def run():
+        outputs = {}
+        for capture in [None, 5, 'discard', 'file']:
+            outputs[capture] = await (await client.submit(verbose, simple_files, properties={'energy'}, capture=capture))
+        failed = await (await client.submit(verbose + 'error invalid command', simple_files, capture='discard'))
+        return outputs, failed
+
+    outputs, failed = run_client(client, run)
+    assert all(output['results']['energy'] == -8.0 for output in outputs.values())
+    assert len(outputs[5]['stdout'].splitlines()) == 5
+    assert outputs['discard']['stdout'] == b''
+    assert outputs['file']['stdout'] == b''
+    with open(outputs['file']['stdout_file'], 'rb') as f:
+        assert f.read() == outputs[None]['stdout']
+    assert b'step 99' in outputs[None]['stdout']
+    assert b'ERROR' in failed['stdout'] and len(failed['stdout']) < len(outputs[None]['stdout'])
+
+
+def test_local_client_resource_accounting(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, parse_processes=0, deduplicate=False)
+
+    async def run():
+        futures = [await client.submit(energy_script(steps), simple_files, properties={'energy'}) for steps in range(3)]
+        return await asyncio.gather(*futures)
+
+    outputs = run_client(client, run)
+    for output in outputs:
+        assert set(output['timings']) == {'queue', 'write', 'execute', 'parse'}
+        assert output['resources']['cpu_seconds'] >= 0
+        assert output['resources']['peak_rss_bytes'] > 0
+        assert output['resources']['written_bytes'] > 0 # lammps.log
+    stats = client.resource_stats()
+    assert stats['execute']['count'] == 3 and stats['peak_rss_bytes']['max'] > 0
+    assert stats['queue']['max'] >= stats['queue']['min'] >= 0
+
+
+def test_local_client_performance_property(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, parse_processes=1)
+
+    async def run():
+        return await (await client.submit(energy_script(10), simple_files, properties={'performance'}))
+
+    output = run_client(client, run)
+    performance, = output['results']['performance']
+    assert performance['steps'] == 10 and performance['timesteps_per_second'] == 100000.0
+    assert set(performance['sections']) == {'Pair', 'Neigh', 'Comm', 'Output'}
+    assert performance['sections']['Pair']['percent'] == 60.0
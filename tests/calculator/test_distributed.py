@@ -0,0 +1,164 @@
+import asyncio
+import json
+import socket
+import time
+
+import pytest
+
+pytest.importorskip('zmq_legos')
+
+from pmg_lammps.calculator import LammpsMaster, LammpsWorker, LammpsDistributedClient, enable_tracing, disable_tracing
+
+
+def free_uri():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f'tcp://127.0.0.1:{s.getsockname()[1]}'
+
+
+def run_distributed(coroutine, command, num_workers=1, **kwargs):
+    """ Run a master, lammps workers and a client in one event loop """
+    loop = asyncio.get_event_loop()
+    stop_event = asyncio.Event()
+    uri = free_uri()
+    master = LammpsMaster(stop_event, uri, loop=loop)
+    workers = [
+        LammpsWorker(stop_event, uri, command=command, num_workers=1, parse_processes=0, loop=loop)
+        for _ in range(num_workers)
+    ]
+    client = LammpsDistributedClient(uri, loop=loop, **kwargs)
+
+    async def run():
+        tasks = [asyncio.ensure_future(master.mdp_scheduler.on_recv_message())]
+        for worker in workers:
+            await worker.create()
+            tasks.append(asyncio.ensure_future(worker.run()))
+        await client.create()
+        try:
+            return await asyncio.wait_for(coroutine(client, master, *workers), 30)
+        finally:
+            stop_event.set()
+            tasks += [service['task'] for service in master.mdp_scheduler.services.values() if service['task']]
+            for task in tasks + [client._completed_jobs_task]:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for worker in workers:
+                await worker.shutdown()
+                await worker.pool.wait_closed()
+            master.disconnect()
+
+    return loop.run_until_complete(run())
+
+
+def test_distributed_client_sends_files_once(mock_command, simple_files, energy_script):
+    sent_bytes = []
+
+    async def run(client, master, worker):
+        submit = client.mdp_client.submit
+
+        async def record_submit(service, frames):
+            sent_bytes.append(sum(len(frame) for frame in frames))
+            await submit(service, frames)
+
+        client.mdp_client.submit = record_submit
+        outputs = []
+        for steps in range(3):
+            outputs.append(await (await client.submit(energy_script(steps), simple_files, properties={'energy'})))
+        # worker lost its blobs (e.g. restarted) and fetches them again
+        for key in list(worker.blob_store._blobs):
+            worker.blob_store._num_bytes -= worker.blob_store._blobs.pop(key)
+        outputs.append(await (await client.submit(energy_script(3), simple_files, properties={'energy'})))
+        return outputs
+
+    outputs = run_distributed(run, mock_command, blob_threshold=64)
+    assert all(output['results']['energy'] == -8.0 for output in outputs)
+    assert len(sent_bytes) == 5
+    assert sent_bytes[1] < sent_bytes[0] - len(simple_files['initial.data']) / 2
+    assert sent_bytes[2] == sent_bytes[1]
+    assert sent_bytes[4] > sent_bytes[3]
+
+
+def test_scheduler_routes_jobs_to_workers_holding_files(mock_command, simple_files, energy_script):
+    async def run(client, master, *workers):
+        # wait for both workers to register with the master
+        while len(master.mdp_scheduler.workers) < 2:
+            await asyncio.sleep(0.01)
+        for steps in range(4):
+            output = await (await client.submit(energy_script(steps), simple_files, properties={'energy'}))
+            assert output['results']['energy'] == -8.0
+        return master.stats(), [len(worker.blob_store) for worker in workers]
+
+    stats, num_blobs = run_distributed(run, mock_command, num_workers=2, blob_threshold=64)
+    assert stats['affinity_hits'] == 3 and stats['affinity_misses'] == 1
+    assert sorted(num_blobs) == [0, 1]
+
+
+def test_scheduler_speculatively_reruns_stragglers(tmp_path, mock_command, simple_files, energy_script):
+    marker = tmp_path / 'slow'
+    # the first copy of the job is slow, e.g. stuck on an overloaded node
+    straggler = f'shell sh -c "test -e {marker} || (touch {marker} && sleep 10)"\n' + energy_script(0)
+
+    async def run(client, master, *workers):
+        scheduler = master.mdp_scheduler
+        scheduler.MONITOR_INTERVAL = 0.05
+        while len(scheduler.workers) < 2:
+            await asyncio.sleep(0.01)
+        for steps in range(3):
+            await (await client.submit(energy_script(steps), simple_files, properties={'energy'}))
+        start_time = time.perf_counter()
+        output = await (await client.submit(straggler, simple_files, properties={'energy'}))
+        elapsed = time.perf_counter() - start_time
+        # the slow copy is cancelled on its worker
+        while sum(worker.metrics()['cancelled'] for worker in workers) < 1:
+            await asyncio.sleep(0.05)
+        return output, elapsed, master.stats()
+
+    output, elapsed, stats = run_distributed(run, mock_command, num_workers=2)
+    assert output['error'] is None and output['results']['energy'] == -8.0
+    assert elapsed < 5
+    assert stats['speculative_copies'] == 1 and stats['speculative_wins'] == 1
+    assert stats['running'] == 0
+
+
+def test_scheduler_requeues_jobs_of_lost_workers(mock_command, simple_files, energy_script):
+    async def run(client, master, *workers):
+        scheduler = master.mdp_scheduler
+        scheduler.MONITOR_INTERVAL = 0.05
+        scheduler.heartbeat_timeout = 1.0
+        scheduler.speculate = False
+        for worker in workers:
+            worker.mdp_worker.heartbeat_interval = 0.1
+        while len(scheduler.workers) < 2:
+            await asyncio.sleep(0.01)
+
+        async def silent(frames):
+            pass
+
+        # the first worker loses its connection to the master
+        workers[0].mdp_worker.socket.send_multipart = silent
+        futures = [await client.submit(energy_script(steps), simple_files, properties={'energy'}) for steps in range(2)]
+        return await asyncio.gather(*futures), master.stats()
+
+    outputs, stats = run_distributed(run, mock_command, num_workers=2)
+    assert all(output['results']['energy'] == -8.0 for output in outputs)
+    assert stats['lost_workers'] == 1
+
+
+def test_distributed_job_stages_are_traced(tmp_path, mock_command, simple_files, energy_script):
+    filename = str(tmp_path / 'trace.json')
+    enable_tracing(filename)
+
+    async def run(client, master, worker):
+        return await (await client.submit(energy_script(0), simple_files, properties={'energy'}))
+
+    try:
+        output = run_distributed(run, mock_command)
+    finally:
+        disable_tracing()
+
+    with open(filename) as f:
+        events = json.load(f)['traceEvents']
+    names = {event['name'] for event in events if event['ph'] == 'b' and event['id'] == output['id']}
+    assert names == {
+        'client.serialize', 'master.queue', 'worker.deserialize', 'process.queue', 'process.write',
+        'process.execute', 'process.parse', 'worker.serialize', 'master.dispatch', 'client.deserialize', 'client.roundtrip'}
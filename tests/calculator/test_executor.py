@@ -0,0 +1,38 @@
+import concurrent.futures
+
+import pytest
+
+from pmg_lammps.calculator import LammpsExecutor
+
+
+script = [
+    ('log', 'lammps.log'),
+    ('read_data', 'initial.data'),
+    ('thermo_style', 'custom step etotal pxx pyy pzz pxy pxz pyz'),
+    ('run', 0)
+]
+
+
+def test_lammps_executor(mock_command, simple_files):
+    with LammpsExecutor(command=mock_command, num_workers=1, max_pending_jobs=2) as executor:
+        assert isinstance(executor, concurrent.futures.Executor)
+        future = executor.submit(script, simple_files, {'energy'})
+        outputs = list(executor.map([script] * 5, [simple_files] * 5, [{'stress'}] * 5, chunksize=2))
+        assert future.result(timeout=30)['results']['energy'] == -8.0
+    assert len(outputs) == 5 and all('stress' in _['results'] for _ in outputs)
+    with pytest.raises(RuntimeError):
+        executor.submit(script, simple_files)
+
+
+def test_lammps_executor_callables(mock_command, simple_files):
+    def make_job(num_atoms, properties=frozenset({'energy'})):
+        files = {'initial.data': simple_files['initial.data'].replace('8 atoms', f'{num_atoms} atoms')}
+        return {'stdin': script, 'files': files, 'properties': set(properties)}
+
+    with LammpsExecutor(command=mock_command, num_workers=1) as executor:
+        future = executor.submit(make_job, 16, properties={'energy', 'stress'})
+        outputs = list(executor.map(make_job, [8, 32], chunksize=2))
+        assert set(future.result(timeout=30)['results']) == {'energy', 'stress'}
+        with pytest.raises(TypeError):
+            executor.submit(make_job)
+    assert [_['results']['energy'] for _ in outputs] == [-8.0, -32.0]
@@ -0,0 +1,53 @@
+import asyncio
+
+import numpy as np
+
+from pmg_lammps.calculator import LammpsLocalClient
+from pmg_lammps.calculator.mock import mock_command
+
+
+script = """
+log  lammps.log
+read_data  initial.data
+thermo_style  custom step etotal pxx pyy pzz pxy pxz pyz
+thermo  5
+dump  1 all custom 5 mol.lammpstrj id type x y z fx fy fz
+run  10
+"""
+
+
+def run_jobs(run_client, client, files, num_jobs, properties={'energy'}):
+    async def run():
+        futures = [await client.submit(script, files, properties=properties) for _ in range(num_jobs)]
+        return await asyncio.gather(*futures)
+
+    return run_client(client, run)
+
+
+def test_mock_synthetic_outputs(simple_files, run_client):
+    client = LammpsLocalClient(command=mock_command(), num_workers=1)
+    output, = run_jobs(run_client, client, simple_files, 1, properties={'energy', 'positions', 'forces', 'performance'})
+    lattice = 4.1990858
+    assert output['results']['energy'] == -8.0
+    assert output['results']['positions'].shape == (8, 3)
+    assert np.all((output['results']['positions'] >= 0) & (output['results']['positions'] <= lattice))
+    assert np.all(output['results']['forces'] == 0)
+    assert output['results']['performance'][0]['steps'] == 10
+
+
+def test_mock_delay(simple_files, run_client):
+    client = LammpsLocalClient(command=mock_command(delay=0.1, step_delay=0.01), num_workers=1, deduplicate=False)
+    outputs = run_jobs(run_client, client, simple_files, 2)
+    assert all(_['timings']['execute'] >= 0.2 for _ in outputs)
+
+
+def test_mock_error_injection(simple_files, run_client):
+    client = LammpsLocalClient(command=mock_command(error_rate=1.0), num_workers=1)
+    output, = run_jobs(run_client, client, simple_files, 1)
+    assert output['error'] == 'error executing script'
+    assert 'mock injected error' in output['stdout'].decode()
+
+    client = LammpsLocalClient(command=mock_command(crash_rate=1.0), num_workers=1)
+    output, = run_jobs(run_client, client, simple_files, 1)
+    assert output['error'] is not None
+    assert client.metrics()['crashes'] >= 1
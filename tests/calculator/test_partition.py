@@ -0,0 +1,91 @@
+import asyncio
+import uuid
+
+import pytest
+
+from pmg_lammps.calculator import LammpsLocalClient
+from pmg_lammps.calculator.partition import LammpsPartitionProcess, parse_partitions
+
+
+script = """
+log  lammps.log
+units  metal
+read_data  initial.data
+dump  1 all custom 1 mol.lammpstrj id type x y z fx fy fz
+thermo_style  custom step etotal pxx pyy pzz pxy pxz pyz
+run  0
+"""
+
+
+def test_parse_partitions():
+    assert parse_partitions('4x16') == [16] * 4
+    assert parse_partitions('2x8 4x1') == [8, 8, 1, 1, 1, 1]
+    assert parse_partitions(['4']) == [4]
+    with pytest.raises(ValueError):
+        parse_partitions('')
+
+
+def test_partition_process_requeues_after_error(mock_command, simple_files, run_client):
+    process = LammpsPartitionProcess(command=mock_command, partitions='2x1', mpirun=None)
+    pending_queue, completed_queue = asyncio.Queue(), asyncio.Queue()
+
+    async def run():
+        jobs = [script] * 3 + ['error deliberate failure\n'] + [script] * 3
+        for stdin in jobs:
+            job = {'id': uuid.uuid4().hex, 'stdin': stdin, 'files': simple_files, 'properties': {'energy', 'forces'}}
+            await pending_queue.put((b'client_id', job))
+        return [(await completed_queue.get())[1] for _ in jobs]
+
+    results = run_client(process, run, {1: pending_queue}, completed_queue)
+    errors = [_ for _ in results if _['error']]
+    assert len(errors) == 1 and b'ERROR' in errors[0]['stdout']
+    completed = [_ for _ in results if not _['error']]
+    assert len(completed) == 6
+    num_atoms = len(completed[0]['results']['forces'])
+    assert all(_['results']['energy'] == -1.0 * num_atoms for _ in completed)
+
+
+def test_local_client_partitions(mock_command, simple_files, run_client):
+    client = LammpsLocalClient(command=mock_command, partitions='1x1', mpirun=None)
+
+    async def run():
+        futures = [await client.submit(script, simple_files, properties={'energy'}) for _ in range(4)]
+        return await asyncio.gather(*futures)
+
+    results = run_client(client, run)
+    assert all(_['error'] is None and 'energy' in _['results'] for _ in results)
+
+
+def test_partition_process_timeout(mock_command, simple_files, run_client):
+    process = LammpsPartitionProcess(command=mock_command, partitions='2x1', mpirun=None)
+    pending_queue, completed_queue = asyncio.Queue(), asyncio.Queue()
+
+    async def run():
+        jobs = [('shell sleep 10\n', 0.5)] + [(script, None)] * 3
+        for stdin, timeout in jobs:
+            job = {'id': uuid.uuid4().hex, 'stdin': stdin, 'files': simple_files, 'properties': {'energy'}, 'timeout': timeout}
+            await pending_queue.put((b'client_id', job))
+        return [(await completed_queue.get())[1] for _ in jobs]
+
+    results = run_client(process, run, {1: pending_queue}, completed_queue)
+    errors = [_ for _ in results if _['error']]
+    assert len(errors) == 1 and 'timed out' in errors[0]['error']
+    assert process.metrics['timeouts'] == 1
+
+
+def test_partition_process_cancel_while_restarting(mock_command, simple_files, run_client):
+    process = LammpsPartitionProcess(command=mock_command, partitions='1x1', mpirun=None)
+    pending_queue, completed_queue = asyncio.Queue(), asyncio.Queue()
+
+    async def run():
+        process._running.clear() # as while lammps restarts
+        job = {'id': uuid.uuid4().hex, 'stdin': script, 'files': simple_files, 'properties': {'energy'}}
+        await pending_queue.put((b'client_id', job))
+        while not process._waiting_jobs:
+            await asyncio.sleep(0.01)
+        assert process.cancel(job['id'])
+        process._running.set()
+        return (await completed_queue.get())[1]
+
+    output = run_client(process, run, {1: pending_queue}, completed_queue)
+    assert output['error'] == 'lammps job cancelled' and not process.cancelled
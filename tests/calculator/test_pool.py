@@ -0,0 +1,88 @@
+import os
+import asyncio
+
+from pmg_lammps.calculator import LammpsLocalClient
+from pmg_lammps.calculator.pool import LammpsPool, job_num_atoms
+from pmg_lammps.calculator.affinity import cpu_layout, numa_node
+
+
+def test_job_num_atoms(simple_files, energy_script):
+    assert job_num_atoms({'stdin': energy_script(), 'files': simple_files}) == 8
+    assert job_num_atoms({'stdin': 'run 0', 'files': simple_files}) is None
+
+
+def test_pool_routing(monkeypatch, mock_command, simple_files, energy_script):
+    monkeypatch.setattr('multiprocessing.cpu_count', lambda: 32)
+    pool = LammpsPool(command=mock_command, slots='4x1 2x8', atoms_per_rank=100)
+    assert pool.num_slots == 6 and pool.num_ranks == 20
+    assert pool.route({'stdin': energy_script(), 'files': simple_files}) == 1
+    assert pool.route({'stdin': energy_script(), 'files': simple_files, 'cost_hint': 799}) == 1
+    assert pool.route({'stdin': energy_script(), 'files': simple_files, 'cost_hint': 800}) == 8
+    assert pool.route({'stdin': 'run 0', 'files': {}}) == 1
+
+
+def test_local_client_slots(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, slots='1x1')
+
+    async def run():
+        futures = [await client.submit(energy_script(), simple_files, properties={'energy', 'stress'}) for _ in range(4)]
+        return await asyncio.gather(*futures)
+
+    results = run_client(client, run)
+    assert all(_['results']['energy'] == -8.0 for _ in results)
+
+
+def test_pool_autoscaling(monkeypatch, mock_command, simple_files, energy_script, run_client):
+    monkeypatch.setattr('multiprocessing.cpu_count', lambda: 4)
+    client = LammpsLocalClient(command=mock_command, slots='2x1', min_workers=0, idle_timeout=0.3,
+                               parse_processes=0, deduplicate=False)
+
+    async def run():
+        assert client.metrics()['processes'] == 0
+        futures = [await client.submit('shell sleep 0.3\n' + energy_script(), simple_files) for _ in range(4)]
+        assert client.metrics()['processes'] >= 1
+        outputs = await asyncio.gather(*futures)
+        busy = client.metrics()['processes']
+        await asyncio.sleep(1.0)
+        return outputs, busy, client.metrics()
+
+    outputs, busy, metrics = run_client(client, run)
+    assert all(_['error'] is None for _ in outputs)
+    assert busy == 2
+    assert metrics['processes'] == 0 and metrics['jobs'] == 4
+
+
+def test_pool_pinning(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, pin='compact', threads_per_rank=1,
+                               deduplicate=False)
+
+    async def run():
+        future = await client.submit('shell printenv OMP_NUM_THREADS OMP_PLACES\n' + energy_script(), simple_files, properties={'energy'})
+        return await future
+
+    output = run_client(client, run)
+    assert output['error'] is None
+    # the first cpus of the affinity mask and numa layout of this host
+    cpus, = cpu_layout([1], threads_per_rank=1, layout='compact')
+    assert output['placement'] == {'cpus': cpus, 'numa_node': numa_node(cpus), 'ranks': 1, 'threads': 1}
+    assert set(cpus) <= os.sched_getaffinity(0)
+    assert b'1\ncores\n' in output['stdout']
+
+
+def test_pool_shutdown_parse_processes(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, parse_processes=1)
+    waited = []
+
+    def shutdown():
+        LammpsLocalClient.shutdown(client)
+        # the parse processes are waited for off the loop in wait_closed
+        waited.append(client.pool._parse_shutdown.done())
+    client.shutdown = shutdown
+
+    async def run():
+        return await (await client.submit(energy_script(), simple_files, properties={'energy'}))
+
+    output = run_client(client, run)
+    assert output['results']['energy'] == -8.0
+    assert waited == [False]
+    assert client.pool._parse_shutdown.done() and client.pool._parse_shutdown.exception() is None
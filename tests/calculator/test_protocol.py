@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from pmg_lammps.calculator.protocol import encode, decode
+
+
+def test_protocol_roundtrip():
+    forces = np.random.random((100, 3))
+    message = {
+        'id': 'abc', 'stdout': b'lammps output', 'error': None,
+        'properties': {'forces', 'energy'},
+        'results': {'energy': np.float64(-8.0), 'forces': forces, 'types': np.arange(4, dtype='>i4')},
+        'timings': {'execute': 0.1},
+    }
+    frames = encode(message)
+    assert len(frames) == 4
+    decoded = decode(frames)
+    assert decoded['id'] == 'abc' and decoded['stdout'] == b'lammps output' and decoded['error'] is None
+    assert decoded['properties'] == {'forces', 'energy'}
+    assert decoded['results']['energy'] == -8.0
+    assert np.array_equal(decoded['results']['forces'], forces)
+    assert decoded['results']['types'].tolist() == [0, 1, 2, 3]
+    assert decoded['results']['types'].dtype.str == '<i4'
+
+
+def test_protocol_arrays_reference_frames():
+    frames = [bytes(frame) for frame in encode({'forces': np.ones((10, 3))})]
+    forces = decode(frames)['forces']
+    assert not forces.flags.writeable
+    assert forces.base.base is frames[1]
+
+
+def test_protocol_compression():
+    message = {'forces': np.zeros((1000, 3))}
+    assert len(encode(message)[1]) == 1000 * 3 * 8
+    frames = encode(message, compress_threshold=1024)
+    assert len(frames[1]) < 1024
+    assert np.array_equal(decode(frames)['forces'], message['forces'])
+
+
+def test_protocol_unsupported_type():
+    with pytest.raises(ValueError):
+        encode({'structure': object()})
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from pmg_lammps.calculator import LammpsLocalClient
+from pmg_lammps.calculator.scheduling import LammpsJobQueue, RuntimeHistory, script_template
+
+
+def job(name, stdin='run 0', **kwargs):
+    return (b'client_id', dict({'id': name, 'stdin': stdin}, **kwargs))
+
+
+def drain(queue):
+    return [queue.get_nowait()[1]['id'] for _ in range(queue.qsize())]
+
+
+def test_script_template():
+    assert script_template('velocity all create 300.0 42  # seed\nrun 1000') == script_template('velocity all create 10 7\nrun 1000')
+    assert script_template('velocity all create 300.0 42\nrun 0') != script_template('velocity all create 300.0 42\nrun 100000')
+    assert script_template('minimize 0 1e-8 100 1000') == script_template('minimize 1e-4 1e-6 100 1000')
+    assert script_template('minimize 0 1e-8 100 1000') != script_template('minimize 0 1e-8 10000 100000')
+    assert script_template('run 10') != script_template('minimize 0 1e-8 100 1000')
+
+
+def test_runtime_history():
+    history = RuntimeHistory()
+    assert history.estimate('run 10') is None
+    history.record('velocity all create 300 1\nrun 10', 100, 2.0)
+    assert history.estimate('velocity all create 500 2\nrun 10', 200) == pytest.approx(4.0)
+    assert history.estimate('velocity all create 500 2\nrun 10') == pytest.approx(2.0)
+    assert history.estimate('velocity all create 500 2\nrun 1000', 200) == pytest.approx(2.0)
+    assert history.estimate('minimize 0 0 1 1') == pytest.approx(2.0)
+
+
+def test_queue_priority_classes():
+    queue = LammpsJobQueue()
+    queue.put_nowait(job('low', priority='low'))
+    queue.put_nowait(job('normal'))
+    queue.put_nowait(job('high', priority='high'))
+    queue.put_nowait(job('urgent', priority=-1))
+    assert drain(queue) == ['urgent', 'high', 'normal', 'low']
+    stats = queue.stats()
+    assert stats['high']['jobs'] == 1 and stats['low']['queued'] == 0
+    with pytest.raises(ValueError):
+        queue.put_nowait(job('unknown', priority='highest'))
+
+
+def test_queue_shortest_job_first():
+    history = RuntimeHistory()
+    history.record('fix 1 all npt temp 300 300 0.1 iso 0 0 1\nrun 100000', None, 60.0)
+    history.record('run 0', None, 0.1)
+    queue = LammpsJobQueue(history=history)
+    queue.put_nowait(job('npt', 'fix 1 all npt temp 500 500 0.1 iso 1 1 1\nrun 100000'))
+    queue.put_nowait(job('unknown', 'minimize 0 0 10 10'))
+    queue.put_nowait(job('energy', 'run 0'))
+    # unseen templates are estimated with the mean runtime
+    assert drain(queue) == ['energy', 'unknown', 'npt']
+
+
+def test_queue_contains_job_ids():
+    queue = LammpsJobQueue()
+    queue.put_nowait(job('a'))
+    assert 'a' in queue and 'b' not in queue
+    queue.get_nowait()
+    assert 'a' not in queue
+
+
+def test_queue_fair_share():
+    queue = LammpsJobQueue(shares={'b': 2})
+    for i in range(4):
+        queue.put_nowait(job(f'a{i}', submitter='a'))
+    for i in range(4):
+        queue.put_nowait(job(f'b{i}', submitter='b'))
+    assert drain(queue) == ['a0', 'b0', 'b1', 'a1', 'b2', 'b3', 'a2', 'a3']
+
+
+def test_local_client_priority(mock_command, simple_files, energy_script, run_client):
+    client = LammpsLocalClient(command=mock_command, num_workers=1, deduplicate=False)
+
+    async def run():
+        completed = []
+        futures = [await client.submit('shell sleep 0.3\n' + energy_script(), simple_files)]
+        for priority in ['low', 'normal', 'high']:
+            future = await client.submit(energy_script(), simple_files, priority=priority)
+            future.add_done_callback(lambda future, priority=priority: completed.append(priority))
+            futures.append(future)
+        await asyncio.gather(*futures)
+        return completed, client.queue_stats()
+
+    completed, stats = run_client(client, run)
+    assert completed == ['high', 'normal', 'low']
+    assert stats['low']['mean_wait'] > stats['high']['mean_wait']
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+from pmg_lammps.calculator import LammpsLocalClient, enable_tracing, disable_tracing, merge_traces
+from pmg_lammps.calculator.tracing import Tracer, tracer
+
+
+def spans(trace):
+    """ `{(name, job): (start, end)}` of the async events of a trace """
+    begins, result = {}, {}
+    for event in trace['traceEvents']:
+        if event['ph'] == 'b':
+            begins[(event['name'], event['id'])] = event['ts']
+        elif event['ph'] == 'e':
+            result[(event['name'], event['id'])] = (begins[(event['name'], event['id'])], event['ts'])
+    return result
+
+
+def test_tracer_disabled_by_default():
+    tracer().add('process.write', 'job', 0.0, 1.0)
+    assert not tracer().enabled
+    assert tracer().events == []
+
+
+def test_tracer_span(tmpdir):
+    filename = str(tmpdir.join('trace.json'))
+    trace = Tracer(filename, process_name='test')
+    with trace.span('client.serialize', 'a', size=3):
+        pass
+    trace.add_duration('process.execute', 'b', 2.0)
+    trace.save()
+
+    with open(filename) as f:
+        data = json.load(f)
+    assert data['traceEvents'][0]['args']['name'] == 'test'
+    assert data['traceEvents'][1]['args'] == {'job': 'a', 'size': 3}
+    start, end = spans(data)[('process.execute', 'b')]
+    assert abs((end - start) - 2e6) < 1
+
+    merge_traces([filename, filename], str(tmpdir.join('merged.json')))
+    with open(str(tmpdir.join('merged.json'))) as f:
+        assert len(json.load(f)['traceEvents']) == 2 * len(data['traceEvents'])
+
+
+def test_local_client_traces_job_stages(tmpdir, mock_command, simple_files, energy_script, run_client):
+    filename = str(tmpdir.join('trace.json'))
+    enable_tracing(filename)
+    client = LammpsLocalClient(command=mock_command, num_workers=1)
+
+    async def run():
+        futures = [await client.submit(energy_script(steps), simple_files, properties={'energy'}) for steps in range(2)]
+        return await asyncio.gather(*futures)
+
+    try:
+        outputs = run_client(client, run)
+    finally:
+        disable_tracing()
+
+    with open(filename) as f:
+        trace = spans(json.load(f))
+    for output in outputs:
+        stages = [trace[(f'process.{stage}', output['id'])] for stage in ('queue', 'write', 'execute', 'parse')]
+        for (start, end), (next_start, _) in zip(stages, stages[1:]):
+            assert start <= end <= next_start + 1e3
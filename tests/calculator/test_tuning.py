@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import pytest
+
+from pmg_lammps.inputs import LammpsData, LammpsInput, LammpsScript
+from pmg_lammps.calculator import LammpsLocalClient, LammpsPoolTuner, LammpsSettingsTuner
+from pmg_lammps.calculator.config import load_pool_config, write_pool_config
+from pmg_lammps.calculator.tuning import fit_scalability, predict_throughput, setting_variants, short_script
+
+
+lammps_script = LammpsScript([
+    ('log', 'lammps.log'),
+    ('read_data', 'initial.data'),
+    ('kspace_style', 'pppm 1e-05'),
+    ('neighbor', '2.0 bin'),
+    ('thermo_style', 'custom step etotal'),
+    ('thermo', 1000),
+    ('restart', '5000 current.restart'),
+    ('minimize', '1.0e-10 1.0e-10 2000 100000'),
+])
+
+
+def test_short_script():
+    script = short_script(lammps_script, 50)
+    assert script['minimize'] == '1.0e-10 1.0e-10 50 500'
+    assert script['restart'] == []
+    assert lammps_script['minimize'] == '1.0e-10 1.0e-10 2000 100000'
+
+
+def test_setting_variants():
+    variants = setting_variants(lammps_script)
+    assert variants['neighbor'] == ['2.0 bin', '1 bin', '1.5 bin', '3 bin']
+    assert variants['kspace_style'] == ['pppm 1e-05', 'pppm 0.0001', 'pppm 0.001']
+    assert variants['kspace_modify'][0] == []
+    assert variants['thermo'] == [1000, 2000, 10000]
+
+
+def test_settings_tuner(mock_command, simple_data_filename, run_client):
+    lammps_input = LammpsInput(lammps_script, LammpsData.from_file(simple_data_filename))
+    client = LammpsLocalClient(command=mock_command, num_workers=1)
+    tuner = LammpsSettingsTuner(client, steps=10, tolerance=0.01)
+    tuning = run_client(client, lambda: tuner.tune(lammps_input), timeout=60)
+
+    # the mock engine is fastest with a skin of 1.0, pppm 0.001 shifts the energy by 0.1
+    assert tuning['settings'] == {'neighbor': '1 bin', 'kspace_style': 'pppm 0.0001'}
+    assert tuning['speedup'] > 3
+    rejected, = [_ for _ in tuning['trials'] if not _['accepted']]
+    assert rejected['settings']['kspace_style'] == 'pppm 0.001' and rejected['error'] is None
+    assert all(_['performance'][0]['steps'] == 10 for _ in tuning['trials'])
+
+
+def test_fit_scalability():
+    model = (10.0, 0.1, 0.01)
+    num_workers = [1, 2, 4, 8, 16]
+    assert fit_scalability(num_workers, [predict_throughput(model, n) for n in num_workers]) == pytest.approx(model)
+    assert fit_scalability([1], [5.0]) == (5.0, 0.0, 0.0)
+
+
+def test_pool_tuner_config(tmp_path, mock_command, simple_files):
+    filename = str(tmp_path / 'pool.json')
+    with open(filename, 'w') as f:
+        json.dump({'master': 'tcp://localhost:8555'}, f)
+
+    tuner = LammpsPoolTuner(command=mock_command, max_cpus=1, jobs_per_worker=2)
+    config = asyncio.get_event_loop().run_until_complete(
+        tuner.tune(str(short_script(lammps_script, 10)), simple_files, {'energy'}))
+    assert config['slots'] == '1x1' and config['threads_per_rank'] == 1
+    assert config['throughput'] > 0 and len(config['measurements']) == 1
+
+    write_pool_config(filename, config)
+    assert load_pool_config(filename) == {'slots': '1x1', 'threads_per_rank': 1, 'command': mock_command}
+    with open(filename) as f:
+        assert json.load(f)['master'] == 'tcp://localhost:8555'
+    client = LammpsLocalClient.from_config(filename, deduplicate=False)
+    assert client.num_workers == 1 and client.pool.command == mock_command
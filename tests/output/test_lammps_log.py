@@ -14,3 +14,24 @@ def test_lammps_log_multiple_runs():
 def test_lammps_log_normal():
     log = LammpsLog('test_files/logs/normal.log')
     assert len(log.thermo_data) == 2
+
+
+def test_lammps_log_performance():
+    log = LammpsLog('test_files/logs/normal.log')
+    assert len(log.performance) == 1
+    performance = log.get_performance(-1)
+    assert performance['steps'] == 20 and performance['mpi_tasks'] == 1
+    assert performance['timesteps_per_second'] == 726.597
+    assert performance['sections']['Kspace'] == {'min': 0.0051187, 'avg': 0.0051187, 'max': 0.0051187, 'varavg': 0.0, 'percent': 18.60}
+    assert performance['sections']['Other']['min'] is None
+    assert performance['distribution']['nghost'] == {'ave': 2189.0, 'max': 2189.0, 'min': 2189.0}
+    assert performance['neighbors'] == {'total': 3000, 'per_atom': 375.0, 'special_per_atom': 0.0, 'builds': 0, 'dangerous_builds': 0}
+
+
+def test_lammps_log_performance_old_format():
+    log = LammpsLog('test_files/logs/couple.log')
+    assert len(log.performance) == 20
+    performance = log.performance[0]
+    assert performance['sections']['Output'] == {'min': None, 'avg': 0.00396585, 'max': None, 'varavg': None, 'percent': 11.0574}
+    assert performance['timesteps_per_second'] == 10 / 0.035866
+    assert performance['neighbors']['builds'] == 3
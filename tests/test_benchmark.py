@@ -0,0 +1,71 @@
+import pytest
+
+from pmg_lammps.benchmark import (
+    BENCHMARKS, SkipBenchmark, benchmark, compare, run_benchmark, run_suite)
+
+
+def test_run_benchmark():
+    result = run_benchmark('dump.parse', repeats=3, atoms=10, frames=2)
+    assert result['params'] == {'atoms': 10, 'frames': 2}
+    assert result['latency']['min'] <= result['latency']['p50'] <= result['latency']['p99'] <= result['latency']['max']
+    assert result['throughput'] > 0
+    with pytest.raises(ValueError):
+        run_benchmark('dump.parse', size=10)
+
+
+def test_run_suite_parameter_grid():
+    results = run_suite(['log.parse', 'data.write'], params={'rows': [10, 20], 'atoms': 8}, repeats=2)
+    assert list(results['benchmarks']) == [
+        'log.parse[rows=10,runs=1]', 'log.parse[rows=20,runs=1]', 'data.write[atoms=8]']
+
+
+def test_benchmark_cleanup_and_skip():
+    events = []
+
+    @benchmark('test.cleanup', value=1)
+    def cleanup(directory, value):
+        try:
+            yield lambda: {'items': value, 'extra': 0.5}
+        finally:
+            events.append('cleanup')
+
+    @benchmark('test.skip')
+    def skip(directory):
+        raise SkipBenchmark('not here')
+        yield
+
+    @benchmark('test.broken')
+    def broken(directory):
+        raise ImportError('broken package')
+        yield
+
+    try:
+        result = run_benchmark('test.cleanup', repeats=2, value=3)
+        assert events == ['cleanup']
+        assert result['metrics']['extra']['p50'] == 0.5
+        assert run_benchmark('test.skip')['skipped'] == 'not here'
+        with pytest.raises(ImportError):
+            run_benchmark('test.broken')
+    finally:
+        del BENCHMARKS['test.cleanup'], BENCHMARKS['test.skip'], BENCHMARKS['test.broken']
+
+
+def test_compare_baseline():
+    def results(p50):
+        return {'benchmarks': {'dump.parse[atoms=10]': {'latency': {'p50': p50}}}}
+    assert compare(results(1.05), results(1.0), threshold=0.1) == []
+    regression, = compare(results(1.2), results(1.0), threshold=0.1)
+    assert regression['name'] == 'dump.parse[atoms=10]' and regression['change'] == pytest.approx(0.2)
+
+    skipped = {'benchmarks': {'dump.parse[atoms=10]': {'skipped': 'not here'}}}
+    regression, = compare(skipped, results(1.0))
+    assert regression['latency'] is None and regression['reason'] == 'skipped: not here'
+    regression, = compare({'benchmarks': {}}, results(1.0))
+    assert regression['reason'] == 'missing'
+    assert compare(results(1.0), skipped) == []
+
+
+def test_calculator_benchmark_with_mock():
+    result = run_benchmark('calculator.throughput', repeats=1, warmup=0, jobs=4, error_rate=1.0)
+    assert result['metrics']['errors']['max'] == 4
+    assert result['throughput'] > 0
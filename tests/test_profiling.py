@@ -0,0 +1,28 @@
+import time
+
+from pmg_lammps.profiling import SamplingProfiler
+
+
+def busy_function(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampling_profiler(tmpdir):
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    busy_function(0.2)
+    profiler.stop()
+
+    assert profiler.samples > 0
+    names = [name for name, _, _ in profiler.top()]
+    assert any(name.startswith('busy_function') for name in names)
+    assert 'busy_function' in profiler.report()
+
+    filename = str(tmpdir.join('profile.txt'))
+    profiler.save(filename)
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == sum(profiler.stacks.values())
+    assert any('test_sampling_profiler' in line and 'busy_function' in line for line in lines)